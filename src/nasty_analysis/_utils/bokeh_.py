@@ -14,14 +14,19 @@
 # limitations under the License.
 #
 
-from datetime import date, timedelta, timezone
-from typing import Mapping, Optional
+from datetime import date, datetime, timedelta, timezone
+from typing import Mapping, Optional, Sequence
 
+import numpy as np
 from bokeh.application.application import Application, ServerContext
 from bokeh.application.handlers import Handler
-from bokeh.models import CustomJS, Range1d
+from bokeh.models import ColumnDataSource, CustomJS, Range1d
 from nasty_utils import date_to_timestamp
 from overrides import overrides
+from typing_extensions import Final
+
+# Patches are sent as JSON, so only use them if few values changed.
+_MAX_PATCH_FRACTION: Final[float] = 0.1
 
 
 class ParameterPassingApplication(Application):
@@ -96,3 +101,66 @@ def bounded_date_range1d(
     if min_interval:
         min_interval = min_interval.total_seconds() * 1000
     return bounded_range1d(start, end, min_interval)
+
+
+def datetime64_array(datetimes: Sequence[datetime]) -> np.ndarray:
+    # Bokeh sends datetime64 arrays as binary buffers of milliseconds since epoch.
+    return np.array(
+        [int(t.timestamp() * 1000) for t in datetimes], dtype="datetime64[ms]"
+    )
+
+
+def update_column_data_source(
+    source: ColumnDataSource, new_data: Mapping[str, object]
+) -> None:
+    # Numeric NumPy arrays (except 64-bit integers) are sent as binary buffers instead
+    # of JSON lists. If the new data only appends to or changes few values of the
+    # current data, only that part is sent via stream() or patch().
+    old_data = source.data
+    if set(old_data.keys()) != set(new_data.keys()) or not new_data:
+        source.data = new_data
+        return
+
+    old_lengths = {len(column) for column in old_data.values()}
+    new_lengths = {len(column) for column in new_data.values()}
+    if len(old_lengths) != 1 or len(new_lengths) != 1:
+        source.data = new_data
+        return
+    old_length, new_length = old_lengths.pop(), new_lengths.pop()
+
+    columns = {
+        name: (np.asarray(old_data[name]), np.asarray(new_data[name]))
+        for name in new_data
+    }
+    # Streamed and patched values are converted to the type of the current column in
+    # the browser, e.g., floats would be truncated if it holds integers.
+    if not all(_has_same_type(old, new) for old, new in columns.values()):
+        source.data = new_data
+        return
+
+    if new_length > old_length and all(
+        np.array_equal(old, new[:old_length]) for old, new in columns.values()
+    ):
+        source.stream({name: new[old_length:] for name, (_, new) in columns.items()})
+        return
+
+    if new_length == old_length:
+        patches = {}
+        for name, (old, new) in columns.items():
+            (changed,) = np.nonzero(old != new)
+            if len(changed):
+                patches[name] = list(zip(changed.tolist(), new[changed].tolist()))
+        num_changed = sum(len(patch) for patch in patches.values())
+        if num_changed <= _MAX_PATCH_FRACTION * new_length * len(columns):
+            if patches:
+                source.patch(patches)
+            return
+
+    source.data = new_data
+
+
+def _has_same_type(old: np.ndarray, new: np.ndarray) -> bool:
+    # Strings of different lengths have different dtypes, but are all sent as JSON.
+    if old.dtype.kind in "OSU":
+        return new.dtype.kind in "OSU"
+    return old.dtype == new.dtype
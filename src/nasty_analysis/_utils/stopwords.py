@@ -0,0 +1,96 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from functools import lru_cache
+from typing import AbstractSet
+from unicodedata import category
+
+from stopwordsiso import stopwords
+
+
+@lru_cache(maxsize=None, typed=True)
+def get_stopwords(lang: str) -> AbstractSet[str]:
+    result = set(stopwords(lang))
+
+    if lang == "en":
+        result.update(
+            ("'m", "'re", "'s", "'ve", "n't", "nt", "n’t", "’m", "’re", "’s", "’ve")
+        )
+        result.difference_update(
+            (
+                "case",
+                "cases",
+                "help",
+                "home",
+                "information",
+                "man",
+                "million",
+                "new",
+                "novel",
+                "state",
+                "states",
+                "system",
+                "today",
+                "uk",
+                "work",
+                "world",
+                "year",
+                "years",
+            )
+        )
+
+    elif lang == "de":
+        result.update(
+            (
+                "bleiben",
+                "ca.",
+                "echt",
+                "eher",
+                "eigentlich",
+                "fast",
+                "fest",
+                "genau",
+                "halt",
+                "klar",
+                "ne",
+                "paar",
+                "sogar",
+                "trotz",
+                "wahrscheinlich",
+            )
+        )
+        result.difference_update(
+            (
+                "ernst",
+                "jahr",
+                "jahre",
+                "jahren",
+                "mensch",
+                "menschen",
+                "neuen",
+                "tag",
+                "tage",
+                "uhr",
+                "wissen",
+                "zeit",
+            )
+        )
+
+    return result
+
+
+def filter_non_letters_unicode(s: str) -> str:
+    return "".join(c for c in s if category(c).startswith("L"))
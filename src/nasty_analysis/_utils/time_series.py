@@ -0,0 +1,138 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import date, timedelta
+from enum import Enum
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from typing_extensions import Final
+
+# Hourly series are aggregated from documents instead of rollups or aggregate store
+# entries, which is only fast enough for short date ranges.
+_MAX_NUM_DAYS_PER_HOUR: Final[int] = 7
+
+
+class Granularity(Enum):
+    def __init__(self, label: str, calendar_interval: Optional[str]):
+        self.label = label
+        self.calendar_interval = calendar_interval
+
+    AUTO = ("Automatic", None)
+    HOUR = ("Hour", "1h")
+    DAY = ("Day", "1d")
+    WEEK = ("Week", "1w")
+    MONTH = ("Month", "1M")
+
+    @classmethod
+    def for_num_days(cls, num_days: int) -> "Granularity":
+        # Keeps the number of points per series in the low hundreds.
+        if num_days <= _MAX_NUM_DAYS_PER_HOUR:
+            return cls.HOUR
+        elif num_days <= 6 * 31:
+            return cls.DAY
+        elif num_days <= 3 * 366:
+            return cls.WEEK
+        return cls.MONTH
+
+    def resolve(self, min_date: date, max_date: date) -> "Granularity":
+        num_days = (max_date - min_date).days + 1
+        if self == Granularity.AUTO:
+            return self.for_num_days(num_days)
+        elif self == Granularity.HOUR and num_days > _MAX_NUM_DAYS_PER_HOUR:
+            return Granularity.DAY
+        return self
+
+    @property
+    def width(self) -> timedelta:
+        return {
+            Granularity.HOUR: timedelta(hours=1),
+            Granularity.DAY: timedelta(days=1),
+            Granularity.WEEK: timedelta(weeks=1),
+            Granularity.MONTH: timedelta(days=30),
+        }[self]
+
+
+def _bucket_start(day: date, granularity: Granularity) -> date:
+    # Same as Elasticsearch's calendar intervals: weeks start on Monday.
+    if granularity == Granularity.DAY:
+        return day
+    elif granularity == Granularity.WEEK:
+        return day - timedelta(days=day.weekday())
+    elif granularity == Granularity.MONTH:
+        return day.replace(day=1)
+    raise ValueError(f"Can not resample days to granularity {granularity.name}.")
+
+
+def resample_per_day(
+    dates: Sequence[date], values: np.ndarray, granularity: Granularity
+) -> Tuple[List[date], np.ndarray]:
+    # Sums values of the last axis (one entry per date) for each week or month. No
+    # values, e.g., while a figure is cleared, result in no buckets.
+    if not dates or values.shape[-1] == 0:
+        return [], values[..., :0]
+
+    bucket_starts = [_bucket_start(day, granularity) for day in dates]
+    boundaries = [0] + [
+        i for i in range(1, len(dates)) if bucket_starts[i] != bucket_starts[i - 1]
+    ]
+    return (
+        [bucket_starts[i] for i in boundaries],
+        np.add.reduceat(values, boundaries, axis=-1),
+    )
+
+
+def lttb(x: np.ndarray, y: np.ndarray, num_points: int) -> np.ndarray:
+    # Indices of points selected via Largest-Triangle-Three-Buckets downsampling, see
+    # Steinarsson: Downsampling Time Series for Visual Representation (2013).
+    if num_points >= len(x) or num_points < 3:
+        return np.arange(len(x))
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # First and last point are always selected, the ones in between are split into
+    # num_points - 2 buckets of (almost) equal size.
+    bucket_bounds = np.linspace(1, len(x) - 1, num_points - 1).astype(np.int64)
+
+    result = np.zeros(num_points, dtype=np.int64)
+    result[-1] = len(x) - 1
+    selected = 0
+    for i in range(num_points - 2):
+        start, end = bucket_bounds[i], bucket_bounds[i + 1]
+        next_end = bucket_bounds[i + 2] if i + 2 < len(bucket_bounds) else len(x)
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+
+        areas = np.abs(
+            (x[selected] - next_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (next_y - y[selected])
+        )
+        selected = start + int(areas.argmax())
+        result[i + 1] = selected
+
+    return result
+
+
+def downsample_indices(x: np.ndarray, ys: np.ndarray, max_points: int) -> np.ndarray:
+    # Since all series share the same x values, the union of the points LTTB selects
+    # for each series is kept.
+    if len(x) <= max_points:
+        return np.arange(len(x))
+    if not len(ys):
+        return lttb(x, np.zeros(len(x)), max_points)
+
+    num_points = max(3, max_points // len(ys))
+    return np.unique(np.concatenate([lttb(x, y, num_points) for y in ys]))
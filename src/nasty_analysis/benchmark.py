@@ -0,0 +1,248 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import date, timedelta
+from enum import Enum
+from functools import partial
+from logging import getLogger
+from statistics import median
+from time import time
+from typing import Callable, Mapping, Sequence, Tuple, Type
+
+from elasticsearch_dsl import Index, Search
+from elasticsearch_dsl.connections import get_connection
+from nasty_data import BaseDocument
+from nasty_utils import ColoredBraceStyleAdapter
+from typing_extensions import Final
+
+from nasty_analysis.document.tokenize import (
+    TokenizedMaxqdaCodedNastyDocument,
+    TokenizedMaxqdaCodedNewsCsvDocument,
+    TokenizedNastyBatchResultsTwitterDocument,
+    TokenizedNewsCsvDocument,
+)
+from nasty_analysis.index_profile import get_disk_usage_per_field, new_profiled_index
+from nasty_analysis.search_helper import SearchHelper
+from nasty_analysis.settings import DatasetSection, DatasetType, IndexProfile
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+_DOCUMENT_CLS_BY_DATASET_TYPE: Final[Mapping[DatasetType, Type[BaseDocument]]] = {
+    DatasetType.NASTY: TokenizedNastyBatchResultsTwitterDocument,
+    DatasetType.NEWS_CSV: TokenizedNewsCsvDocument,
+    DatasetType.MAXQDA_CODED_NASTY: TokenizedMaxqdaCodedNastyDocument,
+    DatasetType.MAXQDA_CODED_NEWS_CSV: TokenizedMaxqdaCodedNewsCsvDocument,
+}
+
+
+class Benchmark(Enum):
+    NASTY_REQUEST_FIELDS = "nasty_request_fields"
+    INDEX_PROFILES = "index_profiles"
+    DISK_USAGE = "disk_usage"
+
+
+def _build_facets_search(
+    dataset: DatasetSection, search_helper: SearchHelper
+) -> Search:
+    # As used for the facets of the visualization app, which are not filtered.
+    search = Search(index=dataset.index).extra(size=0)
+    search = search_helper.add_agg_lang_terms(search, size=100)
+    return search_helper.add_agg_nasty_query_terms(search, size=100)
+
+
+def _build_word_freqs_search(
+    dataset: DatasetSection, search_helper: SearchHelper, lang: str, query: str
+) -> Search:
+    # As used for the word frequencies of the visualization app.
+    search = Search(index=dataset.index).extra(size=0, track_total_hits=True)
+    search = search.filter(search_helper.query_lang_term(lang))
+    search = search.filter(search_helper.query_nasty_query_term(query))
+    return search_helper.add_agg_text_tokens_terms(search, size=1000)
+
+
+def _measure(
+    search: Search, repetitions: int, *, warm_up: bool = True
+) -> Tuple[float, float]:
+    # Disable the request cache, otherwise all but the first repetition would only
+    # measure the cache lookup.
+    search = search.params(request_cache=False)
+    if warm_up:
+        search.execute()
+
+    took_msecs = []
+    wall_msecs = []
+    for _ in range(repetitions):
+        time_before = time()
+        response = search.execute(ignore_cache=True)
+        time_after = time()
+        took_msecs.append(response.took)
+        wall_msecs.append((time_after - time_before) * 1000)
+    return median(took_msecs), median(wall_msecs)
+
+
+def benchmark_nasty_request_fields(
+    dataset: DatasetSection, *, repetitions: int
+) -> None:
+    # Compares latency of the nested nasty_batch_meta.request fields and their flat
+    # copies for typical requests of the visualization app.
+    if dataset.type != DatasetType.NASTY:
+        raise ValueError(f"Dataset type needs to be {DatasetType.NASTY.name}.")
+
+    nested_search_helper = SearchHelper(dataset.type)
+    flat_search_helper = SearchHelper(dataset.type, dataset.index)
+    if not flat_search_helper.has_flat_nasty_request_fields:
+        raise ValueError(
+            f"Index '{dataset.index}' does not contain the flat nasty_request_* fields "
+            "yet. Index the dataset into a new index to add them."
+        )
+
+    facets = _build_facets_search(dataset, nested_search_helper).execute()
+    lang = next(nested_search_helper.read_agg_lang_terms(facets)).key
+    query = next(nested_search_helper.read_agg_nasty_query_terms(facets)).key
+
+    builders: Sequence[Tuple[str, Callable[..., Search]]] = (
+        ("facets", _build_facets_search),
+        ("word frequencies", partial(_build_word_freqs_search, lang=lang, query=query)),
+    )
+    for name, builder in builders:
+        for variant, search_helper in (
+            ("nested", nested_search_helper),
+            ("flat", flat_search_helper),
+        ):
+            took_msecs, wall_msecs = _measure(
+                builder(dataset, search_helper), repetitions
+            )
+            _LOGGER.info(
+                "{} with {} fields: median took {:.0f}ms, median wall time {:.0f}ms.",
+                name.capitalize(),
+                variant,
+                took_msecs,
+                wall_msecs,
+            )
+
+
+def _build_all_word_freqs_search(index: str, search_helper: SearchHelper) -> Search:
+    search = Search(index=index).extra(size=0)
+    return search_helper.add_agg_text_tokens_terms(search, size=1000)
+
+
+def _build_recent_word_freqs_search(
+    index: str, search_helper: SearchHelper, max_date: date
+) -> Search:
+    # The word frequencies of the last month, as when zooming into the date range.
+    search = Search(index=index).extra(size=0)
+    search = search.filter(
+        search_helper.query_date_range(gte=max_date - timedelta(days=30))
+    )
+    return search_helper.add_agg_text_tokens_terms(search, size=1000)
+
+
+def _build_latest_docs_search(index: str, search_helper: SearchHelper) -> Search:
+    # As used for document previews, can terminate early on an index sorted by date.
+    # Any additional sort field, e.g., as a tie breaker, prevents that.
+    search = Search(index=index).extra(size=100, track_total_hits=False)
+    return search.sort({search_helper.date_field: "desc"})
+
+
+def benchmark_index_profiles(dataset: DatasetSection, *, repetitions: int) -> None:
+    # Copies the dataset into one index per profile, so that all profiles are
+    # compared on the same corpus.
+    search_helper = SearchHelper(dataset.type)
+    response = search_helper.add_agg_date_min_max(
+        Search(index=dataset.index).extra(size=0)
+    ).execute()
+    _, max_date = search_helper.read_agg_date_min_max(response)
+
+    for profile in IndexProfile:
+        index = f"{dataset.index}-benchmark-{profile.value.lower()}"
+        new_profiled_index(
+            index,
+            _DOCUMENT_CLS_BY_DATASET_TYPE[dataset.type],
+            dataset.copy(update={"index_profile": profile}),
+        )
+        try:
+            time_before = time()
+            get_connection().reindex(
+                body={"source": {"index": dataset.index}, "dest": {"index": index}},
+                request_timeout=24 * 60 * 60,
+            )
+            Index(index).refresh()
+            time_after = time()
+            _LOGGER.info(
+                "Indexing with profile {} took {:.0f}s.",
+                profile.name,
+                time_after - time_before,
+            )
+
+            # The first terms aggregation after a refresh includes building global
+            # ordinals, unless they are built eagerly.
+            searches: Sequence[Tuple[str, Search, bool]] = (
+                (
+                    "First word frequencies after refresh",
+                    _build_all_word_freqs_search(index, search_helper),
+                    False,
+                ),
+                (
+                    "Word frequencies",
+                    _build_all_word_freqs_search(index, search_helper),
+                    True,
+                ),
+                (
+                    "Word frequencies of last month",
+                    _build_recent_word_freqs_search(index, search_helper, max_date),
+                    True,
+                ),
+                (
+                    "Latest documents",
+                    _build_latest_docs_search(index, search_helper),
+                    True,
+                ),
+            )
+            for name, search, warm_up in searches:
+                took_msecs, wall_msecs = _measure(
+                    search, repetitions if warm_up else 1, warm_up=warm_up
+                )
+                _LOGGER.info(
+                    "{} with profile {}: median took {:.0f}ms, "
+                    "median wall time {:.0f}ms.",
+                    name,
+                    profile.name,
+                    took_msecs,
+                    wall_msecs,
+                )
+        finally:
+            Index(index).delete()
+
+
+def report_disk_usage(dataset: DatasetSection) -> None:
+    disk_usage = get_disk_usage_per_field(dataset.index)
+    _LOGGER.info(
+        "Disk usage per field of index '{}' (total / inverted index / stored / "
+        "doc values / term vectors):",
+        dataset.index,
+    )
+    for field_name, usage in sorted(
+        disk_usage.items(), key=lambda item: -item[1]["total_in_bytes"]
+    ):
+        _LOGGER.info(
+            "  {}: {} / {} / {} / {} / {}",
+            field_name,
+            usage["total"],
+            usage["inverted_index"]["total"],
+            usage["stored_fields"],
+            usage["doc_values"],
+            usage["term_vectors"],
+        )
@@ -34,7 +34,14 @@ from tornado.autoreload import watch
 import nasty_analysis
 from nasty_analysis import serve
 from nasty_analysis._utils.bokeh_ import ParameterPassingApplication
-from nasty_analysis.dataset import Dataset
+from nasty_analysis.benchmark import Benchmark
+from nasty_analysis.dataset import (
+    MAX_SAMPLE_SIZE,
+    Dataset,
+    ExportStratum,
+    load_query_strings,
+)
+from nasty_analysis.serve.export_handler import WORD_FREQS_CSV_PATH, WordFreqsCsvHandler
 from nasty_analysis.settings import NastyAnalysisSettings
 
 _LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
@@ -107,12 +114,35 @@ class _IndexProgram(Program):
         metavar="NAME",
         group=_INDEX_ARGUMENT_GROUP,
     )
+    partition: Optional[str] = Argument(
+        short_alias="p",
+        description=(
+            "Delete and re-index a single partition (e.g., 2020-05 or 2020-w18) of a "
+            "dataset with index_partition."
+        ),
+        metavar="PARTITION",
+        group=_INDEX_ARGUMENT_GROUP,
+    )
+    local: bool = Argument(
+        False,
+        description=(
+            "Instead of indexing, build the local index for the LOCAL serve backend "
+            "from the already indexed documents."
+        ),
+        group=_INDEX_ARGUMENT_GROUP,
+    )
 
     @overrides
     def run(self) -> None:
         dataset = _make_dataset(self.settings, self.dataset)
         self.settings.setup_elasticsearch_connection()
-        dataset.index()
+        if self.local:
+            local_index_dir = self.settings.analysis.serve.local_index_dir
+            if local_index_dir is None:
+                raise ValueError("Configure local_index_dir to build local indices.")
+            dataset.build_local_index(local_index_dir)
+        else:
+            dataset.index(partition=self.partition)
 
 
 _EXPORT_ARGUMENT_GROUP = ArgumentGroup(name="Export Arguments")
@@ -134,23 +164,180 @@ class _ExportProgram(Program):
         metavar="NAME",
         group=_INDEX_ARGUMENT_GROUP,
     )
-    query: str = Argument(
+    query: Optional[str] = Argument(
         short_alias="q",
         description="Elasticsearch query string for the exported subset.",
         group=_EXPORT_ARGUMENT_GROUP,
     )
+    queries: Optional[Path] = Argument(
+        description=(
+            "CSV-File with columns 'name' and 'query' to export one subset per named "
+            "query string in a single pass over the index."
+        ),
+        metavar="FILE",
+        group=_EXPORT_ARGUMENT_GROUP,
+    )
     output: Path = Argument(
         short_alias="o",
-        description="CSV-File to which the output will be written.",
-        metavar="FILE",
+        description=(
+            "CSV-File to which the output will be written (directory when using "
+            "--queries)."
+        ),
+        metavar="PATH",
+        group=_EXPORT_ARGUMENT_GROUP,
+    )
+    resume: bool = Argument(
+        False,
+        short_alias="r",
+        description="Resume an interrupted export from its checkpoint file.",
+        group=_EXPORT_ARGUMENT_GROUP,
+    )
+    sample: Optional[int] = Argument(
+        description=(
+            "Only export a random sample of this many documents (per stratum, if "
+            f"--stratify-by is given), at most {MAX_SAMPLE_SIZE}."
+        ),
+        metavar="N",
+        group=_EXPORT_ARGUMENT_GROUP,
+    )
+    stratify_by: Optional[ExportStratum] = Argument(
+        alias="stratify-by",
+        description=(
+            "Draw the random sample separately for each "
+            + "|".join(stratum.value for stratum in ExportStratum)
+            + "."
+        ),
+        metavar="STRATUM",
+        group=_EXPORT_ARGUMENT_GROUP,
+    )
+    seed: int = Argument(
+        0,
+        description="Seed for the random sample.",
         group=_EXPORT_ARGUMENT_GROUP,
     )
 
+    @overrides
+    def run(self) -> None:
+        if (self.query is None) == (self.queries is None):
+            raise ValueError("Specify exactly one of -q, --query or --queries.")
+
+        if self.sample is None and self.stratify_by is not None:
+            raise ValueError("Can only use --stratify-by together with --sample.")
+        if self.sample is not None and (self.queries or self.resume):
+            raise ValueError("Can not use --sample with --queries or --resume.")
+        if self.sample is not None and not 0 < self.sample <= MAX_SAMPLE_SIZE:
+            raise ValueError(f"--sample must be between 1 and {MAX_SAMPLE_SIZE}.")
+
+        dataset = _make_dataset(self.settings, self.dataset)
+        self.settings.setup_elasticsearch_connection()
+        if self.sample is not None:
+            assert self.query
+            dataset.export_sample(
+                self.query,
+                self.output,
+                sample_size=self.sample,
+                stratify_by=self.stratify_by,
+                seed=self.seed,
+            )
+        elif self.queries:
+            dataset.export_multiple(
+                load_query_strings(self.queries), self.output, resume=self.resume
+            )
+        else:
+            assert self.query
+            dataset.export(self.query, self.output, resume=self.resume)
+
+
+_DUMP_ARGUMENT_GROUP = ArgumentGroup(name="Dump Arguments")
+
+
+class _DumpProgram(Program):
+    class Config(ProgramConfig):
+        title = "dump"
+        aliases = ("m",)
+        description = (
+            "Dump the number of documents per word and day of a dataset subset as a "
+            "sparse matrix."
+        )
+
+    settings: NastyAnalysisSettings = Argument(
+        alias="config", description="Overwrite default config file path."
+    )
+
+    dataset: Optional[str] = Argument(
+        short_alias="d",
+        description="Name of the dataset.",
+        metavar="NAME",
+        group=_INDEX_ARGUMENT_GROUP,
+    )
+    query: Optional[str] = Argument(
+        short_alias="q",
+        description=(
+            "Elasticsearch query string for the dumped subset (default: all documents)."
+        ),
+        group=_DUMP_ARGUMENT_GROUP,
+    )
+    output: Path = Argument(
+        short_alias="o",
+        description=(
+            "Directory to which the CSR matrix (term_matrix.npz, loadable with "
+            "scipy.sparse.load_npz()), its rows (vocabulary.txt), and its columns "
+            "(days.txt) will be written."
+        ),
+        metavar="DIR",
+        group=_DUMP_ARGUMENT_GROUP,
+    )
+
+    @overrides
+    def run(self) -> None:
+        dataset = _make_dataset(self.settings, self.dataset)
+        self.settings.setup_elasticsearch_connection()
+        dataset.dump_term_matrix(self.query, self.output)
+
+
+_BENCHMARK_ARGUMENT_GROUP = ArgumentGroup(name="Benchmark Arguments")
+
+
+class _BenchmarkProgram(Program):
+    class Config(ProgramConfig):
+        title = "benchmark"
+        aliases = ("b",)
+        description = "Benchmark query latency or disk usage of a dataset index."
+
+    settings: NastyAnalysisSettings = Argument(
+        alias="config", description="Overwrite default config file path."
+    )
+
+    dataset: Optional[str] = Argument(
+        short_alias="d",
+        description="Name of the dataset.",
+        metavar="NAME",
+        group=_BENCHMARK_ARGUMENT_GROUP,
+    )
+    benchmark: Benchmark = Argument(
+        Benchmark.NASTY_REQUEST_FIELDS,
+        short_alias="b",
+        description=(
+            "Benchmark to run, one of "
+            + "|".join(benchmark.value for benchmark in Benchmark)
+            + "."
+        ),
+        metavar="BENCHMARK",
+        group=_BENCHMARK_ARGUMENT_GROUP,
+    )
+    repetitions: int = Argument(
+        10,
+        short_alias="n",
+        description="Number of times each request is executed.",
+        metavar="N",
+        group=_BENCHMARK_ARGUMENT_GROUP,
+    )
+
     @overrides
     def run(self) -> None:
         dataset = _make_dataset(self.settings, self.dataset)
         self.settings.setup_elasticsearch_connection()
-        dataset.export(self.query, self.output)
+        dataset.benchmark(self.benchmark, repetitions=self.repetitions)
 
 
 _SERVE_ARGUMENTS_GROUP = ArgumentGroup(name="Serve Arguments")
@@ -206,6 +393,18 @@ class _ServeProgram(Program):
             DirectoryHandler(filename=Path(serve.__file__).parent),
             server_context_params={"settings": self.settings},
         )
+        # Exports are streamed from aggregate store entries by a separate handler.
+        extra_patterns = []
+        aggregate_store_dir = self.settings.analysis.serve.aggregate_store_dir
+        if aggregate_store_dir is not None:
+            extra_patterns.append(
+                (
+                    WORD_FREQS_CSV_PATH,
+                    WordFreqsCsvHandler,
+                    {"aggregate_store_dir": aggregate_store_dir},
+                )
+            )
+
         with report_server_init_errors(address=address, port=port):
             server = Server(
                 {"/": application},
@@ -214,6 +413,7 @@ class _ServeProgram(Program):
                 allow_websocket_origin=[f"{address}:{port}"],
                 num_procs=num_procs,
                 autoreload=autoreload,
+                extra_patterns=extra_patterns,
             )
             server.start()
 
@@ -252,6 +452,8 @@ class NastyAnalysisProgram(Program):
             _RetrieveProgram,
             _IndexProgram,
             _ExportProgram,
+            _DumpProgram,
+            _BenchmarkProgram,
             _ServeProgram,
             _GdeltProgram,
         )
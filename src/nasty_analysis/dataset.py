@@ -15,13 +15,32 @@
 #
 
 import csv
-from datetime import date
+import json
+from collections import defaultdict
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta, timezone
+from enum import Enum
 from logging import getLogger
 from pathlib import Path
 from time import time
-from typing import Mapping, Optional, Sequence
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Type,
+)
 
-from elasticsearch_dsl import Index, Keyword
+from elasticsearch_dsl import Index, Keyword, MultiSearch
+from elasticsearch_dsl import Search as ElasticsearchSearch
+from elasticsearch_dsl.connections import get_connection
+from elasticsearch_dsl.query import Bool, Query
+from elasticsearch_dsl.response import Hit, Response
+from more_itertools import chunked
 from nasty import Batch, BatchResults, Request, Search, SearchFilter
 from nasty_data import (
     BaseDocument,
@@ -29,10 +48,16 @@ from nasty_data import (
     load_document_dicts_from_nasty_batch_results,
 )
 from nasty_data.elasticsearch_.index import new_index
-from nasty_utils import ColoredBraceStyleAdapter
+from nasty_utils import ColoredBraceStyleAdapter, checked_cast
 from tqdm import tqdm
 from typing_extensions import Final
 
+from nasty_analysis.benchmark import (
+    Benchmark,
+    benchmark_index_profiles,
+    benchmark_nasty_request_fields,
+    report_disk_usage,
+)
 from nasty_analysis.document.maxqda_coded_nasty import (
     load_document_dicts_from_maxqda_coded_nasty_csv,
 )
@@ -46,16 +71,31 @@ from nasty_analysis.document.tokenize import (
     TokenizedNastyBatchResultsTwitterDocument,
     TokenizedNewsCsvDocument,
 )
-from nasty_analysis.search_helper import SearchHelper
+from nasty_analysis.index_partition import partition_date_range, partition_suffix
+from nasty_analysis.index_profile import new_profiled_index
+from nasty_analysis.local_index import LocalIndex
+from nasty_analysis.rollup import rollup_index, update_rollup
+from nasty_analysis.search_helper import SearchHelper, clear_partitions_cache
 from nasty_analysis.settings import (
     DatasetSection,
     DatasetSourceMaxqdaCodeSection,
     DatasetType,
 )
+from nasty_analysis.term_matrix import dump_term_matrix
 
 _LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
 
 _INDEXED_SUFFIX: Final[str] = "-indexed"
+_NASTY_CREATED_AT_FORMAT: Final[str] = "%a %b %d %H:%M:%S %z %Y"
+
+_CHECKPOINT_SUFFIX: Final[str] = ".checkpoint"
+_EXPORT_PAGE_SIZE: Final[int] = 1000
+_EXPORT_KEEP_ALIVE: Final[str] = "5m"
+_SAMPLE_MAX_STRATA: Final[int] = 10000
+_SAMPLE_STRATA_PER_REQUEST: Final[int] = 100
+# Each stratum's sample is fetched in a single search, so it can not be larger than
+# the default index.max_result_window of Elasticsearch.
+MAX_SAMPLE_SIZE: Final[int] = 10000
 
 
 def _update_nasty_batch_file(
@@ -101,8 +141,16 @@ def _update_nasty_batch_file(
     batch.dump(batch_file)
 
 
+class ExportStratum(Enum):
+    DAY = "day"
+    LANG = "lang"
+    URL_NETLOC = "url_netloc"
+
+
 class IndexedFilesDocument(BaseDocument):
     file_name = Keyword(doc_values=False)
+    # Partition indices that documents of the file were written to.
+    partitions = Keyword(doc_values=False)
 
 
 class Dataset:
@@ -169,9 +217,22 @@ class Dataset:
                 f"Can not dataset of type '{self._settings.type}' automatically."
             )
 
-    def index(self) -> None:
+    def index(self, *, partition: Optional[str] = None) -> None:
+        if partition is not None and self._settings.index_partition is None:
+            raise ValueError(
+                "Can only re-index a partition of datasets with index_partition."
+            )
+
+        # Existing rollups of NASTY datasets are updated per indexed file, all others
+        # are computed after indexing.
+        incremental_rollup = (
+            self._settings.rollup
+            and self._settings.type == DatasetType.NASTY
+            and Index(rollup_index(self._settings.index)).exists()
+        )
+
         if self._settings.type == DatasetType.NASTY:
-            self._index_nasty_dataset()
+            self._index_nasty_dataset(partition, incremental_rollup=incremental_rollup)
 
         elif self._settings.type == DatasetType.NEWS_CSV:
             self._index_news_csv_dataset()
@@ -185,17 +246,42 @@ class Dataset:
         else:
             raise NotImplementedError()
 
-    def _index_nasty_dataset(self) -> None:
+        if self._settings.rollup and not incremental_rollup:
+            Index(self._settings.index).refresh()
+            update_rollup(self._settings)
+
+    def build_local_index(self, directory: Path) -> None:
+        LocalIndex.build(
+            directory / self._settings.name,
+            self._settings.index,
+            SearchHelper(self._settings.type, self._settings.index),
+        )
+
+    def _new_index(
+        self, document_cls: Type[BaseDocument], index: Optional[str] = None
+    ) -> None:
+        new_profiled_index(index or self._settings.index, document_cls, self._settings)
+
+    def _index_nasty_dataset(
+        self, partition: Optional[str], *, incremental_rollup: bool
+    ) -> None:
         source = self._settings.source_nasty
         assert source
 
-        if not Index(self._settings.index).exists():
-            new_index(self._settings.index, TokenizedNastyBatchResultsTwitterDocument)
+        # Partition indices are created on demand, once documents for them exist.
+        if (
+            self._settings.index_partition is None
+            and not Index(self._settings.index).exists()
+        ):
+            self._new_index(TokenizedNastyBatchResultsTwitterDocument)
 
         indexed_index = self._settings.index + _INDEXED_SUFFIX
         if not Index(indexed_index).exists():
             new_index(indexed_index, IndexedFilesDocument)
 
+        if partition is not None:
+            self._delete_nasty_partition(partition, indexed_index)
+
         batch_results = BatchResults(source.batch_results_dir)
         total_size = 0
         for batch_entry in batch_results:
@@ -226,21 +312,104 @@ class Dataset:
                     progress_bar.update(data_file.stat().st_size)
                     continue
 
-                add_documents_to_index(
-                    self._settings.index,
-                    TokenizedNastyBatchResultsTwitterDocument,
-                    load_document_dicts_from_nasty_batch_results(data_file),
-                    max_retries=self._max_retries,
-                    num_procs=self._num_procs,
+                self._index_nasty_data_file(
+                    data_file, indexed_index, incremental_rollup=incremental_rollup
                 )
-                IndexedFilesDocument(file_name=data_file.name).save(index=indexed_index)
                 progress_bar.update(data_file.stat().st_size)
 
+    def _index_nasty_data_file(
+        self, data_file: Path, indexed_index: str, *, incremental_rollup: bool
+    ) -> None:
+        document_dicts = load_document_dicts_from_nasty_batch_results(data_file)
+        if self._settings.index_partition is None and not incremental_rollup:
+            # Nothing depends on the days of documents, so stream them directly.
+            add_documents_to_index(
+                self._settings.index,
+                TokenizedNastyBatchResultsTwitterDocument,
+                document_dicts,
+                max_retries=self._max_retries,
+                num_procs=self._num_procs,
+            )
+            IndexedFilesDocument(file_name=data_file.name, partitions=None).save(
+                index=indexed_index
+            )
+            return
+
+        document_dicts_by_index = defaultdict(list)
+        days = set()
+        for document_dict in document_dicts:
+            day = (
+                datetime.strptime(
+                    checked_cast(str, document_dict["created_at"]),
+                    _NASTY_CREATED_AT_FORMAT,
+                )
+                .astimezone(timezone.utc)
+                .date()
+            )
+            days.add(day)
+            document_dicts_by_index[self._nasty_partition_index(day)].append(
+                document_dict
+            )
+
+        for index, index_document_dicts in sorted(document_dicts_by_index.items()):
+            if not Index(index).exists():
+                self._new_index(TokenizedNastyBatchResultsTwitterDocument, index)
+                Index(index).put_alias(name=self._settings.index)
+                clear_partitions_cache()
+            add_documents_to_index(
+                index,
+                TokenizedNastyBatchResultsTwitterDocument,
+                index_document_dicts,
+                max_retries=self._max_retries,
+                num_procs=self._num_procs,
+            )
+
+        # Update the rollup before marking the file as indexed, so that an
+        # interrupted update is repeated.
+        if incremental_rollup:
+            Index(self._settings.index).refresh()
+            update_rollup(self._settings, sorted(days))
+
+        IndexedFilesDocument(
+            file_name=data_file.name,
+            partitions=(
+                sorted(document_dicts_by_index.keys())
+                if self._settings.index_partition
+                else None
+            ),
+        ).save(index=indexed_index)
+
+    def _nasty_partition_index(self, day: date) -> str:
+        if self._settings.index_partition is None:
+            return self._settings.index
+        return (
+            self._settings.index
+            + "-"
+            + partition_suffix(self._settings.index_partition, day)
+        )
+
+    def _delete_nasty_partition(self, partition: str, indexed_index: str) -> None:
+        # Deletes the partition index and forgets all data files that contributed to
+        # it, so that indexing writes their documents again. Documents of those files
+        # in other partitions are overwritten with themselves.
+        if partition_date_range(partition) is None:
+            raise ValueError(f"'{partition}' is not a valid partition name.")
+
+        partition_index = self._settings.index + "-" + partition
+        if Index(partition_index).exists():
+            _LOGGER.info("Deleting partition index '{}'.", partition_index)
+            Index(partition_index).delete()
+            clear_partitions_cache()
+
+        IndexedFilesDocument.search(index=indexed_index).query(
+            "term", partitions=partition_index
+        ).params(refresh=True).delete()
+
     def _index_news_csv_dataset(self) -> None:
         source = self._settings.source_news_csv
         assert source
 
-        new_index(self._settings.index, TokenizedNewsCsvDocument)
+        self._new_index(TokenizedNewsCsvDocument)
         add_documents_to_index(
             self._settings.index,
             TokenizedNewsCsvDocument,
@@ -253,7 +422,7 @@ class Dataset:
         source = self._settings.source_maxqda_coded_nasty
         assert source
 
-        new_index(self._settings.index, TokenizedMaxqdaCodedNastyDocument)
+        self._new_index(TokenizedMaxqdaCodedNastyDocument)
         self._index_maxqda_coded_nasty_code(source.codes, source.lang)
 
     def _index_maxqda_coded_nasty_code(
@@ -284,7 +453,7 @@ class Dataset:
         ):
             news_csv_document_dicts[str(document_dict["index"])] = document_dict
 
-        new_index(self._settings.index, TokenizedMaxqdaCodedNewsCsvDocument)
+        self._new_index(TokenizedMaxqdaCodedNewsCsvDocument)
         add_documents_to_index(
             self._settings.index,
             TokenizedMaxqdaCodedNewsCsvDocument,
@@ -323,22 +492,254 @@ class Dataset:
                     code.codes, news_csv_document_dicts
                 )
 
-    def export(self, query_string: str, output_file: Path) -> None:
+    def benchmark(self, benchmark: Benchmark, *, repetitions: int) -> None:
+        if benchmark == Benchmark.NASTY_REQUEST_FIELDS:
+            benchmark_nasty_request_fields(self._settings, repetitions=repetitions)
+
+        elif benchmark == Benchmark.INDEX_PROFILES:
+            benchmark_index_profiles(self._settings, repetitions=repetitions)
+
+        elif benchmark == Benchmark.DISK_USAGE:
+            report_disk_usage(self._settings)
+
+        else:
+            raise NotImplementedError()
+
+    def export(
+        self, query_string: str, output_file: Path, *, resume: bool = False
+    ) -> None:
+        search_helper = SearchHelper(self._settings.type)
+        self._export(
+            search_helper.query_text_query_string(query_string),
+            {output_file.name: output_file},
+            lambda _document: (output_file.name,),
+            output_file.with_name(output_file.name + _CHECKPOINT_SUFFIX),
+            desc=output_file.name,
+            resume=resume,
+        )
+
+    def dump_term_matrix(self, query_string: Optional[str], output_dir: Path) -> None:
+        search_helper = SearchHelper(self._settings.type, self._settings.index)
+        dump_term_matrix(
+            output_dir,
+            self._settings.index,
+            search_helper,
+            search_helper.query_text_query_string(query_string)
+            if query_string
+            else None,
+        )
+
+    def export_multiple(
+        self,
+        query_strings: Mapping[str, str],
+        output_dir: Path,
+        *,
+        resume: bool = False,
+    ) -> None:
+        # Instead of scanning the index once per query, all queries are combined into
+        # a single scan. Named queries tell us which of the queries each hit matched
+        # and thereby to which output files it belongs.
         search_helper = SearchHelper(self._settings.type)
-        search = (
-            Index(self._settings.index)
-            .search()
-            .extra(size=0, track_total_hits=True)
-            .query(search_helper.query_text_query_string(query_string))
+        query = Bool(
+            should=[
+                search_helper.query_text_query_string(query_string, name=name)
+                for name, query_string in query_strings.items()
+            ],
+            minimum_should_match=1,
         )
 
-        time_before = time()
-        response = search.execute()
-        time_after = time()
-        _LOGGER.debug("Search took {:.2}s", time_after - time_before)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self._export(
+            query,
+            {name: output_dir / (name + ".csv") for name in query_strings.keys()},
+            lambda document: document.meta.matched_queries,
+            output_dir / _CHECKPOINT_SUFFIX,
+            desc=output_dir.name,
+            resume=resume,
+        )
+
+    def export_sample(
+        self,
+        query_string: str,
+        output_file: Path,
+        *,
+        sample_size: int,
+        stratify_by: Optional[ExportStratum] = None,
+        seed: int = 0,
+    ) -> None:
+        # Instead of exporting all matching documents, only the sampled documents are
+        # fetched: for each stratum the sample_size documents with the highest seeded
+        # random score.
+        search_helper = SearchHelper(self._settings.type)
+        query = search_helper.query_text_query_string(query_string)
+        strata = self._fetch_export_strata(query, stratify_by)
+        _LOGGER.debug("Sampling from {} strata.", len(strata))
+
+        fieldnames = self._export_fieldnames()
+        with output_file.open("w", encoding="UTF-8", newline="") as fout, tqdm(
+            desc=output_file.name, total=len(strata), dynamic_ncols=True
+        ) as progress_bar:
+            csv_writer = csv.DictWriter(
+                fout, fieldnames=fieldnames, quoting=csv.QUOTE_NONNUMERIC
+            )
+            csv_writer.writeheader()
 
+            for strata_chunk in chunked(strata, _SAMPLE_STRATA_PER_REQUEST):
+                search = MultiSearch(index=self._settings.index)
+                for stratum_query in strata_chunk:
+                    stratified_query = query & stratum_query if stratum_query else query
+                    search = search.add(
+                        ElasticsearchSearch()
+                        .extra(size=sample_size)
+                        .query(search_helper.query_random_score(stratified_query, seed))
+                    )
+
+                for response in search.execute():
+                    for document in response.hits:
+                        csv_writer.writerow(_document_to_csv_row(document, fieldnames))
+                progress_bar.update(len(strata_chunk))
+
+    def _fetch_export_strata(
+        self, query: Query, stratify_by: Optional[ExportStratum]
+    ) -> Sequence[Optional[Query]]:
+        if not stratify_by:
+            return [None]
+
+        search_helper = SearchHelper(self._settings.type, self._settings.index)
+        search = ElasticsearchSearch(index=self._settings.index).extra(size=0)
+        search = search.query(query)
+
+        if stratify_by == ExportStratum.DAY:
+            search = search_helper.add_agg_text_tokens_date_histogram_terms(
+                search, calendar_interval="1d", size=0, include=None
+            )
+            response = search.execute()
+            result = []
+            for bucket, _ in search_helper.read_text_tokens_date_histogram_terms(
+                response
+            ):
+                if not bucket.doc_count:
+                    continue
+                day = datetime.fromtimestamp(bucket.key / 1000, timezone.utc).date()
+                result.append(
+                    search_helper.query_date_range(gte=day, lt=day + timedelta(days=1))
+                )
+            return result
+
+        elif stratify_by == ExportStratum.LANG:
+            search = search_helper.add_agg_lang_terms(search, _SAMPLE_MAX_STRATA)
+            response = search.execute()
+            return [
+                search_helper.query_lang_term(bucket.key)
+                for bucket in search_helper.read_agg_lang_terms(response)
+            ]
+
+        elif stratify_by == ExportStratum.URL_NETLOC:
+            if (
+                self._settings.type != DatasetType.NEWS_CSV
+                and self._settings.type != DatasetType.MAXQDA_CODED_NEWS_CSV
+            ):
+                raise ValueError(
+                    f"Can not stratify dataset of type '{self._settings.type.name}' "
+                    f"by {stratify_by.value}."
+                )
+
+            search = search_helper.add_agg_news_csv_url_netloc_terms(
+                search, _SAMPLE_MAX_STRATA
+            )
+            response = search.execute()
+            return [
+                search_helper.query_news_csv_url_netloc_term(bucket.key)
+                for bucket in search_helper.read_agg_news_csv_url_netloc_terms(response)
+            ]
+
+        else:
+            raise NotImplementedError()
+
+    def _export(
+        self,
+        query: Query,
+        output_files: Mapping[str, Path],
+        route_document: Callable[[Hit], Iterable[str]],
+        checkpoint_file: Path,
+        *,
+        desc: str,
+        resume: bool,
+    ) -> None:
+        search_helper = SearchHelper(self._settings.type)
+        fieldnames = self._export_fieldnames()
+
+        search_after: Optional[Sequence[object]] = None
+        num_received_documents = 0
+        file_offsets: Optional[Mapping[str, int]] = None
+        if resume:
+            search_after, num_received_documents, file_offsets = _load_checkpoint(
+                checkpoint_file, self._settings.index, query
+            )
+            _LOGGER.info(
+                "Resuming export to '{}' after {} documents.",
+                desc,
+                num_received_documents,
+            )
+
+        search = search_helper.sort_by_date_and_id(ElasticsearchSearch().query(query))
+        num_expected_documents: Optional[int] = None
+        with ExitStack() as stack:
+            fouts = {}
+            csv_writers = {}
+            for name, output_file in output_files.items():
+                fouts[name], csv_writers[name] = _open_csv_writer(
+                    stack,
+                    output_file,
+                    fieldnames,
+                    file_offsets[name] if file_offsets else None,
+                )
+
+            progress_bar = stack.enter_context(
+                tqdm(desc=desc, initial=num_received_documents, dynamic_ncols=True)
+            )
+
+            for response in _search_point_in_time(
+                self._settings.index, search, search_after
+            ):
+                if num_expected_documents is None:
+                    num_expected_documents = response.hits.total.value
+                    progress_bar.total = num_expected_documents
+
+                for document in response.hits:
+                    csv_row = _document_to_csv_row(document, fieldnames)
+                    for name in route_document(document):
+                        csv_writers[name].writerow(csv_row)
+                num_received_documents += len(response.hits)
+
+                for fout in fouts.values():
+                    fout.flush()
+                _save_checkpoint(
+                    checkpoint_file,
+                    self._settings.index,
+                    query,
+                    list(response.hits[-1].meta.sort),
+                    num_received_documents,
+                    {name: fout.tell() for name, fout in fouts.items()},
+                )
+                progress_bar.update(len(response.hits))
+
+        if checkpoint_file.exists():
+            checkpoint_file.unlink()
+
+        if (
+            num_expected_documents is not None
+            and num_expected_documents != num_received_documents
+        ):
+            _LOGGER.warning(
+                "Expected {} documents, but received {}.",
+                num_expected_documents,
+                num_received_documents,
+            )
+
+    def _export_fieldnames(self) -> Sequence[str]:
         if self._settings.type == DatasetType.NASTY:
-            fieldnames = (
+            return (
                 "created_at",
                 "favorite_count",
                 "full_text",
@@ -373,7 +774,7 @@ class Dataset:
             self._settings.type == DatasetType.NEWS_CSV
             or self._settings.type == DatasetType.MAXQDA_CODED_NEWS_CSV
         ):
-            fieldnames = (
+            fieldnames: Sequence[str] = (
                 "_id",
                 "lang",
                 "text",
@@ -386,16 +787,19 @@ class Dataset:
             )
 
             if self._settings.type == DatasetType.MAXQDA_CODED_NEWS_CSV:
-                fieldnames = fieldnames + (
+                fieldnames = tuple(fieldnames) + (
                     "document_id",
                     "document_group",
-                    "code_identifier" "code",
+                    "code_identifier",
+                    "code",
                     "segment",
                     "coverage",
                 )
 
+            return fieldnames
+
         elif self._settings.type == DatasetType.MAXQDA_CODED_NASTY:
-            fieldnames = (
+            return (
                 "_id",
                 "document_group",
                 "code_identifier",
@@ -409,43 +813,150 @@ class Dataset:
         else:
             raise NotImplementedError()
 
-        num_expected_documents = response.hits.total.value
-        num_received_documents = 0
 
-        with output_file.open("w", encoding="UTF-8", newline="") as fout:
-            csv_writer = csv.DictWriter(
-                fout, fieldnames=fieldnames, quoting=csv.QUOTE_NONNUMERIC
+def load_query_strings(file: Path) -> Mapping[str, str]:
+    query_strings = {}
+    with file.open(encoding="UTF-8", newline="") as fin:
+        for row in csv.DictReader(fin):
+            name = row["name"]
+            if not name or "/" in name or name.startswith("."):
+                raise ValueError(f"Invalid query name '{name}' in '{file}'.")
+            if name in query_strings:
+                raise ValueError(
+                    f"Query name '{name}' used multiple times in '{file}', but must be "
+                    "unique."
+                )
+            query_strings[name] = row["query"]
+    return query_strings
+
+
+def _search_point_in_time(
+    index: str, search: ElasticsearchSearch, search_after: Optional[Sequence[object]]
+) -> Iterator[Response]:
+    # Pages through all hits of the given (sorted) search via search_after on a point
+    # in time, i.e., a consistent view of the index that is unaffected by concurrent
+    # indexing. Only the first response tracks the total number of hits.
+    connection = get_connection()
+    pit_id = connection.open_point_in_time(index=index, keep_alive=_EXPORT_KEEP_ALIVE)[
+        "id"
+    ]
+    try:
+        track_total_hits = True
+        while True:
+            page = search.extra(
+                size=_EXPORT_PAGE_SIZE,
+                pit={"id": pit_id, "keep_alive": _EXPORT_KEEP_ALIVE},
+                track_total_hits=track_total_hits,
             )
-            csv_writer.writeheader()
-
-            for document in tqdm(
-                search.scan(),
-                desc=output_file.name,
-                total=num_expected_documents,
-                dynamic_ncols=True,
-            ):
-                num_received_documents += 1
-
-                csv_row = {}
-                for fieldname in fieldnames:
-                    if fieldname == "_id":
-                        csv_row[fieldname] = document.meta.id
-                        continue
-
-                    value = document
-                    for segment in fieldname.split("."):
-                        if segment not in value:
-                            value = None
-                            break
-                        else:
-                            value = getattr(value, segment)
-                    csv_row[fieldname] = value
+            if search_after is not None:
+                page = page.extra(search_after=search_after)
+
+            time_before = time()
+            response = page.execute()
+            time_after = time()
+            _LOGGER.debug("Search took {:.2}s", time_after - time_before)
+
+            # The point in time id may change between requests.
+            pit_id = response.pit_id
+            if not response.hits:
+                return
+
+            yield response
+            track_total_hits = False
+            search_after = list(response.hits[-1].meta.sort)
+    finally:
+        connection.close_point_in_time(body={"id": pit_id})
+
+
+def _open_csv_writer(
+    stack: ExitStack,
+    output_file: Path,
+    fieldnames: Sequence[str],
+    file_offset: Optional[int],
+) -> Tuple[TextIO, csv.DictWriter]:
+    # If a file offset is given, we resume writing to an existing file and discard
+    # everything that was written after the offset was recorded.
+    if file_offset is not None:
+        with output_file.open("r+b") as fout_binary:
+            fout_binary.truncate(file_offset)
+
+    fout = stack.enter_context(
+        output_file.open(
+            "w" if file_offset is None else "a", encoding="UTF-8", newline=""
+        )
+    )
+    csv_writer = csv.DictWriter(
+        fout, fieldnames=fieldnames, quoting=csv.QUOTE_NONNUMERIC
+    )
+    if file_offset is None:
+        csv_writer.writeheader()
+    return fout, csv_writer
+
+
+def _document_to_csv_row(
+    document: Hit, fieldnames: Sequence[str]
+) -> Mapping[str, object]:
+    csv_row = {}
+    for fieldname in fieldnames:
+        if fieldname == "_id":
+            csv_row[fieldname] = document.meta.id
+            continue
+
+        value = document
+        for segment in fieldname.split("."):
+            if segment not in value:
+                value = None
+                break
+            else:
+                value = getattr(value, segment)
+        csv_row[fieldname] = value
+    return csv_row
+
+
+def _save_checkpoint(
+    checkpoint_file: Path,
+    index: str,
+    query: Query,
+    search_after: Sequence[object],
+    num_received_documents: int,
+    file_offsets: Mapping[str, int],
+) -> None:
+    # Write to a temporary file first, so that a crash while writing can never leave
+    # a corrupt checkpoint behind.
+    tmp_file = checkpoint_file.with_name(checkpoint_file.name + ".tmp")
+    tmp_file.write_text(
+        json.dumps(
+            {
+                "index": index,
+                "query": query.to_dict(),
+                "search_after": search_after,
+                "num_received_documents": num_received_documents,
+                "file_offsets": file_offsets,
+            }
+        ),
+        encoding="UTF-8",
+    )
+    tmp_file.replace(checkpoint_file)
+
+
+def _load_checkpoint(
+    checkpoint_file: Path, index: str, query: Query
+) -> Tuple[Sequence[object], int, Mapping[str, int]]:
+    if not checkpoint_file.exists():
+        raise FileNotFoundError(
+            f"Can not resume export, checkpoint file '{checkpoint_file}' does not "
+            "exist."
+        )
 
-                csv_writer.writerow(csv_row)
+    checkpoint = json.loads(checkpoint_file.read_text(encoding="UTF-8"))
+    if checkpoint["index"] != index or checkpoint["query"] != query.to_dict():
+        raise ValueError(
+            f"Can not resume export, checkpoint file '{checkpoint_file}' was written "
+            "for a different index or query."
+        )
 
-        if num_expected_documents != num_received_documents:
-            _LOGGER.warning(
-                "Expected {} documents, but received {}.",
-                num_expected_documents,
-                num_expected_documents,
-            )
+    return (
+        checkpoint["search_after"],
+        checkpoint["num_received_documents"],
+        checkpoint["file_offsets"],
+    )
@@ -44,6 +44,7 @@ from overrides import overrides
 from somajo import SoMaJo
 from typing_extensions import Final
 
+from nasty_analysis._utils.stopwords import filter_non_letters_unicode, get_stopwords
 from nasty_analysis.document.maxqda_coded_nasty import MaxqdaCodedNastyDocument
 from nasty_analysis.document.maxqda_coded_news_csv import MaxqdaCodedNewsCsvDocument
 from nasty_analysis.document.news_csv import NewsCsvDocument
@@ -119,6 +120,13 @@ class TokenizedBaseDocument(BaseDocument):
                     doc_dict[field_name + "_orig"],
                     doc_dict[field_name + "_tokens"],
                 ) = cls._tokenize(checked_cast(str, value), lang)
+                (
+                    doc_dict[field_name + "_hashtags"],
+                    doc_dict[field_name + "_mentions"],
+                    doc_dict[field_name + "_content_words"],
+                ) = cls._split_tokens(
+                    cast(Sequence[str], doc_dict[field_name + "_tokens"]), lang
+                )
             elif isinstance(value, MutableMapping):
                 cls._tokenize_doc_dict(
                     value, cast(Mapping[str, object], text_field_or_childs), lang
@@ -159,9 +167,33 @@ class TokenizedBaseDocument(BaseDocument):
         ]
         return " ".join(tokens), text_orig, tokens
 
+    @classmethod
+    def _split_tokens(
+        cls, tokens: Sequence[str], lang: str
+    ) -> Tuple[Sequence[str], Sequence[str], Sequence[str]]:
+        # Same as the word filters of the visualization app, so that their
+        # aggregations can target these much smaller fields.
+        stopwords = get_stopwords(lang)
+        return (
+            [token for token in tokens if token.startswith("#")],
+            [token for token in tokens if token.startswith("@")],
+            [
+                token
+                for token in tokens
+                if token not in stopwords and filter_non_letters_unicode(token)
+            ],
+        )
+
 
 _T_BaseDocument = TypeVar("_T_BaseDocument", bound=BaseDocument)
 
+TOKENS_FIELD_SUFFIXES: Final[Sequence[str]] = (
+    "_tokens",
+    "_hashtags",
+    "_mentions",
+    "_content_words",
+)
+
 
 def tokenize_document_cls(
     document_cls: Type[_T_BaseDocument],
@@ -180,7 +212,7 @@ def tokenize_document_cls(
             return {
                 field_name: Text(**(text_parameters or {"analyzer": "whitespace"})),
                 field_name + "_orig": Keyword(doc_values=False, index=False),
-                field_name + "_tokens": Keyword(),
+                **{field_name + suffix: Keyword() for suffix in TOKENS_FIELD_SUFFIXES},
             }
         return {}
 
@@ -237,7 +269,32 @@ class TokenizedNastyBatchResultsTwitterDocument(
         lang_callback=_lang_from_field,
     )
 ):
-    pass
+    # Flat copies of the nested nasty_batch_meta.request fields, so that filtering and
+    # aggregating on them does not require nested queries and aggregations.
+    nasty_request_lang = Keyword()
+    nasty_request_filter = Keyword()
+    nasty_request_query = Keyword()
+
+    @classmethod
+    @overrides
+    def prepare_doc_dict(cls, doc_dict: MutableMapping[str, object]) -> None:
+        super().prepare_doc_dict(doc_dict)
+
+        batch_metas = doc_dict.get("nasty_batch_meta") or []
+        if isinstance(batch_metas, Mapping):
+            batch_metas = [batch_metas]
+        requests = [
+            cast(Mapping[str, object], batch_meta).get("request") or {}
+            for batch_meta in cast(Sequence[Mapping[str, object]], batch_metas)
+        ]
+        for name in ("lang", "filter", "query"):
+            doc_dict["nasty_request_" + name] = sorted(
+                {
+                    str(request[name])
+                    for request in cast(Sequence[Mapping[str, object]], requests)
+                    if request.get(name) is not None
+                }
+            )
 
 
 class TokenizedNewsCsvDocument(
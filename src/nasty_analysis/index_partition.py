@@ -0,0 +1,60 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import re
+from datetime import date, timedelta
+from typing import Optional, Pattern, Tuple
+
+from typing_extensions import Final
+
+from nasty_analysis.settings import IndexPartition
+
+_MONTH_SUFFIX_PATTERN: Final[Pattern[str]] = re.compile(r"(\d{4})-(\d{2})")
+_WEEK_SUFFIX_PATTERN: Final[Pattern[str]] = re.compile(r"(\d{4})-w(\d{2})")
+
+
+def partition_suffix(partition: IndexPartition, day: date) -> str:
+    if partition == IndexPartition.MONTH:
+        return f"{day.year:04d}-{day.month:02d}"
+
+    elif partition == IndexPartition.WEEK:
+        year, week, _ = day.isocalendar()
+        return f"{year:04d}-w{week:02d}"
+
+    else:
+        raise NotImplementedError()
+
+
+def partition_date_range(suffix: str) -> Optional[Tuple[date, date]]:
+    # Returns the first day and the day after the last day of the partition with the
+    # given suffix, or None if the suffix does not name a partition.
+    match = _MONTH_SUFFIX_PATTERN.fullmatch(suffix)
+    if match:
+        year, month = int(match.group(1)), int(match.group(2))
+        return (
+            date(year, month, 1),
+            date(year + month // 12, month % 12 + 1, 1),
+        )
+
+    match = _WEEK_SUFFIX_PATTERN.fullmatch(suffix)
+    if match:
+        year, week = int(match.group(1)), int(match.group(2))
+        # The 4th of January is always in the first ISO week of its year.
+        first_week_start = date(year, 1, 4) - timedelta(days=date(year, 1, 4).weekday())
+        start = first_week_start + timedelta(weeks=week - 1)
+        return start, start + timedelta(weeks=1)
+
+    return None
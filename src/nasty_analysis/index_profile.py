@@ -0,0 +1,145 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from logging import getLogger
+from typing import Any, Callable, MutableMapping, Type
+
+from elasticsearch_dsl import Index
+from elasticsearch_dsl.connections import get_connection
+from nasty_data import BaseDocument
+from nasty_data.elasticsearch_.index import new_index
+from nasty_utils import ColoredBraceStyleAdapter
+from typing_extensions import Final
+
+from nasty_analysis.document.tokenize import TOKENS_FIELD_SUFFIXES
+from nasty_analysis.search_helper import SearchHelper
+from nasty_analysis.settings import DatasetSection, IndexOptions, IndexProfile
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+# Terms aggregations on a single shard are exact and need no shard_size overhead,
+# which suits corpora of up to a few tens of millions of documents.
+_AGGREGATION_NUM_SHARDS: Final[int] = 1
+
+
+def _is_default_mapping(settings: DatasetSection) -> bool:
+    return (
+        settings.index_profile == IndexProfile.DEFAULT
+        and settings.index_num_shards is None
+        and settings.index_term_vectors
+        and settings.index_options == IndexOptions.OFFSETS
+        and not settings.index_phrases
+        and settings.index_store_orig
+    )
+
+
+def new_profiled_index(
+    index: str, document_cls: Type[BaseDocument], settings: DatasetSection
+) -> None:
+    if _is_default_mapping(settings):
+        new_index(index, document_cls)
+        return
+
+    body = _make_index_body(index, document_cls, settings)
+
+    index_ = Index(index)
+    if index_.exists():
+        _LOGGER.debug("Deleting existing index '{}'.", index)
+        index_.delete()
+    _LOGGER.debug(
+        "Creating index '{}' with profile {}.", index, settings.index_profile.name
+    )
+    get_connection().indices.create(index=index, body=body)
+
+
+def _make_index_body(
+    index: str, document_cls: Type[BaseDocument], settings: DatasetSection
+) -> MutableMapping[str, Any]:
+    index_ = Index(index)
+    index_.document(document_cls)
+    body = index_.to_dict()
+    index_settings = body.setdefault("settings", {})
+    mappings = body["mappings"]
+
+    if settings.index_num_shards is not None:
+        index_settings["number_of_shards"] = settings.index_num_shards
+
+    if settings.index_profile == IndexProfile.AGGREGATION:
+        index_settings.setdefault("number_of_shards", _AGGREGATION_NUM_SHARDS)
+        # Sorting segments by date lets requests for the latest documents terminate
+        # early and clusters documents of a date range in few blocks.
+        index_settings["sort.field"] = SearchHelper(settings.type).date_field
+        index_settings["sort.order"] = "desc"
+        # Build global ordinals on refresh instead of on the first terms
+        # aggregation after each refresh.
+        _for_each_field(mappings["properties"], _set_eager_global_ordinals)
+
+    def set_text_options(field_name: str, field: MutableMapping[str, Any]) -> None:
+        if field.get("type") != "text":
+            return
+        if not settings.index_term_vectors:
+            field.pop("term_vector", None)
+        # Word frequency aggregations only need the terms themselves. Without
+        # positions phrase queries fail, without freqs scoring ignores term counts.
+        field["index_options"] = settings.index_options.value.lower()
+        # Phrases are not indexed by default. Indexing them speeds up phrase queries,
+        # at the cost of an additional shingle field per text field.
+        if settings.index_phrases:
+            field["index_phrases"] = True
+
+    _for_each_field(mappings["properties"], set_text_options)
+
+    if not settings.index_store_orig:
+        # The _orig fields are neither indexed nor have doc values, so excluding them
+        # from _source drops them entirely. Exports then leave these columns empty.
+        mappings["_source"] = {"excludes": ["*_orig"]}
+
+    return body
+
+
+def _for_each_field(
+    properties: MutableMapping[str, Any],
+    callback: Callable[[str, MutableMapping[str, Any]], None],
+) -> None:
+    for field_name, field in properties.items():
+        if "properties" in field:
+            _for_each_field(field["properties"], callback)
+        else:
+            callback(field_name, field)
+
+
+def _set_eager_global_ordinals(
+    field_name: str, field: MutableMapping[str, Any]
+) -> None:
+    if field.get("type") == "keyword" and field_name.endswith(
+        tuple(TOKENS_FIELD_SUFFIXES)
+    ):
+        field["eager_global_ordinals"] = True
+
+
+def get_disk_usage_per_field(index: str) -> MutableMapping[str, Any]:
+    # Requires the _disk_usage API of Elasticsearch 7.15 or later, and a client that
+    # exposes it. Analyzing the disk usage reads all segments of the index, which is
+    # expensive.
+    response = get_connection().indices.disk_usage(
+        index=index, run_expensive_tasks=True
+    )
+    return {
+        field_name: usage
+        for index_usage in response.values()
+        if isinstance(index_usage, dict) and "fields" in index_usage
+        for field_name, usage in index_usage["fields"].items()
+    }
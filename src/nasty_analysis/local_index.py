@@ -0,0 +1,358 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import re
+from datetime import date, datetime
+from logging import getLogger
+from pathlib import Path
+from shutil import rmtree
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+from uuid import uuid4
+
+import numpy as np
+from elasticsearch_dsl import Search
+from nasty_utils import ColoredBraceStyleAdapter, parse_yyyy_mm_dd
+from tqdm import tqdm
+
+from nasty_analysis.rollup import get_source_values
+from nasty_analysis.search_helper import SearchHelper
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+
+class UnsupportedQueryError(Exception):
+    pass
+
+
+def _to_term(value: object) -> str:
+    # Same representation as the terms of keyword and boolean fields in Elasticsearch.
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _to_day(value: object) -> int:
+    if isinstance(value, datetime):
+        value = value.date()
+    if not isinstance(value, date):
+        value = parse_yyyy_mm_dd(str(value)[: len("yyyy-mm-dd")])
+    return value.toordinal()
+
+
+class LocalIndex:
+    # In-process index of the documents of a dataset for frequency analysis. Stores
+    # the day of each document, a sorted posting list of documents per term of each
+    # rollup field and the text tokens, and additionally the tokens per document.
+    # Filters of searches are evaluated as intersections of posting lists and
+    # frequencies are counted with NumPy, so that no Elasticsearch request is needed.
+
+    def __init__(self, directory: Path):
+        meta = json.loads((directory / "meta.json").read_text(encoding="UTF-8"))
+        self._date_field: str = meta["date_field"]
+        self._tokens_field: str = meta["tokens_field"]
+        self._fields: Sequence[str] = meta["fields"]
+        self._terms: Sequence[Sequence[str]] = meta["terms"]
+        self._term_ids: Sequence[Mapping[str, int]] = [
+            {term: i for i, term in enumerate(terms)} for terms in self._terms
+        ]
+
+        self._days = np.load(directory / "days.npy", mmap_mode="r")
+        self._postings = [
+            (
+                np.load(directory / f"field{i}.indptr.npy", mmap_mode="r"),
+                np.load(directory / f"field{i}.doc_ids.npy", mmap_mode="r"),
+            )
+            for i in range(len(self._fields))
+        ]
+        self._doc_indptr = np.load(directory / "tokens.indptr.npy", mmap_mode="r")
+        self._doc_term_ids = np.load(directory / "tokens.term_ids.npy", mmap_mode="r")
+
+        self._allowed_tokens_cache: Dict[Tuple[object, object], np.ndarray] = {}
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._days)
+
+    @classmethod
+    def build(cls, directory: Path, index: str, search_helper: SearchHelper) -> None:
+        # The last field holds the text tokens.
+        fields = [*search_helper.rollup_fields, search_helper.text_tokens_field]
+        term_ids: List[Dict[str, int]] = [{} for _ in fields]
+        doc_indptrs: List[List[int]] = [[0] for _ in fields]
+        doc_term_ids: List[List[int]] = [[] for _ in fields]
+        days = []
+
+        search = (
+            Search(index=index)
+            .source(fields)
+            .extra(
+                docvalue_fields=[
+                    {"field": search_helper.date_field, "format": "yyyy-MM-dd"}
+                ]
+            )
+        )
+        for hit in tqdm(search.scan(), desc=index, dynamic_ncols=True):
+            # Requested doc value fields are merged into the source of hits.
+            source = hit.to_dict()
+            days.append(_to_day(source[search_helper.date_field][0]))
+            for i, field in enumerate(fields):
+                for value in get_source_values(source, field):
+                    doc_term_ids[i].append(
+                        term_ids[i].setdefault(_to_term(value), len(term_ids[i]))
+                    )
+                doc_indptrs[i].append(len(doc_term_ids[i]))
+
+        # Write to a new directory first, so that loading never sees a partial index.
+        tmp_directory = directory.with_name(f"{directory.name}.tmp-{uuid4().hex}")
+        tmp_directory.mkdir(parents=True)
+        np.save(tmp_directory / "days.npy", np.array(days, dtype=np.int32))
+        for i in range(len(fields)):
+            indptr, doc_ids = cls._invert(
+                np.array(doc_indptrs[i], dtype=np.int64),
+                np.array(doc_term_ids[i], dtype=np.int32),
+                len(term_ids[i]),
+            )
+            np.save(tmp_directory / f"field{i}.indptr.npy", indptr)
+            np.save(tmp_directory / f"field{i}.doc_ids.npy", doc_ids)
+        np.save(
+            tmp_directory / "tokens.indptr.npy",
+            np.array(doc_indptrs[-1], dtype=np.int64),
+        )
+        np.save(
+            tmp_directory / "tokens.term_ids.npy",
+            np.array(doc_term_ids[-1], dtype=np.int32),
+        )
+        (tmp_directory / "meta.json").write_text(
+            json.dumps(
+                {
+                    "date_field": search_helper.date_field,
+                    "tokens_field": search_helper.text_tokens_field,
+                    "fields": fields,
+                    "terms": [list(ids.keys()) for ids in term_ids],
+                }
+            ),
+            encoding="UTF-8",
+        )
+
+        if directory.exists():
+            rmtree(directory)
+        tmp_directory.rename(directory)
+        _LOGGER.info("Built local index of {} documents in '{}'.", len(days), directory)
+
+    @classmethod
+    def _invert(
+        cls, doc_indptr: np.ndarray, term_ids: np.ndarray, num_terms: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        doc_ids = np.repeat(
+            np.arange(len(doc_indptr) - 1, dtype=np.int32), np.diff(doc_indptr)
+        )
+        # A stable sort keeps the documents of each term sorted.
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(term_ids, minlength=num_terms))
+        return indptr, doc_ids[order]
+
+    def match(self, query: Optional[Mapping[str, Any]]) -> np.ndarray:
+        # Evaluates the query of a search as a boolean mask over all documents.
+        if not query:
+            return np.ones(self.num_docs, dtype=np.bool_)
+        if len(query) != 1:
+            raise UnsupportedQueryError(f"Malformed query: {query}")
+
+        ((kind, params),) = query.items()
+        matchers: Mapping[str, Callable[[Any], np.ndarray]] = {
+            "match_all": lambda _params: self.match(None),
+            "bool": self._match_bool,
+            "term": self._match_term,
+            "terms": self._match_terms,
+            "range": self._match_range,
+        }
+        if kind not in matchers:
+            raise UnsupportedQueryError(f"Unsupported query type '{kind}'.")
+        return matchers[kind](params)
+
+    def _match_bool(self, params: Mapping[str, Any]) -> np.ndarray:
+        if set(params.keys()) - {"filter", "must"}:
+            raise UnsupportedQueryError("Only filter and must clauses are supported.")
+
+        mask = self.match(None)
+        for occur in ("filter", "must"):
+            clauses = params.get(occur, [])
+            for clause in clauses if isinstance(clauses, list) else [clauses]:
+                mask &= self.match(clause)
+        return mask
+
+    def _match_term(self, params: Mapping[str, Any]) -> np.ndarray:
+        ((field, value),) = params.items()
+        if isinstance(value, Mapping):
+            value = value["value"]
+        return self._match_terms({field: [value]})
+
+    def _match_terms(self, params: Mapping[str, Any]) -> np.ndarray:
+        ((field, values),) = params.items()
+        if field not in self._fields:
+            raise UnsupportedQueryError(f"Field '{field}' is not in the local index.")
+
+        i = self._fields.index(field)
+        indptr, doc_ids = self._postings[i]
+        mask = np.zeros(self.num_docs, dtype=np.bool_)
+        for value in values:
+            term_id = self._term_ids[i].get(_to_term(value))
+            if term_id is not None:
+                mask[doc_ids[indptr[term_id] : indptr[term_id + 1]]] = True
+        return mask
+
+    def _match_range(self, params: Mapping[str, Any]) -> np.ndarray:
+        ((field, bounds),) = params.items()
+        if field != self._date_field:
+            raise UnsupportedQueryError(f"Range on field '{field}' is unsupported.")
+
+        # Ranges are evaluated with the granularity of days.
+        mask = self.match(None)
+        comparisons: Mapping[str, Callable[[np.ndarray, int], np.ndarray]] = {
+            "gt": np.greater,
+            "gte": np.greater_equal,
+            "lt": np.less,
+            "lte": np.less_equal,
+        }
+        for name, value in bounds.items():
+            if name not in comparisons:
+                raise UnsupportedQueryError(f"Unsupported range parameter '{name}'.")
+            mask &= comparisons[name](self._days, _to_day(value))
+        return mask
+
+    def count_per_day(
+        self,
+        mask: np.ndarray,
+        dates: Sequence[date],
+        *,
+        size: Optional[int] = None,
+        words: Optional[Sequence[str]] = None,
+        include: Optional[object] = None,
+        exclude: Optional[object] = None,
+    ) -> Tuple[np.ndarray, Mapping[str, np.ndarray]]:
+        # Returns the number of matching documents per date, and the number of matching
+        # documents per token and date, either for the given words or for the size most
+        # frequent tokens of each date. Include and exclude work like for terms
+        # aggregations.
+        doc_positions = self._doc_positions(dates)
+        mask = mask & (doc_positions >= 0)
+        num_docs = np.bincount(doc_positions[mask], minlength=len(dates))
+
+        docs = np.flatnonzero(mask)
+        starts = self._doc_indptr[docs]
+        lengths = self._doc_indptr[docs + 1] - starts
+        postings = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        postings += np.arange(len(postings))
+        term_ids = self._doc_term_ids[postings]
+        positions = np.repeat(doc_positions[docs], lengths)
+
+        allowed = self._allowed_tokens(words, include, exclude)
+        selected = allowed[term_ids]
+        keys = term_ids[selected].astype(np.int64) * len(dates) + positions[selected]
+        keys, counts = np.unique(keys, return_counts=True)
+        key_term_ids, key_positions = np.divmod(keys, len(dates))
+
+        if size is not None:
+            # Keep the size most frequent tokens per date.
+            order = np.lexsort((-counts, key_positions))
+            group_starts = np.searchsorted(key_positions[order], key_positions[order])
+            keep = order[np.arange(len(order)) - group_starts < size]
+            key_term_ids, key_positions, counts = (
+                key_term_ids[keep],
+                key_positions[keep],
+                counts[keep],
+            )
+
+        tokens = self._terms[-1]
+        word_freqs: MutableMapping[str, np.ndarray] = {}
+        for term_id, position, count in zip(
+            key_term_ids.tolist(), key_positions.tolist(), counts.tolist()
+        ):
+            token = tokens[term_id]
+            if token not in word_freqs:
+                word_freqs[token] = np.zeros(len(dates), dtype=np.int32)
+            word_freqs[token][position] = count
+        return num_docs, word_freqs
+
+    def _doc_positions(self, dates: Sequence[date]) -> np.ndarray:
+        # Index of the day of each document in the dates, or -1.
+        if not dates:
+            return np.full(self.num_docs, -1, dtype=np.int64)
+        ordinals = np.array([d.toordinal() for d in dates], dtype=np.int64)
+        first = ordinals.min()
+        lookup = np.full(ordinals.max() - first + 1, -1, dtype=np.int64)
+        lookup[ordinals - first] = np.arange(len(dates))
+        offsets = self._days - first
+        in_range = (offsets >= 0) & (offsets < len(lookup))
+        return np.where(in_range, lookup[np.clip(offsets, 0, len(lookup) - 1)], -1)
+
+    def _allowed_tokens(
+        self,
+        words: Optional[Sequence[str]],
+        include: Optional[object],
+        exclude: Optional[object],
+    ) -> np.ndarray:
+        if words is not None:
+            return self._allowed_tokens_for_words(words)
+
+        key = (
+            tuple(include) if isinstance(include, list) else include,
+            tuple(exclude) if isinstance(exclude, list) else exclude,
+        )
+        if key not in self._allowed_tokens_cache:
+            included = self._matches_terms(include, default=True)
+            excluded = self._matches_terms(exclude, default=False)
+            self._allowed_tokens_cache[key] = np.array(
+                [included(token) and not excluded(token) for token in self._terms[-1]],
+                dtype=np.bool_,
+            )
+        return self._allowed_tokens_cache[key]
+
+    def _allowed_tokens_for_words(self, words: Sequence[str]) -> np.ndarray:
+        allowed = np.zeros(len(self._terms[-1]), dtype=np.bool_)
+        for word in words:
+            term_id = self._term_ids[-1].get(word)
+            if term_id is not None:
+                allowed[term_id] = True
+        return allowed
+
+    @classmethod
+    def _matches_terms(
+        cls, terms: Optional[object], *, default: bool
+    ) -> Callable[[str], bool]:
+        # Include and exclude of terms aggregations are either a regular expression
+        # or a list of exact terms.
+        if terms is None:
+            return lambda _token: default
+        if isinstance(terms, str):
+            pattern = re.compile(terms)
+            return lambda token: pattern.fullmatch(token) is not None
+        term_set: AbstractSet[str] = set(cast(Sequence[str], terms))
+        return lambda token: token in term_set
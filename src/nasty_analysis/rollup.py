@@ -0,0 +1,184 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from collections import Counter
+from datetime import date, timedelta
+from functools import lru_cache
+from hashlib import sha256
+from logging import getLogger
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+)
+
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl import Index, Search
+from elasticsearch_dsl.connections import get_connection
+from nasty_utils import ColoredBraceStyleAdapter, date_range
+from typing_extensions import Final
+
+from nasty_analysis.search_helper import SearchHelper
+from nasty_analysis.settings import DatasetSection
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+_ROLLUP_SUFFIX: Final[str] = "-rollup"
+
+# The values of all rollup fields of a document, which is what it is rolled up by.
+_RollupKey = Tuple[Tuple[object, ...], ...]
+
+
+def rollup_index(index: str) -> str:
+    return index + _ROLLUP_SUFFIX
+
+
+@lru_cache(maxsize=None, typed=True)
+def has_rollup(index: str) -> bool:
+    # Cached for the lifetime of the process, so a rollup index that is created later
+    # is only used after a restart.
+    return bool(Index(rollup_index(index)).exists())
+
+
+def update_rollup(
+    settings: DatasetSection, days: Optional[Iterable[date]] = None
+) -> None:
+    # The rollup index contains one document per day and distinct combination of
+    # values of the rollup fields, with its _doc_count set to the number of documents
+    # it stands for, and one such document per token that occurred in them. Queries
+    # on the rollup fields and bucket aggregations therefore return the same document
+    # counts as on the dataset index. Given days are recomputed completely.
+    search_helper = SearchHelper(settings.type, settings.index)
+    index = rollup_index(settings.index)
+    if not Index(index).exists():
+        _new_rollup_index(index, settings.index, search_helper)
+
+    if days is None:
+        # Missing dates default to 1900 for some entries, which would otherwise make
+        # us roll up a century of empty days.
+        response = search_helper.add_agg_date_min_max(
+            Search(index=settings.index).extra(size=0), gte=date(2000, 1, 1)
+        ).execute()
+        days = date_range(*search_helper.read_agg_date_min_max(response))
+
+    connection = get_connection()
+    for day in days:
+        _LOGGER.debug("Rolling up day {} of index '{}'.", day, settings.index)
+        Search(index=index).filter(
+            search_helper.query_date_range(gte=day, lt=day + timedelta(days=1))
+        ).params(refresh=True).delete()
+        bulk(connection, _make_rollup_docs(settings.index, search_helper, day))
+
+    Index(index).refresh()
+
+
+def _new_rollup_index(
+    index: str, source_index: str, search_helper: SearchHelper
+) -> None:
+    source_properties = next(iter(Index(source_index).get_mapping().values()))[
+        "mappings"
+    ]["properties"]
+
+    properties: MutableMapping[str, Any] = {
+        search_helper.date_field: {"type": "date"},
+    }
+    for field in (*search_helper.rollup_fields, search_helper.text_tokens_field):
+        cur_source_properties, cur_properties = source_properties, properties
+        *parents, name = field.split(".")
+        for parent in parents:
+            cur_source_properties = cur_source_properties[parent]["properties"]
+            cur_properties = cur_properties.setdefault(parent, {"properties": {}})[
+                "properties"
+            ]
+        cur_properties[name] = cur_source_properties[name]
+
+    _LOGGER.debug("Creating rollup index '{}'.", index)
+    get_connection().indices.create(
+        index=index, body={"mappings": {"dynamic": "strict", "properties": properties}}
+    )
+
+
+def _make_rollup_docs(
+    index: str, search_helper: SearchHelper, day: date
+) -> Iterator[Mapping[str, object]]:
+    fields = search_helper.rollup_fields
+    tokens_field = search_helper.text_tokens_field
+
+    num_docs: "Counter[_RollupKey]" = Counter()
+    num_docs_by_token: "Counter[Tuple[_RollupKey, str]]" = Counter()
+    search = search_helper.filter_date_range(
+        Search(index=index), gte=day, lt=day + timedelta(days=1)
+    ).source([*fields, tokens_field])
+    for hit in search.scan():
+        source = hit.to_dict()
+        key = tuple(get_source_values(source, field) for field in fields)
+        num_docs[key] += 1
+        # Terms aggregations count documents, not occurrences.
+        for token in set(source.get(tokens_field) or ()):
+            num_docs_by_token[key, token] += 1
+
+    for key, count in num_docs.items():
+        yield _make_rollup_doc(
+            rollup_index(index), search_helper, day, key, None, count
+        )
+    for (key, token), count in num_docs_by_token.items():
+        yield _make_rollup_doc(
+            rollup_index(index), search_helper, day, key, token, count
+        )
+
+
+def get_source_values(source: Mapping[str, object], field: str) -> Tuple[object, ...]:
+    values: List[object] = [source]
+    for name in field.split("."):
+        inner_values: List[object] = []
+        for value in values:
+            if isinstance(value, Mapping) and value.get(name) is not None:
+                inner_value = value[name]
+                if isinstance(inner_value, list):
+                    inner_values.extend(inner_value)
+                else:
+                    inner_values.append(inner_value)
+        values = inner_values
+    return tuple(sorted(set(values), key=str))
+
+
+def _make_rollup_doc(
+    index: str,
+    search_helper: SearchHelper,
+    day: date,
+    key: _RollupKey,
+    token: Optional[str],
+    doc_count: int,
+) -> Mapping[str, object]:
+    source: MutableMapping[str, object] = {
+        search_helper.date_field: day.isoformat(),
+        "_doc_count": doc_count,
+    }
+    for field, values in zip(search_helper.rollup_fields, key):
+        source[field] = list(values)
+    if token is not None:
+        source[search_helper.text_tokens_field] = token
+
+    id_ = sha256(
+        json.dumps([day.isoformat(), key, token], default=str).encode("UTF-8")
+    ).hexdigest()
+    return {"_index": index, "_id": id_, "_source": source}
@@ -15,14 +15,18 @@
 #
 
 from copy import copy
-from datetime import date
-from typing import Iterator, Optional, Sequence, Tuple
+from datetime import date, datetime, timedelta, timezone
+from enum import Enum
+from functools import lru_cache
+from typing import AbstractSet, Iterator, Mapping, Optional, Sequence, Tuple, cast
 
-from elasticsearch_dsl import AttrDict, Search, aggs, query
+from elasticsearch_dsl import AttrDict, Index, Search, aggs, query
+from elasticsearch_dsl.aggs import AggBase
 from elasticsearch_dsl.query import Query
 from elasticsearch_dsl.response import Response
-from elasticsearch_dsl.response.aggs import Bucket
+from elasticsearch_dsl.response.aggs import AggResponse, Bucket
 
+from nasty_analysis.index_partition import partition_date_range
 from nasty_analysis.settings import DatasetType
 
 
@@ -30,12 +34,73 @@ class IncorrectDatasetTypeError(Exception):
     pass
 
 
+class TextTokensSubset(Enum):
+    HASHTAGS = "hashtags"
+    MENTIONS = "mentions"
+    CONTENT_WORDS = "content_words"
+
+
+@lru_cache(maxsize=None, typed=True)
+def _get_index_fields(index: str) -> AbstractSet[str]:
+    # Cached for the lifetime of the process, so fields added by reindexing are only
+    # picked up after a restart. For aliases, only fields that exist in all concrete
+    # indices are returned.
+    def collect_fields(properties: Mapping[str, object], prefix: str) -> Iterator[str]:
+        for name, field in properties.items():
+            yield prefix + name
+            inner_properties = cast(Mapping[str, object], field).get("properties")
+            if inner_properties:
+                yield from collect_fields(
+                    cast(Mapping[str, object], inner_properties), prefix + name + "."
+                )
+
+    fields_by_index = [
+        set(collect_fields(mapping["mappings"].get("properties", {}), ""))
+        for mapping in Index(index).get_mapping().values()
+    ]
+    return frozenset(set.intersection(*fields_by_index) if fields_by_index else ())
+
+
+@lru_cache(maxsize=None, typed=True)
+def _get_partitions(index: str) -> Sequence[Tuple[str, date, date]]:
+    # Concrete indices behind the given alias that are named like its partitions,
+    # together with the first day and the day after the last day they contain. Cached
+    # for the lifetime of the process until clear_partitions_cache() is called, which
+    # indexing and each refresh of the serve context do. Serving partitioned datasets
+    # therefore needs a context_refresh_interval to pick up new partitions, except for
+    # those after the last cached one, see SearchHelper.filter_date_range().
+    result = []
+    for concrete_index in Index(index).get_alias().keys():
+        if not concrete_index.startswith(index + "-"):
+            continue
+        date_range = partition_date_range(concrete_index[len(index) + 1 :])
+        if date_range:
+            result.append((concrete_index, *date_range))
+    return tuple(sorted(result, key=lambda partition: partition[1]))
+
+
+def clear_partitions_cache() -> None:
+    _get_partitions.cache_clear()
+
+
 class SearchHelper:
-    def __init__(self, dataset_type: DatasetType):
+    def __init__(
+        self,
+        dataset_type: DatasetType,
+        index: Optional[str] = None,
+        *,
+        rollup: bool = False,
+    ):
+        # With rollup, the index is a rollup index of the dataset, in which documents
+        # count as many original documents as their _doc_count and the per-day totals
+        # are the documents without text tokens.
         self._dataset_type = dataset_type
+        self._index = index
+        self._rollup = rollup
+        self._partitions: Optional[Sequence[Tuple[str, date, date]]] = None
 
     @property
-    def _date_field(self) -> str:
+    def date_field(self) -> str:
         return {
             DatasetType.NASTY: "created_at",
             DatasetType.NEWS_CSV: "time",
@@ -43,6 +108,19 @@ class SearchHelper:
             DatasetType.MAXQDA_CODED_NEWS_CSV: "time",
         }[self._dataset_type]
 
+    @property
+    def id_field(self) -> str:
+        # A field that is unique per document and has doc values, so that it can be
+        # sorted on. Only tweets have one, for the other types sorting on _id requires
+        # fielddata on _id (indices.id_field_data.enabled), which is deprecated in
+        # Elasticsearch 7 and disabled by default in Elasticsearch 8.
+        return {
+            DatasetType.NASTY: "id_str",
+            DatasetType.NEWS_CSV: "_id",
+            DatasetType.MAXQDA_CODED_NASTY: "_id",
+            DatasetType.MAXQDA_CODED_NEWS_CSV: "_id",
+        }[self._dataset_type]
+
     def query_date_range(
         self,
         gt: Optional[date] = None,
@@ -67,18 +145,90 @@ class SearchHelper:
         if not range_kwargs:
             raise ValueError("At least one of gt, gte, lt, lte must be given.")
 
-        return query.Range(**{self._date_field: range_kwargs})
+        return query.Range(**{self.date_field: range_kwargs})
 
-    def add_agg_date_min_max(self, search: Search) -> Search:
+    def filter_date_range(
+        self,
+        search: Search,
+        gt: Optional[date] = None,
+        gte: Optional[date] = None,
+        lt: Optional[date] = None,
+        lte: Optional[date] = None,
+    ) -> Search:
+        # Filters the given search on the index of this helper to the date range. If
+        # that index is an alias of time partitions, the search is restricted to the
+        # partitions overlapping the date range.
+        search = search.filter(self.query_date_range(gt=gt, gte=gte, lt=lt, lte=lte))
+        if self._index is None:
+            return search
+
+        if self._partitions is None:
+            self._partitions = self._get_partitions(
+                (lt - timedelta(days=1)) if lt else (lte or gt or gte)
+            )
+        if not self._partitions:
+            return search
+
+        min_date = gt or gte
+        max_date = lt or lte
+        indices = [
+            partition_index
+            for partition_index, start_date, end_date in self._partitions
+            if (min_date is None or end_date > min_date)
+            and (max_date is None or start_date <= max_date)
+        ]
+        if not indices:
+            # The date filter matches nothing in this case, but an empty list of
+            # indices would search all indices.
+            indices = [self._partitions[0][0]]
+        return search.index().index(*indices)
+
+    def _get_partitions(
+        self, last_day: Optional[date]
+    ) -> Sequence[Tuple[str, date, date]]:
+        assert self._index is not None
+        partitions = _get_partitions(self._index)
+        # Dates after the last cached partition may be in a partition that was created
+        # since, so look the partitions up again in that case.
+        if partitions and last_day is not None and last_day >= partitions[-1][2]:
+            clear_partitions_cache()
+            partitions = _get_partitions(self._index)
+        return partitions
+
+    def sort_by_date_and_id(self, search: Search) -> Search:
+        # Sorting by a unique id as a tie breaker makes the order independent of the
+        # point in time or scroll context, which is required to resume via
+        # search_after.
+        return search.sort({self.date_field: "asc"}, {self.id_field: "asc"})
+
+    @classmethod
+    def query_random_score(cls, q: Query, seed: int) -> Query:
+        # Scoring by _seq_no makes the random scores reproducible for a given seed
+        # without needing fielddata on _id.
+        return query.FunctionScore(
+            query=q,
+            functions=[query.SF("random_score", seed=seed, field="_seq_no")],
+            boost_mode="replace",
+        )
+
+    def add_agg_date_min_max(
+        self, search: Search, gte: Optional[date] = None
+    ) -> Search:
         search = copy(search)
-        search.aggs.metric("min_date", aggs.Min(field=self._date_field))
-        search.aggs.metric("max_date", aggs.Max(field=self._date_field))
+        a = search.aggs
+        if gte:
+            # Only restrict the aggregation and not the search query, so that other
+            # aggregations can be computed in the same request.
+            a = a.bucket("date_range", aggs.Filter(self.query_date_range(gte=gte)))
+        a.metric("min_date", aggs.Min(field=self.date_field))
+        a.metric("max_date", aggs.Max(field=self.date_field))
         return search
 
     def read_agg_date_min_max(self, response: Response) -> Tuple[date, date]:
+        result = getattr(response.aggs, "date_range", response.aggs)
         return (
-            date.fromtimestamp(response.aggs.min_date.value / 1000),
-            date.fromtimestamp(response.aggs.max_date.value / 1000),
+            date.fromtimestamp(result.min_date.value / 1000),
+            date.fromtimestamp(result.max_date.value / 1000),
         )
 
     @classmethod
@@ -89,23 +239,55 @@ class SearchHelper:
         return q
 
     @classmethod
-    def _add_agg_terms(cls, search: Search, size: int, field: Sequence[str]) -> Search:
+    def _add_agg_terms(
+        cls,
+        search: Search,
+        size: int,
+        field: Sequence[str],
+        include: Optional[object] = None,
+        exclude: Optional[object] = None,
+    ) -> Search:
         search = copy(search)
-        a = search.aggs
+        cls._add_agg_terms_to(search.aggs, size, field, include, exclude)
+        return search
+
+    @classmethod
+    def _add_agg_terms_to(
+        cls,
+        a: AggBase,
+        size: int,
+        field: Sequence[str],
+        include: Optional[object] = None,
+        exclude: Optional[object] = None,
+    ) -> None:
         for i in range(len(field) - 1):
-            a = a.bucket(
-                field[i].replace(".", "__"), aggs.Nested(path=".".join(field[: i + 1]))
-            )
+            name = field[i].replace(".", "__")
+            # Reuse nested aggregations so that multiple terms aggregations on the same
+            # nested path can be added to one search.
+            if name in a:
+                a = a[name]
+            else:
+                a = a.bucket(name, aggs.Nested(path=".".join(field[: i + 1])))
+        kwargs = {}
+        if include is not None:
+            kwargs["include"] = include
+        if exclude is not None:
+            kwargs["exclude"] = exclude
         a.bucket(
-            field[-1].replace(".", "__"), aggs.Terms(field=".".join(field), size=size)
+            field[-1].replace(".", "__"),
+            aggs.Terms(field=".".join(field), size=size, **kwargs),
         )
-        return search
 
     @classmethod
     def _read_agg_terms(
         cls, response: Response, field: Sequence[str]
     ) -> Iterator[Bucket]:
-        result = response.aggs
+        yield from cls._read_agg_terms_from(response.aggs, field)
+
+    @classmethod
+    def _read_agg_terms_from(
+        cls, result: AggResponse, field: Sequence[str]
+    ) -> Iterator[Bucket]:
         for f in field:
             result = getattr(result, f.replace(".", "__"))
         yield from result.buckets
@@ -117,10 +299,57 @@ class SearchHelper:
             q = query.Nested(path=".".join(field[: i + 1]), query=q)
         return q
 
+    def _prefer_flat_field(
+        self, field: Sequence[str], flat_field: str
+    ) -> Sequence[str]:
+        # Nested queries and aggregations are expensive, so use the flat copy of a
+        # nested field if documents were indexed with it.
+        if self._index is not None and flat_field in _get_index_fields(self._index):
+            return (flat_field,)
+        return field
+
+    @property
+    def has_flat_nasty_request_fields(self) -> bool:
+        return (
+            self._index is not None
+            and self._dataset_type == DatasetType.NASTY
+            and self._nasty_query_field == ("nasty_request_query",)
+        )
+
+    @property
+    def rollup_fields(self) -> Sequence[str]:
+        # The fields the visualization app filters on, which are kept in the rollup.
+        fields = [self._lang_field]
+        if self._dataset_type == DatasetType.NASTY:
+            fields += [
+                self._nasty_filter_field,
+                self._nasty_query_field,
+                self._nasty_user_verified_field,
+            ]
+        if (
+            self._dataset_type == DatasetType.NEWS_CSV
+            or self._dataset_type == DatasetType.MAXQDA_CODED_NEWS_CSV
+        ):
+            fields.append(self._news_csv_url_netloc_field)
+        if (
+            self._dataset_type == DatasetType.MAXQDA_CODED_NASTY
+            or self._dataset_type == DatasetType.MAXQDA_CODED_NEWS_CSV
+        ):
+            fields.append(self._maxqda_coded_code_identifier_field)
+
+        if any(len(field) != 1 for field in fields):
+            raise ValueError(
+                "Can not roll up nested fields. Index the dataset into a new index to "
+                "add their flat copies."
+            )
+        return [field[0] for field in fields]
+
     @property
     def _lang_field(self) -> Sequence[str]:
         return {
-            DatasetType.NASTY: ("nasty_batch_meta", "request.lang"),
+            DatasetType.NASTY: self._prefer_flat_field(
+                ("nasty_batch_meta", "request.lang"), "nasty_request_lang"
+            ),
             DatasetType.NEWS_CSV: ("lang",),
             DatasetType.MAXQDA_CODED_NASTY: ("lang",),
             DatasetType.MAXQDA_CODED_NEWS_CSV: ("lang",),
@@ -144,11 +373,16 @@ class SearchHelper:
             DatasetType.MAXQDA_CODED_NEWS_CSV: "segment",
         }[self._dataset_type]
 
-    def query_text_query_string(self, query_string: str) -> Query:
-        return query.QueryString(query=query_string, default_field=self._text_field)
+    def query_text_query_string(
+        self, query_string: str, *, name: Optional[str] = None
+    ) -> Query:
+        kwargs = {"_name": name} if name else {}
+        return query.QueryString(
+            query=query_string, default_field=self._text_field, **kwargs
+        )
 
     @property
-    def _text_tokens_field(self) -> str:
+    def text_tokens_field(self) -> str:
         return {
             DatasetType.NASTY: "full_text_tokens",
             DatasetType.NEWS_CSV: "text_tokens",
@@ -157,13 +391,142 @@ class SearchHelper:
         }[self._dataset_type]
 
     def query_text_tokens_term(self, value: str) -> Query:
-        return self._query_term(value, (self._text_tokens_field,))
+        return self._query_term(value, (self.text_tokens_field,))
 
-    def add_agg_text_tokens_terms(self, search: Search, size: int) -> Search:
-        return self._add_agg_terms(search, size, (self._text_tokens_field,))
+    def has_text_tokens_subset_field(self, subset: TextTokensSubset) -> bool:
+        # Requires the index to check whether documents were indexed with the field.
+        return (
+            self._index is not None
+            and f"{self._text_field}_{subset.value}" in _get_index_fields(self._index)
+        )
 
-    def read_agg_text_tokens_terms(self, response: Response) -> Iterator[Bucket]:
-        return self._read_agg_terms(response, (self._text_tokens_field,))
+    def _text_tokens_subset_field(self, subset: Optional[TextTokensSubset]) -> str:
+        # Falls back to all tokens if the index has no field for the subset.
+        if subset is None or not self.has_text_tokens_subset_field(subset):
+            return self.text_tokens_field
+        return f"{self._text_field}_{subset.value}"
+
+    def add_agg_text_tokens_terms(
+        self,
+        search: Search,
+        size: int,
+        include: Optional[object] = None,
+        exclude: Optional[object] = None,
+        subset: Optional[TextTokensSubset] = None,
+    ) -> Search:
+        return self._add_agg_terms(
+            search, size, (self._text_tokens_subset_field(subset),), include, exclude
+        )
+
+    def read_agg_text_tokens_terms(
+        self, response: Response, subset: Optional[TextTokensSubset] = None
+    ) -> Iterator[Bucket]:
+        return self._read_agg_terms(response, (self._text_tokens_subset_field(subset),))
+
+    def add_agg_text_tokens_cardinality(
+        self, search: Search, subset: Optional[TextTokensSubset] = None
+    ) -> Search:
+        # Approximate number of distinct words.
+        search = copy(search)
+        search.aggs.bucket(
+            "text_tokens_cardinality",
+            aggs.Cardinality(field=self._text_tokens_subset_field(subset)),
+        )
+        return search
+
+    def read_agg_text_tokens_cardinality(self, response: Response) -> int:
+        return cast(int, response.aggs.text_tokens_cardinality.value)
+
+    def add_agg_sampled_text_tokens_terms(
+        self,
+        search: Search,
+        shard_size: int,
+        size: int,
+        include: Optional[object] = None,
+        exclude: Optional[object] = None,
+        subset: Optional[TextTokensSubset] = None,
+        seed: int = 0,
+    ) -> Search:
+        # Only aggregates over the shard_size highest scoring documents of each shard.
+        # Filters all score the same, which would make this sample the oldest
+        # documents, so documents are scored randomly instead. Scores of any other
+        # non-filter queries would be added to the random ones.
+        search = search.query(self.query_random_score(query.MatchAll(), seed))
+        self._add_agg_terms_to(
+            search.aggs.bucket("sample", aggs.Sampler(shard_size=shard_size)),
+            size,
+            (self._text_tokens_subset_field(subset),),
+            include,
+            exclude,
+        )
+        return search
+
+    def read_agg_sampled_text_tokens_terms(
+        self, response: Response, subset: Optional[TextTokensSubset] = None
+    ) -> Tuple[int, Iterator[Bucket]]:
+        return (
+            cast(int, response.aggs.sample.doc_count),
+            self._read_agg_terms_from(
+                response.aggs.sample, (self._text_tokens_subset_field(subset),)
+            ),
+        )
+
+    def add_agg_text_tokens_date_composite(
+        self, search: Search, size: int, after: Optional[Mapping[str, object]] = None
+    ) -> Search:
+        # Pages through all pairs of words and days, ordered by word and then by day.
+        search = copy(search)
+        kwargs = {"after": after} if after is not None else {}
+        search.aggs.bucket(
+            "text_tokens_date",
+            aggs.Composite(
+                sources=[
+                    {"token": aggs.Terms(field=self.text_tokens_field)},
+                    {
+                        "date": aggs.DateHistogram(
+                            field=self.date_field, calendar_interval="1d"
+                        )
+                    },
+                ],
+                size=size,
+                **kwargs,
+            ),
+        )
+        return search
+
+    def read_agg_text_tokens_date_composite(
+        self, response: Response
+    ) -> Tuple[Optional[Mapping[str, object]], Sequence[Tuple[str, date, int]]]:
+        # Returns the key to continue after (None if there are no more pages) and the
+        # number of documents per word and day.
+        result = response.aggs.text_tokens_date
+        buckets = [
+            (
+                bucket.key.token,
+                datetime.fromtimestamp(bucket.key.date / 1000, timezone.utc).date(),
+                bucket.doc_count,
+            )
+            for bucket in result.buckets
+        ]
+        after_key = getattr(result, "after_key", None)
+        return (after_key.to_dict() if after_key and buckets else None), buckets
+
+    def add_agg_num_docs(self, search: Search) -> Search:
+        if not self._rollup:
+            return search.extra(track_total_hits=True)
+        search = copy(search)
+        search.aggs.bucket("num_docs", aggs.Missing(field=self.text_tokens_field))
+        return search
+
+    def read_agg_num_docs(self, response: Response) -> int:
+        if not self._rollup:
+            return cast(int, response.hits.total.value)
+        return cast(int, response.aggs.num_docs.doc_count)
+
+    def read_date_histogram_bucket_num_docs(self, bucket: Bucket) -> int:
+        if not self._rollup:
+            return cast(int, bucket.doc_count)
+        return cast(int, bucket.num_docs.doc_count)
 
     def add_agg_text_tokens_date_histogram_terms(
         self,
@@ -174,16 +537,18 @@ class SearchHelper:
     ) -> Search:
         search = copy(search)
         a = search.aggs.bucket(
-            self._date_field.replace(".", "__"),
+            self.date_field.replace(".", "__"),
             aggs.DateHistogram(
-                field=self._date_field, calendar_interval=calendar_interval
+                field=self.date_field, calendar_interval=calendar_interval
             ),
         )
+        if self._rollup:
+            a.bucket("num_docs", aggs.Missing(field=self.text_tokens_field))
         if size:
             a.bucket(
-                self._text_tokens_field.replace(".", "__"),
+                self.text_tokens_field.replace(".", "__"),
                 aggs.Terms(
-                    field=self._text_tokens_field,
+                    field=self.text_tokens_field,
                     size=size,
                     include=include,
                 ),
@@ -194,28 +559,32 @@ class SearchHelper:
         self, response: Response
     ) -> Iterator[Tuple[Bucket, Sequence[Bucket]]]:
         for bucket in getattr(
-            response.aggs, self._date_field.replace(".", "__")
+            response.aggs, self.date_field.replace(".", "__")
         ).buckets:
             yield bucket, getattr(
                 bucket,
-                self._text_tokens_field.replace(".", "__"),
+                self.text_tokens_field.replace(".", "__"),
                 AttrDict({"buckets": []}),
             ).buckets
 
     @property
     def _nasty_filter_field(self) -> Sequence[str]:
-        return {DatasetType.NASTY: ("nasty_batch_meta", "request.filter")}[
-            self._dataset_type
-        ]
+        return {
+            DatasetType.NASTY: self._prefer_flat_field(
+                ("nasty_batch_meta", "request.filter"), "nasty_request_filter"
+            )
+        }[self._dataset_type]
 
     def query_nasty_filter_term(self, value: str) -> Query:
         return self._query_term(value, self._nasty_filter_field)
 
     @property
     def _nasty_query_field(self) -> Sequence[str]:
-        return {DatasetType.NASTY: ("nasty_batch_meta", "request.query")}[
-            self._dataset_type
-        ]
+        return {
+            DatasetType.NASTY: self._prefer_flat_field(
+                ("nasty_batch_meta", "request.query"), "nasty_request_query"
+            )
+        }[self._dataset_type]
 
     def query_nasty_query_term(self, value: str) -> Query:
         return self._query_term(value, self._nasty_query_field)
@@ -0,0 +1,250 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import re
+from datetime import date
+from enum import Enum
+from hashlib import sha256
+from itertools import chain
+from logging import getLogger
+from pathlib import Path
+from time import time
+from typing import AbstractSet, Iterator, Mapping, NamedTuple, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import numpy as np
+from nasty_utils import ColoredBraceStyleAdapter, format_yyyy_mm_dd, parse_yyyy_mm_dd
+from typing_extensions import Final
+
+from nasty_analysis.settings import DatasetSection
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+_PRUNE_GRACE_SECS: Final[int] = 60 * 60
+
+
+class Aggregate(NamedTuple):
+    dates: Sequence[date]
+    words: Sequence[str]
+    word_freqs: np.ndarray  # One row per word, one column per date.
+    num_docs: np.ndarray  # One column per date.
+
+    @classmethod
+    def from_word_freqs_per_day(
+        cls,
+        dates: Sequence[date],
+        word_freqs_per_day: Mapping[str, Sequence[int]],
+        num_docs_per_day: Sequence[int],
+    ) -> "Aggregate":
+        words = sorted(word_freqs_per_day)
+        word_freqs = np.zeros((len(words), len(dates)), dtype=np.int32)
+        for i, word in enumerate(words):
+            word_freqs[i] = word_freqs_per_day[word]
+        num_docs = np.zeros(len(dates), dtype=np.int32)
+        num_docs[:] = num_docs_per_day
+        return cls(list(dates), words, word_freqs, num_docs)
+
+    def reindex(self, words: Sequence[str], dates: Sequence[date]) -> "Aggregate":
+        # Words and dates that are not part of this aggregate get zero values.
+        word_freqs = np.zeros((len(words), len(dates)), dtype=np.int32)
+        num_docs = np.zeros(len(dates), dtype=np.int32)
+
+        index_by_word = {word: i for i, word in enumerate(self.words)}
+        index_by_date = {day: i for i, day in enumerate(self.dates)}
+        rows = [
+            (i, index_by_word[w]) for i, w in enumerate(words) if w in index_by_word
+        ]
+        cols = [
+            (i, index_by_date[d]) for i, d in enumerate(dates) if d in index_by_date
+        ]
+        if cols:
+            new_cols, old_cols = (list(x) for x in zip(*cols))
+            num_docs[new_cols] = self.num_docs[old_cols]
+            if rows:
+                new_rows, old_rows = (list(x) for x in zip(*rows))
+                word_freqs[np.ix_(new_rows, new_cols)] = self.word_freqs[
+                    np.ix_(old_rows, old_cols)
+                ]
+
+        return Aggregate(list(dates), list(words), word_freqs, num_docs)
+
+    @property
+    def word_freqs_per_day(self) -> Mapping[str, np.ndarray]:
+        # Rows are views, so this does not copy (memory-mapped) data.
+        return {word: self.word_freqs[i] for i, word in enumerate(self.words)}
+
+
+class AggregateStore:
+    # Stores aggregates in a directory shared by all worker processes. Each entry
+    # consists of a JSON index file named after the hash of its selection, which
+    # references a .npy data file. Data files are never modified after being written
+    # and entries are replaced by atomically replacing the index file, so readers can
+    # memory-map data files without any locking. Entries are never evicted on their
+    # own, instead prune() has to be called periodically.
+
+    def __init__(self, directory: Path):
+        self._directory = directory
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    def get(
+        self, namespace: str, selection: Mapping[str, object]
+    ) -> Optional[Aggregate]:
+        return self._get(self._index_file(namespace, selection))
+
+    def get_by_key(self, key: str) -> Optional[Aggregate]:
+        # Keys are passed in from outside, e.g., in URLs, so they may not reference
+        # any other files.
+        if not re.fullmatch("[0-9a-f]{64}", key):
+            return None
+        return self._get(self._directory / f"{key}.json")
+
+    def _get(self, index_file: Path) -> Optional[Aggregate]:
+        try:
+            with index_file.open("r", encoding="UTF-8") as fin:
+                entry = json.load(fin)
+            # First row holds the number of documents, the others the word freqs.
+            data = np.load(self._directory / entry["data_file"], mmap_mode="r")
+            # Modification times of index files are used to prune least recently used
+            # entries.
+            index_file.touch()
+            return Aggregate(
+                [parse_yyyy_mm_dd(day) for day in entry["dates"]],
+                entry["words"],
+                data[1:],
+                data[0],
+            )
+        except FileNotFoundError:
+            # Either no entry exists or it was replaced while we were reading it.
+            return None
+        except (KeyError, TypeError, ValueError) as e:
+            _LOGGER.warning(
+                "Could not read aggregate store entry {}: {}", index_file, e
+            )
+            return None
+
+    def put(
+        self, namespace: str, selection: Mapping[str, object], aggregate: Aggregate
+    ) -> None:
+        index_file = self._index_file(namespace, selection)
+        data_file = self._directory / f"{index_file.stem}-{uuid4().hex}.npy"
+        np.save(data_file, np.vstack((aggregate.num_docs, aggregate.word_freqs)))
+
+        old_data_file = None
+        try:
+            with index_file.open("r", encoding="UTF-8") as fin:
+                old_data_file = self._directory / json.load(fin)["data_file"]
+        except (FileNotFoundError, KeyError, TypeError, ValueError):
+            pass
+
+        entry = {
+            "namespace": namespace,
+            "selection": selection,
+            "dates": [format_yyyy_mm_dd(day) for day in aggregate.dates],
+            "words": list(aggregate.words),
+            "data_file": data_file.name,
+        }
+        # Threads of the same process might put the same entry at the same time.
+        index_file_tmp = index_file.with_name(f"{index_file.name}.{uuid4().hex}.tmp")
+        with index_file_tmp.open("w", encoding="UTF-8") as fout:
+            json.dump(entry, fout, default=_json_default)
+        index_file_tmp.replace(index_file)
+
+        # Processes that memory-mapped the old data file can still read it. Data files
+        # orphaned by concurrent puts of the same entry are removed by prune().
+        if old_data_file is not None and old_data_file != data_file:
+            _unlink_missing_ok(old_data_file)
+
+    def prune(
+        self, *, max_age: Optional[int] = None, max_size: Optional[int] = None
+    ) -> None:
+        # Removes entries not used for max_age seconds and then least recently used
+        # entries until all files take up at most max_size bytes. Afterwards, removes
+        # data and temporary files that no entry references anymore. Files younger
+        # than _PRUNE_GRACE_SECS might belong to a put that is still running.
+        now = time()
+        entries = sorted(self._list_entries(), key=lambda entry: entry[0])
+
+        total_size = sum(size for _mtime, size, _index_file, _data_file in entries)
+        num_removed = 0
+        referenced_data_files = set()
+        for mtime, size, index_file, data_file in entries:
+            if (max_age is not None and now - mtime > max_age) or (
+                max_size is not None and total_size > max_size
+            ):
+                _unlink_missing_ok(index_file)
+                total_size -= size
+                num_removed += 1
+            else:
+                referenced_data_files.add(data_file)
+
+        self._remove_unreferenced_files(referenced_data_files, now)
+
+        _LOGGER.debug(
+            "Pruned {} of {} aggregate store entries.", num_removed, len(entries)
+        )
+
+    def _list_entries(self) -> Iterator[Tuple[float, int, Path, Path]]:
+        for index_file in self._directory.glob("*.json"):
+            try:
+                mtime = index_file.stat().st_mtime
+                with index_file.open("r", encoding="UTF-8") as fin:
+                    data_file = self._directory / json.load(fin)["data_file"]
+                size = index_file.stat().st_size + data_file.stat().st_size
+            except (FileNotFoundError, KeyError, TypeError, ValueError):
+                continue
+            yield mtime, size, index_file, data_file
+
+    def _remove_unreferenced_files(
+        self, referenced_data_files: AbstractSet[Path], now: float
+    ) -> None:
+        for file in chain(self._directory.glob("*.npy"), self._directory.glob("*.tmp")):
+            if file in referenced_data_files:
+                continue
+            try:
+                if now - file.stat().st_mtime > _PRUNE_GRACE_SECS:
+                    _unlink_missing_ok(file)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def key(cls, namespace: str, selection: Mapping[str, object]) -> str:
+        serialized = json.dumps(
+            {"namespace": namespace, "selection": selection},
+            sort_keys=True,
+            default=_json_default,
+        )
+        return sha256(serialized.encode("UTF-8")).hexdigest()
+
+    def _index_file(self, namespace: str, selection: Mapping[str, object]) -> Path:
+        return self._directory / f"{self.key(namespace, selection)}.json"
+
+
+def _unlink_missing_ok(file: Path) -> None:
+    try:
+        file.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _json_default(o: object) -> object:
+    if isinstance(o, DatasetSection):
+        return {"name": o.name, "index": o.index}
+    elif isinstance(o, Enum):
+        return o.name
+    elif isinstance(o, AbstractSet):
+        return sorted(o)
+    return str(o)
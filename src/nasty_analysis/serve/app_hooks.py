@@ -14,11 +14,13 @@
 # limitations under the License.
 #
 
+from threading import Thread
 from typing import cast
 
 from bokeh.application.application import ServerContext
 
 from nasty_analysis.serve.context import Context
+from nasty_analysis.serve.prefetch import Prefetcher
 from nasty_analysis.settings import NastyAnalysisSettings
 
 
@@ -26,3 +28,32 @@ def on_server_loaded(server_context: ServerContext) -> None:
     settings = cast(NastyAnalysisSettings, getattr(server_context, "settings"))
     context = Context(settings)
     setattr(server_context, "context", context)
+
+    refresh_interval = settings.analysis.serve.context_refresh_interval
+    if refresh_interval:
+        # Refresh in a separate thread so that the server is not blocked by the
+        # Elasticsearch requests.
+        server_context.add_periodic_callback(
+            lambda: Thread(target=context.refresh, daemon=True).start(),
+            refresh_interval * 1000,
+        )
+
+    aggregate_store = context.aggregate_store
+    if aggregate_store is not None:
+        serve_settings = settings.analysis.serve
+
+        def prune_aggregate_store() -> None:
+            aggregate_store.prune(
+                max_age=serve_settings.aggregate_store_max_age,
+                max_size=serve_settings.aggregate_store_max_size,
+            )
+
+        # Every process prunes the shared directory, which is harmless as pruning
+        # only ever removes files.
+        server_context.add_periodic_callback(
+            lambda: Thread(target=prune_aggregate_store, daemon=True).start(),
+            serve_settings.aggregate_store_prune_interval * 1000,
+        )
+
+    if settings.analysis.serve.prefetch:
+        Prefetcher(context).start()
@@ -14,137 +14,371 @@
 # limitations under the License.
 #
 
+import json
 from datetime import date
 from logging import getLogger
+from os import getpid
+from threading import Lock, Thread
 from time import time
 from typing import (
     AbstractSet,
     Callable,
     Counter,
-    Iterator,
     Mapping,
+    MutableSequence,
+    NamedTuple,
     Optional,
     Sequence,
-    Tuple,
 )
 
-from elasticsearch_dsl import Search
-from elasticsearch_dsl.response import Response
-from elasticsearch_dsl.response.aggs import Bucket
-from nasty_utils import ColoredBraceStyleAdapter
+from elasticsearch_dsl import MultiSearch, Search
+from nasty_utils import ColoredBraceStyleAdapter, format_yyyy_mm_dd, parse_yyyy_mm_dd
 
-from nasty_analysis.search_helper import SearchHelper
-from nasty_analysis.settings import DatasetSection, DatasetType, NastyAnalysisSettings
+from nasty_analysis.local_index import LocalIndex
+from nasty_analysis.search_helper import SearchHelper, clear_partitions_cache
+from nasty_analysis.serve.aggregate_store import AggregateStore
+from nasty_analysis.settings import (
+    DatasetSection,
+    DatasetType,
+    NastyAnalysisSettings,
+    ServeBackend,
+)
 
 _LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
 
 
+class _DatasetStats(NamedTuple):
+    num_docs: int
+    min_date: date
+    max_date: date
+    lang_freqs: Counter[str]
+    query_freqs: Optional[Counter[str]]
+    url_netloc_freqs: Optional[Counter[str]]
+
+
 class Context:
     def __init__(self, settings: NastyAnalysisSettings):
         _LOGGER.debug("Initializing new visualization app context.")
-        time_before = time()
 
         datasets = settings.analysis.datasets
         if not datasets:
             raise ValueError("No datasets given.")
 
         self.settings = settings
-        self.min_date, self.max_date = self._fetch_min_and_max_dates(datasets)
-        self.lang_freqs_by_dataset = self._fetch_agg_terms_by_dataset(
-            datasets,
-            SearchHelper.add_agg_lang_terms,
-            SearchHelper.read_agg_lang_terms,
-            "Languages",
-        )
-        self.query_freqs_by_dataset = self._fetch_agg_terms_by_dataset(
-            datasets,
-            SearchHelper.add_agg_nasty_query_terms,
-            SearchHelper.read_agg_nasty_query_terms,
-            "Queries",
-            {DatasetType.NASTY},
-        )
-        self.url_netloc_freqs_by_dataset = self._fetch_agg_terms_by_dataset(
-            datasets,
-            SearchHelper.add_agg_news_csv_url_netloc_terms,
-            SearchHelper.read_agg_news_csv_url_netloc_terms,
-            "Domains",
-            {DatasetType.NEWS_CSV, DatasetType.MAXQDA_CODED_NEWS_CSV},
+        self._snapshot_file = settings.analysis.serve.context_snapshot_file
+        self._stats_by_dataset: Mapping[str, _DatasetStats] = {}
+        self._refresh_lock = Lock()
+        self._callbacks: MutableSequence[Callable[[AbstractSet[str]], None]] = []
+        self._callbacks_lock = Lock()
+        self._last_activity = 0.0
+
+        aggregate_store_dir = settings.analysis.serve.aggregate_store_dir
+        self.aggregate_store = (
+            AggregateStore(aggregate_store_dir) if aggregate_store_dir else None
         )
+        self.local_indices = self._load_local_indices()
 
-        time_after = time()
-        _LOGGER.debug("  Done after {:.2f}s.", time_after - time_before)
+        stats_by_dataset = self._load_snapshot()
+        if stats_by_dataset is None:
+            self.refresh()
+        else:
+            self._set_stats_by_dataset(stats_by_dataset)
+            Thread(target=self.refresh, daemon=True).start()
 
-    @classmethod
-    def _fetch_min_and_max_dates(
-        cls, datasets: Sequence[DatasetSection]
-    ) -> Tuple[date, date]:
-        min_date: Optional[date] = None
-        max_date: Optional[date] = None
+    def _load_local_indices(self) -> Mapping[str, LocalIndex]:
+        serve_settings = self.settings.analysis.serve
+        if serve_settings.backend != ServeBackend.LOCAL:
+            return {}
+        if serve_settings.local_index_dir is None:
+            raise ValueError("Configure local_index_dir to use the LOCAL backend.")
 
-        for dataset in datasets:
-            search_helper = SearchHelper(dataset.type)
-            search = Search(index=dataset.index).extra(size=0)
-            search = search.filter(
-                search_helper.query_date_range(gte=date(2000, 1, 1))
-            )  # Needed because missing date defaults to 1900 for some entries.
-            search = search_helper.add_agg_date_min_max(search)
-            response = search.execute()
+        result = {}
+        for dataset in self.settings.analysis.datasets:
+            directory = serve_settings.local_index_dir / dataset.name
+            if not directory.exists():
+                _LOGGER.warning(
+                    "No local index for dataset '{}', using Elasticsearch instead.",
+                    dataset.name,
+                )
+                continue
+            result[dataset.name] = LocalIndex(directory)
+        return result
 
-            dataset_min_date, dataset_max_date = search_helper.read_agg_date_min_max(
-                response
-            )
+    def record_activity(self) -> None:
+        self._last_activity = time()
 
+    @property
+    def secs_since_last_activity(self) -> float:
+        return time() - self._last_activity
+
+    def on_change(self, callback: Callable[[AbstractSet[str]], None]) -> None:
+        # Callbacks are called from the refreshing thread with the names of all
+        # datasets whose statistics changed.
+        with self._callbacks_lock:
+            self._callbacks.append(callback)
+
+    def remove_on_change(self, callback: Callable[[AbstractSet[str]], None]) -> None:
+        with self._callbacks_lock:
+            self._callbacks.remove(callback)
+
+    def refresh(self) -> None:
+        # Skip if another refresh is still running, e.g., because the periodic refresh
+        # took longer than its interval.
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        try:
+            _LOGGER.debug("Fetching visualization app context.")
+            time_before = time()
+
+            datasets = self.settings.analysis.datasets
+            if self._stats_by_dataset:
+                num_docs_by_dataset = self._fetch_num_docs_by_dataset(datasets)
+                datasets = [
+                    dataset
+                    for dataset in datasets
+                    if dataset.name not in self._stats_by_dataset
+                    or self._stats_by_dataset[dataset.name].num_docs
+                    != num_docs_by_dataset[dataset.name]
+                ]
+
+            if datasets:
+                # New documents might have been indexed into new partitions.
+                clear_partitions_cache()
+                stats_by_dataset = dict(self._stats_by_dataset)
+                stats_by_dataset.update(self._fetch_stats_by_dataset(datasets))
+                self._set_stats_by_dataset(stats_by_dataset)
+                self._dump_snapshot(stats_by_dataset)
+
+            time_after = time()
             _LOGGER.debug(
-                "Dates of dataset '{}' range from {} to {}.",
-                dataset.name,
-                dataset_min_date,
-                dataset_max_date,
+                "  Done after {:.2f}s, {} dataset(s) changed.",
+                time_after - time_before,
+                len(datasets),
             )
+        finally:
+            self._refresh_lock.release()
 
-            min_date = min(min_date, dataset_min_date) if min_date else dataset_min_date
-            max_date = max(max_date, dataset_max_date) if max_date else dataset_max_date
-
-        if not min_date or not max_date:
-            raise ValueError("Could not determine min or max date.")
+        if datasets:
+            changed_datasets = {dataset.name for dataset in datasets}
+            with self._callbacks_lock:
+                callbacks = list(self._callbacks)
+            for callback in callbacks:
+                callback(changed_datasets)
 
+    def _set_stats_by_dataset(
+        self, stats_by_dataset: Mapping[str, _DatasetStats]
+    ) -> None:
+        min_date = min(stats.min_date for stats in stats_by_dataset.values())
+        max_date = max(stats.max_date for stats in stats_by_dataset.values())
         _LOGGER.debug("Dates over all datasets range from {} to {}", min_date, max_date)
 
-        return min_date, max_date
+        (  # Ensure "atomic" update via tuple assignment.
+            self._stats_by_dataset,
+            self.min_date,
+            self.max_date,
+            self.num_docs_by_dataset,
+            self.lang_freqs_by_dataset,
+            self.query_freqs_by_dataset,
+            self.url_netloc_freqs_by_dataset,
+        ) = (
+            stats_by_dataset,
+            min_date,
+            max_date,
+            {name: stats.num_docs for name, stats in stats_by_dataset.items()},
+            {name: stats.lang_freqs for name, stats in stats_by_dataset.items()},
+            {
+                name: stats.query_freqs
+                for name, stats in stats_by_dataset.items()
+                if stats.query_freqs is not None
+            },
+            {
+                name: stats.url_netloc_freqs
+                for name, stats in stats_by_dataset.items()
+                if stats.url_netloc_freqs is not None
+            },
+        )
 
     @classmethod
-    def _fetch_agg_terms_by_dataset(
-        cls,
-        datasets: Sequence[DatasetSection],
-        add_agg_terms: Callable[[SearchHelper, Search, int], Search],
-        read_agg_terms: Callable[[SearchHelper, Response], Iterator[Bucket]],
-        log_msg: str,
-        dataset_types: Optional[AbstractSet[DatasetType]] = None,
-    ) -> Mapping[str, Counter[str]]:
-        result = {}
-
+    def _fetch_num_docs_by_dataset(
+        cls, datasets: Sequence[DatasetSection]
+    ) -> Mapping[str, int]:
+        search = MultiSearch()
         for dataset in datasets:
-            if dataset_types and dataset.type not in dataset_types:
-                continue
+            search = search.add(
+                Search(index=dataset.index).extra(size=0, track_total_hits=True)
+            )
+        return {
+            dataset.name: response.hits.total.value
+            for dataset, response in zip(datasets, search.execute())
+        }
 
-            search_helper = SearchHelper(dataset.type)
-            search = Search(index=dataset.index).extra(size=0)
-            search = add_agg_terms(search_helper, search, 100)
-            response = search.execute()
+    @classmethod
+    def _fetch_stats_by_dataset(
+        cls, datasets: Sequence[DatasetSection]
+    ) -> Mapping[str, _DatasetStats]:
+        # All aggregations of a dataset are computed in a single search and the
+        # searches for all datasets are sent as one MultiSearch, which Elasticsearch
+        # executes concurrently.
+        search = MultiSearch()
+        for dataset in datasets:
+            search_helper = SearchHelper(dataset.type, dataset.index)
+            dataset_search = Search(index=dataset.index).extra(
+                size=0, track_total_hits=True
+            )
+            dataset_search = search_helper.add_agg_date_min_max(
+                dataset_search, gte=date(2000, 1, 1)
+            )  # Needed because missing date defaults to 1900 for some entries.
+            dataset_search = search_helper.add_agg_lang_terms(dataset_search, 100)
+            if dataset.type == DatasetType.NASTY:
+                dataset_search = search_helper.add_agg_nasty_query_terms(
+                    dataset_search, 100
+                )
+            if (
+                dataset.type == DatasetType.NEWS_CSV
+                or dataset.type == DatasetType.MAXQDA_CODED_NEWS_CSV
+            ):
+                dataset_search = search_helper.add_agg_news_csv_url_netloc_terms(
+                    dataset_search, 100
+                )
+            search = search.add(dataset_search)
 
-            result[dataset.name] = Counter[str](
+        result = {}
+        for dataset, response in zip(datasets, search.execute()):
+            search_helper = SearchHelper(dataset.type, dataset.index)
+            min_date, max_date = search_helper.read_agg_date_min_max(response)
+            lang_freqs = Counter[str](
                 {
                     bucket.key: bucket.doc_count
-                    for bucket in read_agg_terms(search_helper, response)
+                    for bucket in search_helper.read_agg_lang_terms(response)
                 }
             )
 
+            query_freqs = None
+            if dataset.type == DatasetType.NASTY:
+                query_freqs = Counter[str](
+                    {
+                        bucket.key: bucket.doc_count
+                        for bucket in search_helper.read_agg_nasty_query_terms(response)
+                    }
+                )
+
+            url_netloc_freqs = None
+            if (
+                dataset.type == DatasetType.NEWS_CSV
+                or dataset.type == DatasetType.MAXQDA_CODED_NEWS_CSV
+            ):
+                url_netloc_freqs = Counter[str](
+                    {
+                        bucket.key: bucket.doc_count
+                        for bucket in search_helper.read_agg_news_csv_url_netloc_terms(
+                            response
+                        )
+                    }
+                )
+
+            result[dataset.name] = _DatasetStats(
+                response.hits.total.value,
+                min_date,
+                max_date,
+                lang_freqs,
+                query_freqs,
+                url_netloc_freqs,
+            )
+            cls._log_dataset_stats(dataset, result[dataset.name])
+
+        return result
+
+    @classmethod
+    def _log_dataset_stats(cls, dataset: DatasetSection, stats: _DatasetStats) -> None:
+        _LOGGER.debug(
+            "Dates of dataset '{}' range from {} to {}.",
+            dataset.name,
+            stats.min_date,
+            stats.max_date,
+        )
+        for log_msg, freqs in (
+            ("Languages", stats.lang_freqs),
+            ("Queries", stats.query_freqs),
+            ("Domains", stats.url_netloc_freqs),
+        ):
+            if freqs is None:
+                continue
             _LOGGER.debug(
                 log_msg + " of dataset '{}': {}",
                 dataset.name,
                 ", ".join(
-                    "{} ({:,})".format(lang, freq)
-                    for lang, freq in result[dataset.name].most_common()
+                    "{} ({:,})".format(value, freq)
+                    for value, freq in freqs.most_common()
                 ),
             )
 
+    def _load_snapshot(self) -> Optional[Mapping[str, _DatasetStats]]:
+        if not self._snapshot_file or not self._snapshot_file.exists():
+            return None
+
+        try:
+            snapshot = json.loads(self._snapshot_file.read_text(encoding="UTF-8"))
+            result = {}
+            for dataset in self.settings.analysis.datasets:
+                dataset_snapshot = snapshot[dataset.name]
+                if (
+                    dataset_snapshot["index"] != dataset.index
+                    or dataset_snapshot["type"] != dataset.type.value
+                ):
+                    _LOGGER.debug(
+                        "Context snapshot is outdated for dataset '{}'.", dataset.name
+                    )
+                    return None
+
+                result[dataset.name] = _DatasetStats(
+                    dataset_snapshot["num_docs"],
+                    parse_yyyy_mm_dd(dataset_snapshot["min_date"]),
+                    parse_yyyy_mm_dd(dataset_snapshot["max_date"]),
+                    Counter[str](dataset_snapshot["lang_freqs"]),
+                    _load_optional_counter(dataset_snapshot["query_freqs"]),
+                    _load_optional_counter(dataset_snapshot["url_netloc_freqs"]),
+                )
+        except (KeyError, TypeError, ValueError):
+            _LOGGER.warning(
+                "Could not load context snapshot from '{}', ignoring it.",
+                self._snapshot_file,
+                exc_info=True,
+            )
+            return None
+
+        _LOGGER.debug("Loaded context snapshot from '{}'.", self._snapshot_file)
         return result
+
+    def _dump_snapshot(self, stats_by_dataset: Mapping[str, _DatasetStats]) -> None:
+        if not self._snapshot_file:
+            return
+
+        snapshot = {}
+        for dataset in self.settings.analysis.datasets:
+            stats = stats_by_dataset[dataset.name]
+            snapshot[dataset.name] = {
+                "index": dataset.index,
+                "type": dataset.type.value,
+                "num_docs": stats.num_docs,
+                "min_date": format_yyyy_mm_dd(stats.min_date),
+                "max_date": format_yyyy_mm_dd(stats.max_date),
+                "lang_freqs": stats.lang_freqs,
+                "query_freqs": stats.query_freqs,
+                "url_netloc_freqs": stats.url_netloc_freqs,
+            }
+
+        # Multiple Bokeh worker processes might write the snapshot at the same time, so
+        # write to a process-specific file first and atomically replace afterwards.
+        self._snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self._snapshot_file.with_name(
+            "{}.{}.tmp".format(self._snapshot_file.name, getpid())
+        )
+        tmp_file.write_text(json.dumps(snapshot), encoding="UTF-8")
+        tmp_file.replace(self._snapshot_file)
+
+
+def _load_optional_counter(
+    value: Optional[Mapping[str, int]]
+) -> Optional[Counter[str]]:
+    return Counter[str](value) if value is not None else None
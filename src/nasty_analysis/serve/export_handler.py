@@ -0,0 +1,89 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import csv
+import zlib
+from io import StringIO
+from logging import getLogger
+from pathlib import Path
+from typing import Iterator, Sequence
+from urllib.parse import urlencode
+
+from more_itertools import chunked
+from nasty_utils import ColoredBraceStyleAdapter, format_yyyy_mm_dd
+from tornado.web import HTTPError, RequestHandler
+from typing_extensions import Final
+
+from nasty_analysis.serve.aggregate_store import Aggregate, AggregateStore
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+WORD_FREQS_CSV_PATH: Final[str] = "/export/word_freqs.csv"
+
+_ROWS_PER_CHUNK: Final[int] = 1000
+
+
+def word_freqs_csv_url(key: str) -> str:
+    return WORD_FREQS_CSV_PATH + "?" + urlencode({"key": key})
+
+
+class WordFreqsCsvHandler(RequestHandler):
+    # Streams the word frequencies per day of an aggregate store entry as CSV, so that
+    # exports are not limited to what was sent to the browser. Entries are shared
+    # between all worker processes, so any of them can serve the download.
+
+    def initialize(self, aggregate_store_dir: Path) -> None:
+        self._aggregate_store = AggregateStore(aggregate_store_dir)
+
+    async def get(self) -> None:
+        aggregate = self._aggregate_store.get_by_key(self.get_argument("key"))
+        if aggregate is None:
+            raise HTTPError(404)
+
+        self.set_header("Content-Type", "text/csv; charset=UTF-8")
+        self.set_header("Content-Disposition", 'attachment; filename="word_freqs.csv"')
+        compressor = None
+        if "gzip" in self.request.headers.get("Accept-Encoding", ""):
+            self.set_header("Content-Encoding", "gzip")
+            compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+
+        _LOGGER.debug("Streaming word frequencies of {} words.", len(aggregate.words))
+        for rows in chunked(_word_freqs_csv_rows(aggregate), _ROWS_PER_CHUNK):
+            chunk = _format_csv_rows(rows).encode("UTF-8")
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                self.write(chunk)
+                await self.flush()
+
+        if compressor is not None:
+            self.write(compressor.flush())
+        self.finish()
+
+
+def _word_freqs_csv_rows(aggregate: Aggregate) -> Iterator[Sequence[object]]:
+    # One column per date. The first row after the header holds the number of
+    # documents per date and has an empty word.
+    yield ["word"] + [format_yyyy_mm_dd(day) for day in aggregate.dates]
+    yield [""] + aggregate.num_docs.tolist()
+    for word, word_freqs in zip(aggregate.words, aggregate.word_freqs):
+        yield [word] + word_freqs.tolist()
+
+
+def _format_csv_rows(rows: Sequence[Sequence[object]]) -> str:
+    buffer = StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
@@ -14,6 +14,12 @@
  * limitations under the License.
  */
 
+// Download the full export from the server, if it can provide one.
+if (typeof url !== "undefined" && url) {
+  window.location.assign(url);
+  return;
+}
+
 function source_to_csv() {
   var columns = []
   var row = [];
@@ -14,9 +14,10 @@
 # limitations under the License.
 #
 
-from datetime import date, timedelta, timezone
-from typing import List, Mapping, Sequence
+from datetime import date, timezone
+from typing import Mapping, Sequence
 
+import numpy as np
 from bokeh.layouts import row
 from bokeh.models import (
     BoxAnnotation,
@@ -28,6 +29,8 @@ from bokeh.plotting import Figure
 from nasty_utils import date_range, date_to_datetime, date_to_timestamp
 from tornado.gen import coroutine
 
+from nasty_analysis._utils.bokeh_ import datetime64_array, update_column_data_source
+from nasty_analysis._utils.time_series import Granularity, resample_per_day
 from nasty_analysis.serve.widgets.date_range_widget import DateRangeWidget
 
 
@@ -44,7 +47,7 @@ class NumDocsFigure:
         self._source = ColumnDataSource(self._new_source_data())
 
         self._figure = Figure(
-            title="# Documents per day",
+            title="",
             toolbar_location="above",
             tools="save",
             sizing_mode="stretch_width",
@@ -63,12 +66,8 @@ class NumDocsFigure:
             days=["%d %b"], months=["%b"]
         )
         self._figure.yaxis[0].formatter = NumeralTickFormatter(format="0a")
-        self._figure.vbar(
-            source=self._source,
-            x="days",
-            top="num_docs",
-            width=timedelta(days=1).total_seconds() * 1000,
-        )
+        self._bars = self._figure.vbar(source=self._source, x="days", top="num_docs")
+        self._set_granularity()
 
         self._selected_annotation = BoxAnnotation(
             left=self._figure.x_range.start,
@@ -87,18 +86,51 @@ class NumDocsFigure:
 
         self.figure = row(self._figure)
 
+    def _set_granularity(self) -> None:
+        # One bar per day gets too dense for long date ranges, in that case days are
+        # summed up into weeks or months.
+        self._granularity = Granularity.for_num_days(
+            (self._max_date - self._min_date).days + 1
+        )
+        if self._granularity == Granularity.HOUR:
+            self._granularity = Granularity.DAY
+        self._figure.title.text = f"# Documents per {self._granularity.label.lower()}"
+        self._bars.glyph.width = self._granularity.width.total_seconds() * 1000
+
+    def set_min_and_max_date(self, min_date: date, max_date: date) -> None:
+        self._min_date = min_date
+        self._max_date = max_date
+        self._set_granularity()
+        self._figure.x_range.start = (
+            date_to_timestamp(self._min_date, tzinfo_=timezone.utc) * 1000
+        )
+        self._figure.x_range.end = (
+            date_to_timestamp(self._max_date, tzinfo_=timezone.utc) * 1000
+        )
+
     @classmethod
-    def _new_source_data(cls) -> Mapping[str, List[object]]:
-        return {"days": [], "num_docs": []}
+    def _new_source_data(cls) -> Mapping[str, np.ndarray]:
+        return {
+            "days": np.array([], dtype="datetime64[ms]"),
+            "num_docs": np.array([], dtype=np.int32),
+        }
 
     @coroutine
     def display_update(self, num_docs_per_day: Sequence[int]) -> None:
-        new_data = self._new_source_data()
-        for day, num_docs in zip(
-            date_range(self._min_date, self._max_date), num_docs_per_day
-        ):
-            if not num_docs:
-                continue
-            new_data["days"].append(date_to_datetime(day, tzinfo_=timezone.utc))
-            new_data["num_docs"].append(num_docs)
-        self._source.data = new_data
+        buckets, num_docs_per_bucket = resample_per_day(
+            list(date_range(self._min_date, self._max_date)),
+            np.array(num_docs_per_day, dtype=np.int64),
+            self._granularity,
+        )
+
+        nonzero = num_docs_per_bucket != 0
+        days = datetime64_array(
+            [date_to_datetime(day, tzinfo_=timezone.utc) for day in buckets]
+        )
+        update_column_data_source(
+            self._source,
+            {
+                "days": days[nonzero],
+                "num_docs": num_docs_per_bucket[nonzero].astype(np.int32),
+            },
+        )
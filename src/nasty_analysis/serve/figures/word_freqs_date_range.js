@@ -0,0 +1,74 @@
+/*
+ * Copyright 2019-2020 Lukas Schmelzeisen
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+var MSECS_PER_DAY = 24 * 60 * 60 * 1000;
+var SMOOTHING_FACTOR = 0.1;
+
+function compute_word_freqs() {
+  if (!client_side_source.get_length())
+    return;
+
+  var words = client_side_source.data["words"][0];
+  var word_freqs = client_side_source.data["word_freqs"][0];
+  var num_docs_per_day = client_side_source.data["num_docs"][0];
+  var min_date = client_side_source.data["min_date"][0];
+  var normalize = client_side_source.data["normalize"][0];
+
+  // Word frequencies are a flattened array with one row per word.
+  var num_days = num_docs_per_day.length;
+  var value = cb_obj.value;
+  var start = Math.round((value[0] - min_date) / MSECS_PER_DAY);
+  var end = Math.round((value[1] - min_date) / MSECS_PER_DAY) + 1;
+  start = Math.min(Math.max(start, 0), num_days);
+  end = Math.min(Math.max(end, start), num_days);
+
+  var num_docs = 0;
+  for (var j = start; j !== end; ++j)
+    num_docs += num_docs_per_day[j];
+  var smoothing_denominator = SMOOTHING_FACTOR * (end - start);
+
+  var freqs = new Float64Array(words.length);
+  for (var i = 0; i !== words.length; ++i) {
+    var freq = 0;
+    for (var j = start; j !== end; ++j) {
+      var word_freq = word_freqs[i * num_days + j];
+      if (normalize)
+        freq += (word_freq + SMOOTHING_FACTOR)
+          / (num_docs_per_day[j] + smoothing_denominator);
+      else
+        freq += word_freq;
+    }
+    freqs[i] = freq;
+  }
+
+  var order = [];
+  for (var i = 0; i !== words.length; ++i)
+    if (freqs[i])
+      order.push(i);
+  order.sort(function (a, b) { return freqs[b] - freqs[a]; });
+  order = order.slice(0, top_n_words);
+
+  source.data = {
+    "words": order.map(function (i) { return words[i]; }),
+    "freqs": order.map(function (i) { return freqs[i]; }),
+  };
+  stats.text = (
+    "# matching documents: <strong>" + num_docs.toLocaleString("en-US")
+    + "</strong>&nbsp;&centerdot;&nbsp;Computed in browser"
+  );
+}
+
+compute_word_freqs();
@@ -15,9 +15,11 @@
 #
 
 from collections import defaultdict
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
 from functools import lru_cache, partial
+from itertools import islice
 from logging import getLogger
+from math import ceil
 from pathlib import Path
 from threading import Thread
 from time import time
@@ -26,22 +28,31 @@ from typing import (
     Callable,
     Counter,
     Hashable,
+    Iterable,
+    Iterator,
     List,
     Mapping,
+    MutableMapping,
+    MutableSet,
     Optional,
     Sequence,
     Tuple,
+    cast,
 )
-from unicodedata import category
 
+import numpy as np
 from bokeh.layouts import column, row
 from bokeh.models import Button, ColumnDataSource, CustomJS, DataTable, Div, TableColumn
 from elasticsearch_dsl import MultiSearch, Search
-from nasty_utils import ColoredBraceStyleAdapter, date_range
-from stopwordsiso import stopwords
+from nasty_utils import ColoredBraceStyleAdapter, date_range, date_to_timestamp
 from tornado.gen import coroutine
 
-from nasty_analysis.search_helper import SearchHelper
+from nasty_analysis._utils.bokeh_ import update_column_data_source
+from nasty_analysis._utils.stopwords import filter_non_letters_unicode, get_stopwords
+from nasty_analysis.local_index import LocalIndex
+from nasty_analysis.search_helper import SearchHelper, TextTokensSubset
+from nasty_analysis.serve.aggregate_store import Aggregate, AggregateStore
+from nasty_analysis.serve.export_handler import word_freqs_csv_url
 from nasty_analysis.serve.figures.num_docs_figure import NumDocsFigure
 from nasty_analysis.serve.widgets.dataset_widget import DatasetWidget
 from nasty_analysis.serve.widgets.date_range_widget import DateRangeWidget
@@ -51,79 +62,29 @@ from nasty_analysis.settings import DatasetType
 _LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
 
 
-@lru_cache(maxsize=None, typed=True)
-def _get_stopwords(lang: str) -> AbstractSet[str]:
-    result = set(stopwords(lang))
-
-    if lang == "en":
-        result.update(
-            ("'m", "'re", "'s", "'ve", "n't", "nt", "n’t", "’m", "’re", "’s", "’ve")
-        )
-        result.difference_update(
-            (
-                "case",
-                "cases",
-                "help",
-                "home",
-                "information",
-                "man",
-                "million",
-                "new",
-                "novel",
-                "state",
-                "states",
-                "system",
-                "today",
-                "uk",
-                "work",
-                "world",
-                "year",
-                "years",
-            )
-        )
-
-    elif lang == "de":
-        result.update(
-            (
-                "bleiben",
-                "ca.",
-                "echt",
-                "eher",
-                "eigentlich",
-                "fast",
-                "fest",
-                "genau",
-                "halt",
-                "klar",
-                "ne",
-                "paar",
-                "sogar",
-                "trotz",
-                "wahrscheinlich",
-            )
-        )
-        result.difference_update(
-            (
-                "ernst",
-                "jahr",
-                "jahre",
-                "jahren",
-                "mensch",
-                "menschen",
-                "neuen",
-                "tag",
-                "tage",
-                "uhr",
-                "wissen",
-                "zeit",
-            )
-        )
-
-    return result
+_TEXT_TOKENS_SUBSET_BY_WORD_FILTER: Mapping[WordFilter, TextTokensSubset] = {
+    WordFilter.ONLY_NON_STOPWORDS: TextTokensSubset.CONTENT_WORDS,
+    WordFilter.ONLY_HASHTAGS: TextTokensSubset.HASHTAGS,
+    WordFilter.ONLY_MENTIONS: TextTokensSubset.MENTIONS,
+}
 
 
-def _filter_non_letters_unicode(s: str) -> str:
-    return "".join(c for c in s if category(c).startswith("L"))
+@lru_cache(maxsize=None, typed=True)
+def _get_word_filter_include_exclude(
+    word_filter: WordFilter, lang: str
+) -> Tuple[Optional[object], Optional[object]]:
+    # Include and exclude for the terms aggregation, so that only words passing the
+    # word filter are fetched. Words without any letters can not be expressed as a
+    # Lucene regular expression and are still filtered after fetching. In Lucene, # and
+    # @ are operators (the empty language and any string), so they are only matched
+    # literally inside character classes, which Python's re treats the same way.
+    if word_filter == WordFilter.ONLY_NON_STOPWORDS:
+        return None, sorted(get_stopwords(lang))
+    elif word_filter == WordFilter.ONLY_HASHTAGS:
+        return "[#].*", None
+    elif word_filter == WordFilter.ONLY_MENTIONS:
+        return "[@].*", None
+    return None, None
 
 
 class WordFreqsFigure:
@@ -132,21 +93,29 @@ class WordFreqsFigure:
     def __init__(
         self,
         top_n_words: int,
+        num_client_side_candidate_words: Optional[int],
+        preview_sample_size: Optional[int],
         min_date: date,
         max_date: date,
         date_range_widget: DateRangeWidget,
         dataset_widget: DatasetWidget,
         word_freqs_widget: WordFreqsWidget,
         num_docs_figure: NumDocsFigure,
+        aggregate_store: Optional[AggregateStore],
+        local_indices: Mapping[str, LocalIndex],
         add_next_tick_callback: Callable[[Callable[[], None]], None],
     ):
         self._top_n_words = top_n_words
+        self._num_client_side_candidate_words = num_client_side_candidate_words
+        self._preview_sample_size = preview_sample_size
         self._min_date = min_date
         self._max_date = max_date
         self._date_range_widget = date_range_widget
         self._dataset_widget = dataset_widget
         self._word_freqs_widget = word_freqs_widget
         self._num_docs_figure = num_docs_figure
+        self._aggregate_store = aggregate_store
+        self._local_indices = local_indices
         self._add_next_tick_callback = add_next_tick_callback
 
         self._source = ColumnDataSource(self._new_source_data())
@@ -170,37 +139,109 @@ class WordFreqsFigure:
             width=100,
             height=30,
         )
-        export_csv.js_on_click(
-            CustomJS(
-                args={"source": self._source},
-                code=(Path(__file__).parent / "export_csv.js").read_text(
-                    encoding="UTF-8"
-                ),
-            )
+        # With an aggregate store, the URL of its entry is set once it is displayed,
+        # and the export is streamed from the server.
+        self._export_csv_callback = CustomJS(
+            args={"source": self._source, "url": ""},
+            code=(Path(__file__).parent / "export_csv.js").read_text(encoding="UTF-8"),
+        )
+        export_csv.js_on_click(self._export_csv_callback)
+        # Words beyond the top words are browsed in pages, which are only fetched when
+        # requested.
+        self._previous_page = Button(
+            label="\N{BLACK LEFT-POINTING TRIANGLE}",
+            sizing_mode="fixed",
+            width=30,
+            height=30,
+            disabled=True,
+        )
+        self._previous_page.on_click(lambda _event: self._on_click_page(-1))
+        self._next_page = Button(
+            label="\N{BLACK RIGHT-POINTING TRIANGLE}",
+            sizing_mode="fixed",
+            width=30,
+            height=30,
         )
+        self._next_page.on_click(lambda _event: self._on_click_page(+1))
         self.figure = column(
-            row(self._stats, export_csv, sizing_mode="stretch_width"),
+            row(
+                self._stats,
+                self._previous_page,
+                self._next_page,
+                export_csv,
+                sizing_mode="stretch_width",
+            ),
             freqs_table,
         )
 
+        # If enabled, the word frequencies per day of the top candidate words are sent
+        # to the browser once per selection, which then recomputes the table itself
+        # whenever the selected date range changes.
+        self._client_side_source = ColumnDataSource(self._new_client_side_data())
+        if self.client_side_date_range:
+            self._date_range_widget.slider.js_on_change(
+                "value",
+                CustomJS(
+                    args={
+                        "source": self._source,
+                        "client_side_source": self._client_side_source,
+                        "stats": self._stats,
+                        "top_n_words": self._top_n_words,
+                    },
+                    code=(Path(__file__).parent / "word_freqs_date_range.js").read_text(
+                        encoding="UTF-8"
+                    ),
+                ),
+            )
+
         self._last_selection: Optional[Hashable] = None
-        self._word_freqs_per_day: Optional[Mapping[str, Sequence[int]]] = None
-        self._num_docs_per_day: Optional[Sequence[int]] = None
+        self._stale_datasets: MutableSet[str] = set()
+        self._aggregate: Optional[Aggregate] = None
         self._took_msecs: Optional[int] = None
+        self._client_side_state: Optional[Tuple[Aggregate, bool]] = None
+        self._page = 0
+        self._num_pages: Optional[int] = None
+        self._top_words: AbstractSet[str] = frozenset()
+        self._vocabulary_size: Optional[Tuple[Hashable, int]] = None
+
+    @property
+    def client_side_date_range(self) -> bool:
+        return self._num_client_side_candidate_words is not None
+
+    def set_min_and_max_date(
+        self, min_date: date, max_date: date, changed_datasets: AbstractSet[str]
+    ) -> None:
+        # Cached word frequencies are extended to the new dates on the next update.
+        # For changed datasets, days on which the number of documents changed are
+        # fetched again.
+        self._min_date = min_date
+        self._max_date = max_date
+        self._stale_datasets.update(changed_datasets)
 
     @classmethod
-    def _new_source_data(cls) -> Mapping[str, List[object]]:
+    def _new_source_data(cls) -> MutableMapping[str, Sequence[object]]:
         return {
             "words": [],
             "freqs": [],
         }
 
+    @classmethod
+    def _new_client_side_data(cls) -> MutableMapping[str, Sequence[object]]:
+        return {
+            "words": [],
+            "word_freqs": [],
+            "num_docs": [],
+            "min_date": [],
+            "normalize": [],
+        }
+
     @property
     def selection(self) -> Hashable:
         result = {
             "dataset": self._dataset_widget.dataset,
             "lang": self._dataset_widget.lang,
             "cooccur_words": self._dataset_widget.cooccur_words,
+            "word_filter": self._word_freqs_widget.word_filter,
         }
 
         if self._dataset_widget.dataset.type == DatasetType.NASTY:
@@ -230,57 +271,143 @@ class WordFreqsFigure:
     def _compute_update(self) -> None:
         _LOGGER.debug("Computing update.")
 
-        # TODO: add lock around this if?
-        selection = self.selection
-        if self._last_selection != selection:
-            (  # Ensure "atomic" update via tuple assignment.
-                self._last_selection,
-                (self._word_freqs_per_day, self._num_docs_per_day, self._took_msecs),
-            ) = (selection, self._fetch_word_freqs_per_day(self._dataset_widget))
-            self._add_next_tick_callback(
-                partial(self._num_docs_figure.display_update, self._num_docs_per_day)
-            )
-
         dates = list(date_range(self._min_date, self._max_date))
+        self._update_aggregate(dates, preview=True)
+        aggregate = self._aggregate
+        assert aggregate is not None
+
         min_date, max_date = self._date_range_widget.min_and_max_date
         date_slice = slice(dates.index(min_date), dates.index(max_date) + 1)
 
-        num_docs = sum(self._num_docs_per_day[date_slice])
+        num_docs_per_day = aggregate.num_docs[date_slice]
+        word_freqs_per_day = aggregate.word_freqs[:, date_slice]
+        num_docs = int(num_docs_per_day.sum())
 
-        word_freqs = Counter[str]()
         if self._word_freqs_widget.should_normalize:
             smoothing_factor = 0.1
-            smoothing_denominator = smoothing_factor * len(
-                self._num_docs_per_day[date_slice]
+            smoothing_denominator = smoothing_factor * len(num_docs_per_day)
+            freqs = (
+                (word_freqs_per_day + smoothing_factor)
+                / (num_docs_per_day + smoothing_denominator)
+            ).sum(axis=1)
+        else:
+            freqs = word_freqs_per_day.sum(axis=1)
+        word_freqs = Counter[str](dict(zip(aggregate.words, freqs.tolist())))
+
+        new_data = self._make_source_data(word_freqs.most_common(self._top_n_words))
+        self._top_words = frozenset(new_data["words"])
+
+        client_side_data = None
+        if self.client_side_date_range:
+            client_side_data = self._compute_client_side_data(aggregate)
+
+        self._add_next_tick_callback(
+            partial(
+                self._display_update,
+                new_data,
+                client_side_data,
+                num_docs,
+                self._took_msecs,
             )
+        )
 
-            for word, freqs_per_day in self._word_freqs_per_day.items():
-                normalized_freq_sum = 0
-                for num_docs_on_day, freq_on_day in zip(
-                    self._num_docs_per_day[date_slice], freqs_per_day[date_slice]
-                ):
-                    normalized_freq_sum += (freq_on_day + smoothing_factor) / (
-                        num_docs_on_day + smoothing_denominator
-                    )
-                word_freqs[word] = normalized_freq_sum
+    def _make_source_data(
+        self, word_freqs: Iterable[Tuple[str, float]]
+    ) -> Mapping[str, Sequence[object]]:
+        words: List[str] = []
+        word_freqs_list: List[float] = []
+        for word, freq in islice(self._filter_words(word_freqs), self._top_n_words):
+            words.append(word)
+            word_freqs_list.append(freq)
 
-        else:
-            for word, freqs_per_day in self._word_freqs_per_day.items():
-                word_freqs[word] = sum(freqs_per_day[date_slice])
+        # Words can only be sent as JSON, but frequencies are sent as binary buffers.
+        new_data = self._new_source_data()
+        new_data["words"] = words
+        new_data["freqs"] = np.array(
+            word_freqs_list,
+            dtype=np.float32 if self._word_freqs_widget.should_normalize else np.int32,
+        )
+        return new_data
+
+    def _display_preview(self) -> None:
+        # Shows word frequencies estimated from a sample of the matching documents
+        # while the exact word frequencies per day are still being fetched. Normalized
+        # frequencies need the number of documents per day and are not estimated.
+        # Rollups and local indices are fast enough on their own.
+        dataset_widget = self._dataset_widget
+        if (
+            not self._preview_sample_size
+            or self._word_freqs_widget.should_normalize
+            or dataset_widget.dataset.name in self._local_indices
+            or dataset_widget.can_use_rollup
+        ):
+            return
+
+        search_helper = dataset_widget.make_search_helper()
+        subset, include, exclude = self._get_word_filter_terms_args(
+            search_helper, dataset_widget
+        )
+        min_date, max_date = self._date_range_widget.min_and_max_date
+        search = search_helper.add_agg_num_docs(Search().extra(size=0))
+        search = dataset_widget.set_search(search)
+        search = search_helper.filter_date_range(
+            search, gte=min_date, lt=max_date + timedelta(days=1)
+        )
+        search = search_helper.add_agg_sampled_text_tokens_terms(
+            search,
+            shard_size=self._preview_sample_size,
+            size=self._top_n_words,
+            include=include,
+            exclude=exclude,
+            subset=subset,
+        )
+
+        time_before = time()
+        response = search.execute()
+        time_after = time()
+
+        # Extrapolate from the sample to all matching documents.
+        num_docs = search_helper.read_agg_num_docs(response)
+        num_sampled_docs, buckets = search_helper.read_agg_sampled_text_tokens_terms(
+            response, subset
+        )
+        factor = num_docs / num_sampled_docs if num_sampled_docs else 0
+        new_data = self._make_source_data(
+            (bucket.key, round(bucket.doc_count * factor)) for bucket in buckets
+        )
+
+        self._add_next_tick_callback(
+            partial(
+                self._display_update,
+                new_data,
+                None,
+                num_docs,
+                int((time_after - time_before) * 1000),
+                num_sampled_docs=num_sampled_docs,
+            )
+        )
 
+    def prefetch(self) -> None:
+        # Only fetches and stores the aggregate of the current selection for the whole
+        # date range, without displaying anything.
+        self._update_aggregate(list(date_range(self._min_date, self._max_date)))
+
+    def _filter_words(
+        self, word_freqs: Iterable[Tuple[str, float]]
+    ) -> Iterator[Tuple[str, float]]:
+        # Expects word frequencies in descending order.
         word_filter = self._word_freqs_widget.word_filter
         stopwords = set()
         if word_filter == WordFilter.ONLY_NON_STOPWORDS:
-            stopwords = _get_stopwords(self._dataset_widget.lang)
+            stopwords = get_stopwords(self._dataset_widget.lang)
 
-        new_data = self._new_source_data()
-        for word, freq in word_freqs.most_common(self._top_n_words):
+        for word, freq in word_freqs:
             if not freq:
                 break
             if (
                 (
                     word_filter == WordFilter.ONLY_NON_STOPWORDS
-                    and (word in stopwords or not _filter_non_letters_unicode(word))
+                    and (word in stopwords or not filter_non_letters_unicode(word))
                 )
                 or (
                     word_filter == WordFilter.ONLY_HASHTAGS and not word.startswith("#")
@@ -290,25 +417,158 @@ class WordFreqsFigure:
                 )
             ):
                 continue
+            yield word, freq
 
-            new_data["words"].append(word)
-            new_data["freqs"].append(freq)
+    def _compute_client_side_data(
+        self, aggregate: Aggregate
+    ) -> Optional[Mapping[str, Sequence[object]]]:
+        # Only send the data again if the aggregate changed since it was last sent.
+        normalize = self._word_freqs_widget.should_normalize
+        if (
+            self._client_side_state is not None
+            and self._client_side_state[0] is aggregate
+            and self._client_side_state[1] == normalize
+        ):
+            return None
+        self._client_side_state = (aggregate, normalize)
+
+        # Candidates are the most frequent words over all dates. The word frequencies
+        # are sent as a single two-dimensional binary array.
+        totals = aggregate.word_freqs.sum(axis=1)
+        order = np.argsort(-totals, kind="stable").tolist()
+        index_by_word = {word: i for i, word in enumerate(aggregate.words)}
+        candidates = [
+            word
+            for word, _ in islice(
+                self._filter_words((aggregate.words[i], int(totals[i])) for i in order),
+                self._num_client_side_candidate_words,
+            )
+        ]
+        indices = [index_by_word[word] for word in candidates]
+
+        new_data = self._new_client_side_data()
+        new_data["words"] = [candidates]
+        new_data["word_freqs"] = [aggregate.word_freqs[indices].astype(np.int32)]
+        new_data["num_docs"] = [aggregate.num_docs.astype(np.int32)]
+        new_data["min_date"] = [
+            date_to_timestamp(aggregate.dates[0], tzinfo_=timezone.utc) * 1000
+            if aggregate.dates
+            else 0
+        ]
+        new_data["normalize"] = [normalize]
+        return new_data
+
+    def _update_aggregate(
+        self, dates: Sequence[date], *, preview: bool = False
+    ) -> None:
+        # TODO: add lock around this if?
+        selection = self.selection
+        dataset_name = self._dataset_widget.dataset.name
+        if (
+            self._last_selection == selection
+            and self._aggregate is not None
+            and self._aggregate.dates == dates
+            and dataset_name not in self._stale_datasets
+        ):
+            return
+
+        if self._last_selection != selection or dataset_name in self._stale_datasets:
+            self._load_aggregate(selection)
+
+        if self._last_selection != selection:
+            if preview:
+                try:
+                    self._display_preview()
+                except Exception:
+                    # The preview is optional, still fetch the exact word frequencies.
+                    _LOGGER.warning("Could not display preview.", exc_info=True)
+            (  # Ensure "atomic" update via tuple assignment.
+                self._last_selection,
+                (self._aggregate, self._took_msecs),
+            ) = (selection, self._fetch_aggregate(self._dataset_widget, dates))
+            self._save_aggregate()
+
+        elif self._aggregate.dates != dates or dataset_name in self._stale_datasets:
+            self._extend_aggregate(dates)
+            self._save_aggregate()
 
+        self._stale_datasets.clear()
         self._add_next_tick_callback(
-            partial(self._display_update, new_data, num_docs, self._took_msecs)
+            partial(
+                self._num_docs_figure.display_update, self._aggregate.num_docs.tolist()
+            )
+        )
+
+    def _store_selection(self, selection: Hashable) -> Mapping[str, object]:
+        # Include the number of documents so that entries stored before the dataset
+        # changed are not used.
+        return {
+            **cast(Mapping[str, object], selection),
+            "top_n_words": self._top_n_words,
+            "num_docs": self._dataset_widget.num_docs,
+        }
+
+    def _load_aggregate(self, selection: Hashable) -> None:
+        if self._aggregate_store is None:
+            return
+
+        time_before = time()
+        aggregate = self._aggregate_store.get(
+            "word_freqs", self._store_selection(selection)
+        )
+        time_after = time()
+        if aggregate is None:
+            return
+
+        _LOGGER.debug("Loaded word frequencies per day from aggregate store.")
+        (  # Ensure "atomic" update via tuple assignment.
+            self._last_selection,
+            self._aggregate,
+            self._took_msecs,
+        ) = (selection, aggregate, int((time_after - time_before) * 1000))
+        self._stale_datasets.discard(self._dataset_widget.dataset.name)
+
+    def _save_aggregate(self) -> None:
+        if self._aggregate_store is None or self._aggregate is None:
+            return
+
+        store_selection = self._store_selection(self._last_selection)
+        self._aggregate_store.put("word_freqs", store_selection, self._aggregate)
+
+        # Continue with the memory-mapped version, so that memory is shared with
+        # all other sessions and worker processes.
+        self._aggregate = (
+            self._aggregate_store.get("word_freqs", store_selection) or self._aggregate
         )
 
     @coroutine
     def _display_update(
-        self, new_data: Mapping[str, List[object]], num_docs: int, took_msecs: int
+        self,
+        new_data: Mapping[str, Sequence[object]],
+        client_side_data: Optional[Mapping[str, Sequence[object]]],
+        num_docs: int,
+        took_msecs: int,
+        *,
+        num_sampled_docs: Optional[int] = None,
     ) -> None:
         _LOGGER.debug("Displaying update.")
 
-        self._date_range_widget.set_enabled(True)
-        self._dataset_widget.set_enabled(True)
-        self._word_freqs_widget.set_enabled(True)
-
-        self._source.data = new_data
+        update_column_data_source(self._source, new_data)
+        if num_sampled_docs is not None:
+            # Widgets stay disabled until the exact word frequencies are displayed.
+            self._stats.text = f"""
+                # matching documents: <strong>{num_docs:,}</strong>
+                &nbsp;&centerdot;&nbsp;
+                <strong style="color: red;">Approximate</strong> from a sample of
+                {num_sampled_docs:,} documents, loading exact frequencies...
+            """
+            return
+
+        self._set_enabled(True)
+        self._set_export_csv_url()
+
+        if client_side_data is not None:
+            self._client_side_source.data = client_side_data
         self._stats.text = f"""
             # matching documents: <strong>{num_docs:,}</strong>
             &nbsp;&centerdot;&nbsp;
@@ -316,11 +576,11 @@ class WordFreqsFigure:
         """
 
     def update(self) -> None:
-        self._date_range_widget.set_enabled(False)
-        self._dataset_widget.set_enabled(False)
-        self._word_freqs_widget.set_enabled(False)
-
-        self._source.data = self._new_source_data()
+        self._page = 0
+        self._num_pages = None
+        # The current words stay visible until the update is displayed, so that only
+        # changed values need to be sent.
+        self._set_enabled(False)
         self._stats.text = """
             <strong style="color: red;">Loading...</strong>
         """
@@ -329,26 +589,276 @@ class WordFreqsFigure:
 
         Thread(target=self._compute_update).start()
 
-    def _fetch_word_freqs_per_day(
+    def _set_export_csv_url(self) -> None:
+        if self._aggregate_store is None or self._last_selection is None:
+            return
+        url = word_freqs_csv_url(
+            self._aggregate_store.key(
+                "word_freqs", self._store_selection(self._last_selection)
+            )
+        )
+        self._export_csv_callback.args = {**self._export_csv_callback.args, "url": url}
+
+    def _set_enabled(self, enabled: bool) -> None:
+        self._date_range_widget.set_enabled(enabled)
+        self._dataset_widget.set_enabled(enabled)
+        self._word_freqs_widget.set_enabled(enabled)
+        self._previous_page.disabled = not enabled or self._page == 0
+        # Pages only contain absolute frequencies, so they are not available while
+        # frequencies are normalized.
+        self._next_page.disabled = (
+            not enabled
+            or self._word_freqs_widget.should_normalize
+            or (self._num_pages is not None and self._page + 1 >= self._num_pages)
+        )
+
+    def _on_click_page(self, delta: int) -> None:
+        page = self._page + delta
+        if page <= 0:
+            self.update()
+            return
+
+        self._page = page
+        self._set_enabled(False)
+        self._stats.text = """
+            <strong style="color: red;">Loading...</strong>
+        """
+        Thread(target=self._compute_page_update, args=(page,)).start()
+
+    def _compute_page_update(self, page: int) -> None:
+        _LOGGER.debug("Computing update of page {}.", page)
+
+        min_date, max_date = self._date_range_widget.min_and_max_date
+        local_index = self._local_indices.get(self._dataset_widget.dataset.name)
+        time_before = time()
+        if local_index is not None:
+            word_freqs, num_pages, vocabulary_size = self._fetch_local_page(
+                local_index, list(date_range(min_date, max_date)), page
+            )
+        else:
+            word_freqs, num_pages, vocabulary_size = self._fetch_page(
+                min_date, max_date, page
+            )
+        time_after = time()
+
+        self._add_next_tick_callback(
+            partial(
+                self._display_page_update,
+                self._make_source_data(word_freqs),
+                page,
+                num_pages,
+                vocabulary_size,
+                int((time_after - time_before) * 1000),
+            )
+        )
+
+    def _fetch_page(
+        self, min_date: date, max_date: date, page: int
+    ) -> Tuple[Sequence[Tuple[str, float]], int, int]:
+        # Elasticsearch can not page through terms ordered by frequency. Instead, each
+        # page after the first one contains the words of one partition of the
+        # vocabulary, ordered by frequency within that partition. Partitions can not
+        # be combined with a regular expression include or any exclude, so the word
+        # filter is only applied afterwards and the words of the first page are
+        # dropped here.
+        dataset_widget = self._dataset_widget
+        rollup = dataset_widget.can_use_rollup
+        search_helper = dataset_widget.make_search_helper(rollup=rollup)
+        subset, _include, _exclude = self._get_word_filter_terms_args(
+            search_helper, dataset_widget
+        )
+        search = dataset_widget.set_search(Search().extra(size=0), rollup=rollup)
+        search = search_helper.filter_date_range(
+            search, gte=min_date, lt=max_date + timedelta(days=1)
+        )
+
+        vocabulary_size = self._get_vocabulary_size(search, search_helper, subset)
+        num_partitions = max(ceil(vocabulary_size / self._top_n_words), 1)
+        if page > num_partitions:
+            return [], num_partitions + 1, vocabulary_size
+
+        # Partitions are only roughly equally sized, so leave some room.
+        search = search_helper.add_agg_text_tokens_terms(
+            search,
+            size=2 * self._top_n_words,
+            include={"partition": page - 1, "num_partitions": num_partitions},
+            subset=subset,
+        )
+        response = search.execute()
+        top_words = self._top_words
+        return (
+            [
+                (bucket.key, bucket.doc_count)
+                for bucket in search_helper.read_agg_text_tokens_terms(response, subset)
+                if bucket.key not in top_words
+            ],
+            num_partitions + 1,
+            vocabulary_size,
+        )
+
+    def _get_vocabulary_size(
+        self,
+        search: Search,
+        search_helper: SearchHelper,
+        subset: Optional[TextTokensSubset],
+    ) -> int:
+        key = (self.selection, self._date_range_widget.min_and_max_date)
+        if self._vocabulary_size is not None and self._vocabulary_size[0] == key:
+            return self._vocabulary_size[1]
+
+        response = search_helper.add_agg_text_tokens_cardinality(
+            search, subset
+        ).execute()
+        vocabulary_size = search_helper.read_agg_text_tokens_cardinality(response)
+        self._vocabulary_size = (key, vocabulary_size)
+        return vocabulary_size
+
+    def _fetch_local_page(
+        self, local_index: LocalIndex, dates: Sequence[date], page: int
+    ) -> Tuple[Sequence[Tuple[str, float]], int, int]:
+        # The local index counts all words, so pages are exact.
+        include, exclude = _get_word_filter_include_exclude(
+            self._word_freqs_widget.word_filter, self._dataset_widget.lang
+        )
+        search = self._dataset_widget.set_search(Search())
+        _num_docs, word_freqs_per_day = local_index.count_per_day(
+            local_index.match(search.to_dict().get("query")),
+            dates,
+            include=include,
+            exclude=exclude,
+        )
+        word_freqs = sorted(
+            ((word, int(freqs.sum())) for word, freqs in word_freqs_per_day.items()),
+            key=lambda word_freq: -word_freq[1],
+        )
+        num_pages = max(ceil(len(word_freqs) / self._top_n_words), 1)
+        return (
+            word_freqs[page * self._top_n_words : (page + 1) * self._top_n_words],
+            num_pages,
+            len(word_freqs),
+        )
+
+    @coroutine
+    def _display_page_update(
+        self,
+        new_data: Mapping[str, Sequence[object]],
+        page: int,
+        num_pages: int,
+        vocabulary_size: int,
+        took_msecs: int,
+    ) -> None:
+        _LOGGER.debug("Displaying update of page {}.", page)
+
+        self._num_pages = num_pages
+        self._set_enabled(True)
+
+        update_column_data_source(self._source, new_data)
+        self._stats.text = f"""
+            Page <strong>{page + 1:,}</strong> of {num_pages:,}
+            &nbsp;&centerdot;&nbsp;
+            Vocabulary: ~<strong>{vocabulary_size:,}</strong> words
+            &nbsp;&centerdot;&nbsp;
+            Request took: <strong>{took_msecs:,}&thinsp;ms</strong>
+        """
+
+    def _extend_aggregate(self, dates: Sequence[date]) -> None:
+        aggregate = self._aggregate
+        assert aggregate is not None
+
+        fetch_dates = set(dates) - set(aggregate.dates)
+        if self._dataset_widget.dataset.name in self._stale_datasets:
+            fetch_dates.update(self._fetch_changed_dates(self._dataset_widget))
+        _LOGGER.debug("Extending word frequencies by {} days.", len(fetch_dates))
+
+        fetched_aggregate, took_msecs = self._fetch_aggregate(
+            self._dataset_widget, sorted(fetch_dates)
+        )
+
+        words = sorted(set(aggregate.words) | set(fetched_aggregate.words))
+        extended_aggregate = aggregate.reindex(words, dates)
+        fetched_aggregate = fetched_aggregate.reindex(words, dates)
+        fetch_indices = [i for i, day in enumerate(dates) if day in fetch_dates]
+        extended_aggregate.word_freqs[:, fetch_indices] = fetched_aggregate.word_freqs[
+            :, fetch_indices
+        ]
+        extended_aggregate.num_docs[fetch_indices] = fetched_aggregate.num_docs[
+            fetch_indices
+        ]
+
+        (  # Ensure "atomic" update via tuple assignment.
+            self._aggregate,
+            self._took_msecs,
+        ) = (extended_aggregate, took_msecs)
+
+    def _fetch_changed_dates(self, dataset_widget: DatasetWidget) -> Sequence[date]:
+        aggregate = self._aggregate
+        assert aggregate is not None
+        # Local indices are snapshots that only change when rebuilt.
+        if not aggregate.dates or dataset_widget.dataset.name in self._local_indices:
+            return []
+
+        rollup = dataset_widget.can_use_rollup
+        search_helper = dataset_widget.make_search_helper(rollup=rollup)
+        search = Search().extra(size=0)
+        search = dataset_widget.set_search(search, rollup=rollup)
+        search = search_helper.filter_date_range(
+            search,
+            gte=aggregate.dates[0],
+            lt=aggregate.dates[-1] + timedelta(days=1),
+        )
+        search = search_helper.add_agg_text_tokens_date_histogram_terms(
+            search, calendar_interval="1d", size=0, include=None
+        )
+        response = search.execute()
+
+        num_docs_by_date = {}
+        for bucket, _ in search_helper.read_text_tokens_date_histogram_terms(response):
+            day = datetime.fromtimestamp(bucket.key / 1000, timezone.utc).date()
+            num_docs_by_date[day] = search_helper.read_date_histogram_bucket_num_docs(
+                bucket
+            )
+
+        return [
+            day
+            for day, num_docs in zip(aggregate.dates, aggregate.num_docs.tolist())
+            if num_docs_by_date.get(day, 0) != num_docs
+        ]
+
+    def _fetch_aggregate(
         self,
         dataset_widget: DatasetWidget,
-    ) -> Tuple[Mapping[str, Sequence[int]], Sequence[int], int]:
+        dates: Sequence[date],
+    ) -> Tuple[Aggregate, int]:
         _LOGGER.debug("Fetching word frequencies per day.")
-
-        search_helper = SearchHelper(dataset_widget.dataset.type)
-        search_template = Search().extra(size=0, track_total_hits=True)
-        search_template = dataset_widget.set_search(search_template)
+        if not dates:
+            return Aggregate.from_word_freqs_per_day([], {}, []), 0
+
+        local_index = self._local_indices.get(dataset_widget.dataset.name)
+        if local_index is not None:
+            return self._fetch_local_aggregate(local_index, dataset_widget, dates)
+
+        # Without co-occurrence words, the selection can be answered from the much
+        # smaller rollup index, if the dataset has one.
+        rollup = dataset_widget.can_use_rollup
+        search_helper = dataset_widget.make_search_helper(rollup=rollup)
+        search_template = search_helper.add_agg_num_docs(Search().extra(size=0))
+        search_template = dataset_widget.set_search(search_template, rollup=rollup)
+        subset, include, exclude = self._get_word_filter_terms_args(
+            search_helper, dataset_widget
+        )
         search_template = search_helper.add_agg_text_tokens_terms(
-            search_template, size=self._top_n_words
+            search_template,
+            size=self._top_n_words,
+            include=include,
+            exclude=exclude,
+            subset=subset,
         )
 
         search = MultiSearch()
-        for cur_date in date_range(self._min_date, self._max_date):
+        for cur_date in dates:
             search = search.add(
-                search_template.filter(
-                    search_helper.query_date_range(
-                        gte=cur_date, lt=cur_date + timedelta(days=1)
-                    )
+                search_helper.filter_date_range(
+                    search_template, gte=cur_date, lt=cur_date + timedelta(days=1)
                 )
             )
 
@@ -360,8 +870,54 @@ class WordFreqsFigure:
         word_freqs = defaultdict(lambda: [0] * len(responses))
         num_docs = []
         for i, response in enumerate(responses):
-            num_docs.append(response.hits.total.value)
-            for bucket in search_helper.read_agg_text_tokens_terms(response):
+            num_docs.append(search_helper.read_agg_num_docs(response))
+            for bucket in search_helper.read_agg_text_tokens_terms(response, subset):
                 word_freqs[bucket.key][i] = bucket.doc_count
 
-        return word_freqs, num_docs, took_msecs
+        return (
+            Aggregate.from_word_freqs_per_day(dates, word_freqs, num_docs),
+            took_msecs,
+        )
+
+    def _get_word_filter_terms_args(
+        self, search_helper: SearchHelper, dataset_widget: DatasetWidget
+    ) -> Tuple[Optional[TextTokensSubset], Optional[object], Optional[object]]:
+        # Aggregate on the field only containing words that pass the word filter, if
+        # the dataset was indexed with it.
+        word_filter = self._word_freqs_widget.word_filter
+        subset = _TEXT_TOKENS_SUBSET_BY_WORD_FILTER.get(word_filter)
+        if subset is not None and search_helper.has_text_tokens_subset_field(subset):
+            return subset, None, None
+        include, exclude = _get_word_filter_include_exclude(
+            word_filter, dataset_widget.lang
+        )
+        return None, include, exclude
+
+    def _fetch_local_aggregate(
+        self,
+        local_index: LocalIndex,
+        dataset_widget: DatasetWidget,
+        dates: Sequence[date],
+    ) -> Tuple[Aggregate, int]:
+        # Evaluates the same filters as the Elasticsearch search. The local index only
+        # has all text tokens, so word filters always use include and exclude.
+        include, exclude = _get_word_filter_include_exclude(
+            self._word_freqs_widget.word_filter, dataset_widget.lang
+        )
+        search = dataset_widget.set_search(Search())
+
+        time_before = time()
+        num_docs, word_freqs = local_index.count_per_day(
+            local_index.match(search.to_dict().get("query")),
+            dates,
+            size=self._top_n_words,
+            include=include,
+            exclude=exclude,
+        )
+        time_after = time()
+        took_msecs = int((time_after - time_before) * 1000)
+
+        return (
+            Aggregate.from_word_freqs_per_day(dates, word_freqs, num_docs),
+            took_msecs,
+        )
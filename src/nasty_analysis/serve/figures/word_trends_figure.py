@@ -15,13 +15,14 @@
 #
 
 from collections import defaultdict
-from datetime import date, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from functools import partial
 from logging import getLogger
 from pathlib import Path
 from threading import Thread
 from time import time
 from typing import (
+    AbstractSet,
     Callable,
     Hashable,
     List,
@@ -30,8 +31,10 @@ from typing import (
     Optional,
     Sequence,
     Tuple,
+    cast,
 )
 
+import numpy as np
 from bokeh.layouts import column, row
 from bokeh.models import (
     Button,
@@ -43,11 +46,20 @@ from bokeh.models import (
 )
 from bokeh.palettes import Category20_20
 from bokeh.plotting import Figure
-from elasticsearch_dsl import Search
+from elasticsearch_dsl import MultiSearch, Search
+from elasticsearch_dsl.response import Response
 from nasty_utils import ColoredBraceStyleAdapter, date_range, date_to_datetime
 from tornado.gen import coroutine
 
+from nasty_analysis._utils.bokeh_ import datetime64_array, update_column_data_source
+from nasty_analysis._utils.time_series import (
+    Granularity,
+    downsample_indices,
+    resample_per_day,
+)
+from nasty_analysis.local_index import LocalIndex
 from nasty_analysis.search_helper import SearchHelper
+from nasty_analysis.serve.aggregate_store import Aggregate, AggregateStore
 from nasty_analysis.serve.widgets.dataset_words_widget import DatasetWordsWidget
 from nasty_analysis.serve.widgets.date_range_widget import DateRangeWidget
 from nasty_analysis.serve.widgets.word_trends_widget import WordTrendsWidget
@@ -55,6 +67,8 @@ from nasty_analysis.settings import DatasetType
 
 _LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
 
+_MAX_NUM_POINTS = 1000
+
 
 class WordTrendsFigure:
     def __init__(
@@ -64,6 +78,8 @@ class WordTrendsFigure:
         date_range_widget: DateRangeWidget,
         dataset_words_widgets: Sequence[DatasetWordsWidget],
         word_trends_widget: WordTrendsWidget,
+        aggregate_store: Optional[AggregateStore],
+        local_indices: Mapping[str, LocalIndex],
         add_next_tick_callback: Callable[[Callable[[], None]], None],
     ):
         self._min_date = min_date
@@ -71,6 +87,8 @@ class WordTrendsFigure:
         self._date_range_widget = date_range_widget
         self._dataset_words_widgets = dataset_words_widgets
         self._word_trends_widget = word_trends_widget
+        self._aggregate_store = aggregate_store
+        self._local_indices = local_indices
         self._add_next_tick_callback = add_next_tick_callback
 
         self._source = ColumnDataSource(self._new_source_data())
@@ -90,7 +108,7 @@ class WordTrendsFigure:
         trends_figure.toolbar.autohide = True
         trends_figure.toolbar.logo = None
         trends_figure.xaxis[0].formatter = DatetimeTickFormatter(
-            days=["%d %b"], months=["%b"]
+            hours=["%H:%M"], days=["%d %b"], months=["%b"]
         )
         trends_figure.yaxis[0].formatter = NumeralTickFormatter(format="0a")
 
@@ -141,24 +159,41 @@ class WordTrendsFigure:
         self._last_selection: Sequence[Optional[Hashable]] = [
             None for _ in range(len(self._dataset_words_widgets))
         ]
-        self._word_freqs_per_day: Sequence[Optional[Mapping[str, Sequence[int]]]] = [
-            None for _ in range(len(self._dataset_words_widgets))
-        ]
-        self._num_docs_per_day: Sequence[Optional[Sequence[int]]] = [
+        self._aggregates: Sequence[Optional[Aggregate]] = [
             None for _ in range(len(self._dataset_words_widgets))
         ]
         self._took_msecs: Sequence[Optional[int]] = [
             None for _ in range(len(self._dataset_words_widgets))
         ]
 
+    def set_min_and_max_date(
+        self, min_date: date, max_date: date, changed_datasets: AbstractSet[str]
+    ) -> None:
+        # Word frequencies of unchanged datasets only need to be padded with zeros for
+        # the new dates. Changed datasets are fetched again on the next update.
+        dates = list(date_range(min_date, max_date))
+        for i, widget in enumerate(self._dataset_words_widgets):
+            aggregate = self._aggregates[i]
+            if (
+                widget.dataset_widget.dataset.name in changed_datasets
+                or aggregate is None
+            ):
+                self._last_selection[i] = None
+                continue
+            self._aggregates[i] = aggregate.reindex(aggregate.words, dates)
+
+        self._min_date = min_date
+        self._max_date = max_date
+
     @classmethod
-    def _new_source_data(cls) -> MutableMapping[str, List[object]]:
-        return {"dates": []}
+    def _new_source_data(cls) -> MutableMapping[str, np.ndarray]:
+        return {"dates": np.array([], dtype="datetime64[ms]")}
 
     def selection(self, index: int) -> Hashable:
+        # Only includes what affects the fetched word frequencies. The selected date
+        # range is served by slicing and words are fetched individually.
         widget = self._dataset_words_widgets[index]
         result = {
-            "min_and_max_date": self._date_range_widget.min_and_max_date,
             "dataset": widget.dataset_widget.dataset,
             "lang": widget.dataset_widget.lang,
             "cooccur_words": widget.dataset_widget.cooccur_words,
@@ -185,53 +220,151 @@ class WordTrendsFigure:
         ):
             result.update({"code_identifier": widget.dataset_widget.code_identifier})
 
-        result.update({"words": widget.words})
         return result
 
     def _compute_update(self) -> None:
         _LOGGER.debug("Computing update.")
 
-        for i in range(len(self._dataset_words_widgets)):
-            selection = self.selection(i)
-            if self._last_selection[i] != selection:
-                (  # Ensure "atomic" update via tuple assignment.
-                    self._last_selection[i],
-                    (
-                        self._word_freqs_per_day[i],
-                        self._num_docs_per_day[i],
-                        self._took_msecs[i],
-                    ),
-                ) = (
-                    selection,
-                    self._fetch_word_freqs_per_day(self._dataset_words_widgets[i]),
-                )
-
-        dates = list(date_range(self._min_date, self._max_date))
         min_date, max_date = self._date_range_widget.min_and_max_date
-        date_slice = slice(dates.index(min_date), dates.index(max_date) + 1)
+        selected_granularity = self._word_trends_widget.granularity
+        granularity = selected_granularity.resolve(min_date, max_date)
+        if granularity == Granularity.HOUR:
+            x, series, wall_msecs, took_msecs = self._fetch_series_per_hour(
+                min_date, max_date
+            )
+        else:
+            x, series, wall_msecs, took_msecs = self._compute_series_per_day(
+                min_date, max_date, granularity
+            )
 
+        # Downsample very long series so that browsers do not have to draw them.
+        indices = downsample_indices(
+            np.array([t.timestamp() for t in x]),
+            np.array(list(series.values())),
+            _MAX_NUM_POINTS,
+        )
+
+        # Send integer series as int32, as Bokeh cannot encode int64 arrays as binary.
         new_data = self._new_source_data()
-        new_data["dates"] = [
-            date_to_datetime(day, tzinfo_=timezone.utc)
-            for day in date_range(min_date, max_date)
-        ]
-        for i, dataset_word_widget in enumerate(self._dataset_words_widgets):
-            if dataset_word_widget.should_num_docs:
-                new_data["d{}_num_docs".format(i)] = self._num_docs_per_day[i][
-                    date_slice
-                ]
-            for word in dataset_word_widget.words:
-                new_data["d{}_{}".format(i, word)] = self._word_freqs_per_day[i][word][
-                    date_slice
-                ]
+        new_data["dates"] = datetime64_array([x[i] for i in indices])
+        for key, values in series.items():
+            values = values[indices]
+            if np.issubdtype(values.dtype, np.integer):
+                values = values.astype(np.int32)
+            new_data[key] = values
 
         self._add_next_tick_callback(
-            partial(self._display_update, new_data, sum(self._took_msecs))
+            partial(
+                self._display_update,
+                new_data,
+                wall_msecs,
+                took_msecs,
+                selected_granularity,
+                granularity,
+            )
         )
 
+    def _compute_series_per_day(
+        self, min_date: date, max_date: date, granularity: Granularity
+    ) -> Tuple[
+        Sequence[datetime], Mapping[str, np.ndarray], int, Sequence[Optional[int]]
+    ]:
+        dates = list(date_range(self._min_date, self._max_date))
+        wall_msecs = self._update_aggregates(dates)
+        visible_dates = dates[dates.index(min_date) : dates.index(max_date) + 1]
+
+        buckets: Sequence[date] = []
+        series = {}
+        for i, dataset_word_widget in enumerate(self._dataset_words_widgets):
+            aggregate = self._aggregates[i]
+            assert aggregate is not None
+            aggregate = aggregate.reindex(dataset_word_widget.words, visible_dates)
+            buckets, num_docs = resample_per_day(
+                visible_dates, aggregate.num_docs, granularity
+            )
+            _, word_freqs = resample_per_day(
+                visible_dates, aggregate.word_freqs, granularity
+            )
+
+            if dataset_word_widget.should_num_docs:
+                series["d{}_num_docs".format(i)] = num_docs
+            for word, freqs in zip(aggregate.words, word_freqs):
+                series["d{}_{}".format(i, word)] = freqs
+
+        x = [date_to_datetime(day, tzinfo_=timezone.utc) for day in buckets]
+        return x, series, wall_msecs, list(self._took_msecs)
+
+    def _fetch_series_per_hour(
+        self, min_date: date, max_date: date
+    ) -> Tuple[
+        Sequence[datetime], Mapping[str, np.ndarray], int, Sequence[Optional[int]]
+    ]:
+        # Hourly series are only fetched for the selected date range and not cached.
+        _LOGGER.debug("Fetching word frequencies per hour.")
+
+        hours = [
+            date_to_datetime(min_date, tzinfo_=timezone.utc) + timedelta(hours=i)
+            for i in range(24 * ((max_date - min_date).days + 1))
+        ]
+        index_by_timestamp = {
+            int(hour.timestamp() * 1000): i for i, hour in enumerate(hours)
+        }
+
+        search = MultiSearch()
+        for dataset_words_widget in self._dataset_words_widgets:
+            search = search.add(
+                self._build_search(
+                    dataset_words_widget,
+                    dataset_words_widget.words,
+                    min_date,
+                    max_date,
+                    Granularity.HOUR,
+                )
+            )
+
+        time_before = time()
+        responses = search.execute()
+        time_after = time()
+        wall_msecs = int((time_after - time_before) * 1000)
+
+        series = {}
+        took_msecs: List[Optional[int]] = []
+        for i, (dataset_words_widget, response) in enumerate(
+            zip(self._dataset_words_widgets, responses)
+        ):
+            search_helper = SearchHelper(
+                dataset_words_widget.dataset_widget.dataset.type
+            )
+            num_docs = np.zeros(len(hours), dtype=np.int32)
+            word_freqs = {
+                word: np.zeros(len(hours), dtype=np.int32)
+                for word in dataset_words_widget.words
+            }
+            for (
+                bucket,
+                inner_buckets,
+            ) in search_helper.read_text_tokens_date_histogram_terms(response):
+                j = index_by_timestamp[bucket.key]
+                num_docs[j] = bucket.doc_count
+                for inner_bucket in inner_buckets:
+                    word_freqs[inner_bucket.key][j] = inner_bucket.doc_count
+
+            if dataset_words_widget.should_num_docs:
+                series["d{}_num_docs".format(i)] = num_docs
+            for word, freqs in word_freqs.items():
+                series["d{}_{}".format(i, word)] = freqs
+            took_msecs.append(response.took)
+
+        return hours, series, wall_msecs, took_msecs
+
     @coroutine
     def _display_update(
-        self, new_data: Mapping[str, List[object]], took_msecs: int
+        self,
+        new_data: Mapping[str, np.ndarray],
+        wall_msecs: int,
+        took_msecs: Sequence[Optional[int]],
+        selected_granularity: Granularity,
+        granularity: Granularity,
     ) -> None:
         _LOGGER.debug("Displaying update.")
 
@@ -242,7 +375,7 @@ class WordTrendsFigure:
 
         glyphs = iter(self._glyphs)
         try:
-            self._source.data = new_data
+            update_column_data_source(self._source, new_data)
 
             for key in new_data:
                 if key == "dates":
@@ -254,8 +387,23 @@ class WordTrendsFigure:
                 circle.glyph.y = key
                 circle.visible = True
 
+            took_msecs_str = " &centerdot; ".join(
+                f"{t:,}&thinsp;ms" if t is not None else "&ndash;" for t in took_msecs
+            )
+            # Hours are only available for short date ranges and are otherwise
+            # replaced by days, so always show what is actually displayed.
+            granularity_str = f"<strong>{granularity.label}</strong>"
+            if selected_granularity not in (Granularity.AUTO, granularity):
+                granularity_str += (
+                    f" ({selected_granularity.label.lower()} not available for "
+                    "this date range)"
+                )
             self._stats.text = f"""
-                Request took: <strong>{took_msecs:,}&thinsp;ms</strong>
+                Granularity: {granularity_str}
+                &nbsp;&centerdot;&nbsp;
+                Request took: <strong>{wall_msecs:,}&thinsp;ms</strong>
+                &nbsp;&centerdot;&nbsp;
+                Per dataset: {took_msecs_str}
             """
         except StopIteration:
             self._stats.text = f"""
@@ -278,31 +426,194 @@ class WordTrendsFigure:
 
         Thread(target=self._compute_update).start()
 
-    def _fetch_word_freqs_per_day(
-        self, dataset_words_widget: DatasetWordsWidget
-    ) -> Tuple[Mapping[str, Sequence[int]], Sequence[int], int]:
-        _LOGGER.debug("Fetching word frequencies per day.")
+    def _update_aggregates(self, dates: Sequence[date]) -> int:
+        # Words missing for any of the dataset words widgets are fetched in a single
+        # MultiSearch. Returns the wall time of that request.
+        selections = []
+        aggregates = []
+        took_msecs = []
+        fetches = []
+        for i, dataset_words_widget in enumerate(self._dataset_words_widgets):
+            selection = self.selection(i)
+            aggregate = self._aggregates[i]
+            took_msecs.append(self._took_msecs[i])
+            if self._last_selection[i] != selection:
+                aggregate, took_msecs[i] = self._load_aggregate(
+                    self._store_selection(i, selection), dates
+                )
 
-        search_helper = SearchHelper(dataset_words_widget.dataset_widget.dataset.type)
-        search = Search().extra(size=0, track_total_hits=True)
-        search = dataset_words_widget.dataset_widget.set_search(search)
-        search = search.filter(
-            search_helper.query_date_range(
-                gte=self._min_date, lt=self._max_date + timedelta(days=1)
+            missing_words = sorted(
+                set(dataset_words_widget.words)
+                - set(aggregate.words if aggregate is not None else ())
+            )
+            if aggregate is None or missing_words:
+                fetches.append((i, missing_words))
+
+            selections.append(selection)
+            aggregates.append(aggregate)
+
+        def put_fetched_aggregate(
+            i: int, fetched_aggregate: Aggregate, took_msecs_: int
+        ) -> None:
+            aggregate = aggregates[i]
+            aggregates[i] = (
+                self._merge_aggregates(aggregate, fetched_aggregate)
+                if aggregate is not None
+                else fetched_aggregate
             )
+            took_msecs[i] = took_msecs_
+            if self._aggregate_store is not None:
+                self._aggregate_store.put(
+                    "word_trends",
+                    self._store_selection(i, selections[i]),
+                    aggregates[i],
+                )
+
+        wall_msecs = 0
+        local_fetches = [
+            (i, words) for i, words in fetches if self._local_index(i) is not None
+        ]
+        for i, words in local_fetches:
+            put_fetched_aggregate(i, *self._fetch_local_aggregate(i, words))
+        fetches = [fetch for fetch in fetches if fetch not in local_fetches]
+
+        if fetches:
+            search = MultiSearch()
+            for i, words in fetches:
+                search = search.add(
+                    self._build_search(
+                        self._dataset_words_widgets[i],
+                        words,
+                        self._min_date,
+                        self._max_date,
+                        Granularity.DAY,
+                    )
+                )
+
+            time_before = time()
+            responses = search.execute()
+            time_after = time()
+            wall_msecs = int((time_after - time_before) * 1000)
+
+            for (i, words), response in zip(fetches, responses):
+                put_fetched_aggregate(
+                    i,
+                    self._read_aggregate(
+                        self._dataset_words_widgets[i], words, response
+                    ),
+                    response.took,
+                )
+
+        (  # Ensure "atomic" update via tuple assignment.
+            self._last_selection,
+            self._aggregates,
+            self._took_msecs,
+        ) = (selections, aggregates, took_msecs)
+        return wall_msecs
+
+    def _local_index(self, index: int) -> Optional[LocalIndex]:
+        return self._local_indices.get(
+            self._dataset_words_widgets[index].dataset_widget.dataset.name
         )
-        search = search_helper.add_agg_text_tokens_date_histogram_terms(
-            search,
-            calendar_interval="1d",
-            size=len(dataset_words_widget.words),
-            include=dataset_words_widget.words,
+
+    def _fetch_local_aggregate(
+        self, index: int, words: Sequence[str]
+    ) -> Tuple[Aggregate, int]:
+        local_index = self._local_index(index)
+        assert local_index is not None
+        dataset_widget = self._dataset_words_widgets[index].dataset_widget
+        dates = list(date_range(self._min_date, self._max_date))
+        search = dataset_widget.set_search(Search())
+
+        time_before = time()
+        num_docs, word_freqs = local_index.count_per_day(
+            local_index.match(search.to_dict().get("query")), dates, words=words
+        )
+        time_after = time()
+
+        # Words without any occurrences are included as zero rows.
+        return (
+            Aggregate.from_word_freqs_per_day(dates, word_freqs, num_docs).reindex(
+                words, dates
+            ),
+            int((time_after - time_before) * 1000),
         )
 
+    def _store_selection(self, index: int, selection: Hashable) -> Mapping[str, object]:
+        # Include the number of documents so that entries stored before the dataset
+        # changed are not used.
+        return {
+            **cast(Mapping[str, object], selection),
+            "num_docs": self._dataset_words_widgets[index].dataset_widget.num_docs,
+        }
+
+    def _load_aggregate(
+        self, store_selection: Mapping[str, object], dates: Sequence[date]
+    ) -> Tuple[Optional[Aggregate], Optional[int]]:
+        if self._aggregate_store is None:
+            return None, None
+
         time_before = time()
-        response = search.execute()
+        aggregate = self._aggregate_store.get("word_trends", store_selection)
         time_after = time()
-        took_msecs = int((time_after - time_before) * 1000)
+        if aggregate is None or aggregate.dates != dates:
+            return None, None
+
+        _LOGGER.debug("Loaded word frequencies per day from aggregate store.")
+        return aggregate, int((time_after - time_before) * 1000)
+
+    @classmethod
+    def _merge_aggregates(
+        cls, aggregate: Aggregate, fetched_aggregate: Aggregate
+    ) -> Aggregate:
+        # Words of the fetched aggregate are added to the words of the aggregate. Words
+        # without any occurrences are kept as zero rows, so they are not fetched again.
+        words = sorted(set(aggregate.words) | set(fetched_aggregate.words))
+        result = aggregate.reindex(words, aggregate.dates)
+        fetched_words = set(fetched_aggregate.words)
+        fetched_aggregate = fetched_aggregate.reindex(words, aggregate.dates)
+        rows = [i for i, word in enumerate(words) if word in fetched_words]
+        result.word_freqs[rows] = fetched_aggregate.word_freqs[rows]
+        return result
+
+    @classmethod
+    def _build_search(
+        cls,
+        dataset_words_widget: DatasetWordsWidget,
+        words: Sequence[str],
+        min_date: date,
+        max_date: date,
+        granularity: Granularity,
+    ) -> Search:
+        # The rollup index only has daily resolution.
+        rollup = (
+            granularity != Granularity.HOUR
+            and dataset_words_widget.dataset_widget.can_use_rollup
+        )
+        search_helper = dataset_words_widget.dataset_widget.make_search_helper(
+            rollup=rollup
+        )
+        search = Search().extra(size=0, track_total_hits=True)
+        search = dataset_words_widget.dataset_widget.set_search(search, rollup=rollup)
+        search = search_helper.filter_date_range(
+            search, gte=min_date, lt=max_date + timedelta(days=1)
+        )
+        return search_helper.add_agg_text_tokens_date_histogram_terms(
+            search,
+            calendar_interval=granularity.calendar_interval,
+            size=len(words),
+            include=words,
+        )
 
+    def _read_aggregate(
+        self,
+        dataset_words_widget: DatasetWordsWidget,
+        words: Sequence[str],
+        response: Response,
+    ) -> Aggregate:
+        search_helper = dataset_words_widget.dataset_widget.make_search_helper(
+            rollup=dataset_words_widget.dataset_widget.can_use_rollup
+        )
         dates = list(date_range(self._min_date, self._max_date))
         word_freqs = defaultdict(lambda: [0] * len(dates))
         num_docs = [0] * len(dates)
@@ -311,8 +622,11 @@ class WordTrendsFigure:
             inner_buckets,
         ) in search_helper.read_text_tokens_date_histogram_terms(response):
             i = dates.index(date.fromtimestamp(bucket.key / 1000))
-            num_docs[i] = bucket.doc_count
+            num_docs[i] = search_helper.read_date_histogram_bucket_num_docs(bucket)
             for inner_bucket in inner_buckets:
                 word_freqs[inner_bucket.key][i] = inner_bucket.doc_count
 
-        return word_freqs, num_docs, took_msecs
+        # Words without any occurrences are included as zero rows.
+        return Aggregate.from_word_freqs_per_day(dates, word_freqs, num_docs).reindex(
+            words, dates
+        )
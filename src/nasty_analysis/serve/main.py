@@ -14,10 +14,11 @@
 # limitations under the License.
 #
 
+from functools import partial
 from logging import getLogger
-from typing import cast
+from typing import AbstractSet, MutableMapping, Sequence, Type, Union, cast
 
-from bokeh.models import Tabs
+from bokeh.models import Div, Panel, Tabs
 from bokeh.plotting import curdoc
 from nasty_utils import ColoredBraceStyleAdapter
 
@@ -34,21 +35,56 @@ doc.title = "nasty-analysis"
 
 context = cast(Context, getattr(doc.session_context.server_context, "context"))
 
-word_freqs_panel = (
-    WordFreqsPanel(context=context, add_next_tick_callback=doc.add_next_tick_callback)
-    if context.settings.analysis.serve.word_freqs.enabled
-    else None
-)
+panel_types: Sequence[Type[Union[WordFreqsPanel, WordTrendsPanel]]] = [
+    panel_type
+    for panel_type, enabled in (
+        (WordFreqsPanel, context.settings.analysis.serve.word_freqs.enabled),
+        (WordTrendsPanel, context.settings.analysis.serve.word_trends.enabled),
+    )
+    if enabled
+]
+panels: MutableMapping[int, Union[WordFreqsPanel, WordTrendsPanel]] = {}
 
-word_trends_panel = (
-    WordTrendsPanel(context=context, add_next_tick_callback=doc.add_next_tick_callback)
-    if context.settings.analysis.serve.word_trends.enabled
-    else None
+# Panels are only constructed and queried once their tab is first activated, until
+# then their tab only contains a placeholder.
+tabs = Tabs(
+    tabs=[
+        Panel(title=panel_type.TITLE, child=Div(text="Loading..."))
+        for panel_type in panel_types
+    ],
+    sizing_mode="stretch_both",
 )
 
-doc.add_root(
-    Tabs(
-        tabs=[x.panel for x in filter(None, (word_freqs_panel, word_trends_panel))],
-        sizing_mode="stretch_both",
+
+def _build_panel(index: int) -> None:
+    if index in panels or not 0 <= index < len(panel_types):
+        return
+
+    _LOGGER.debug("Building panel {}.", panel_types[index].TITLE)
+    panel = panel_types[index](
+        context=context, add_next_tick_callback=doc.add_next_tick_callback
     )
+    panels[index] = panel
+    tabs.tabs = [panel.panel if i == index else tab for i, tab in enumerate(tabs.tabs)]
+
+    # Only start querying after the panel's layout was sent to the browser.
+    doc.add_next_tick_callback(panel.update)
+
+
+tabs.on_change("active", lambda _attr, _old, new: _build_panel(new))
+doc.add_root(tabs)
+_build_panel(tabs.active)
+
+
+def _on_change_context(changed_datasets: AbstractSet[str]) -> None:
+    # Called from the thread refreshing the context, so we may only schedule work on
+    # the document here. Panels that were not built yet will use the new context
+    # once they are.
+    for panel in list(panels.values()):
+        doc.add_next_tick_callback(partial(panel.on_change_context, changed_datasets))
+
+
+context.on_change(_on_change_context)
+doc.on_session_destroyed(
+    lambda _session_context: context.remove_on_change(_on_change_context)
 )
@@ -14,7 +14,7 @@
 # limitations under the License.
 #
 
-from typing import Callable
+from typing import AbstractSet, Callable
 
 from bokeh.layouts import column, row
 from bokeh.models import Div, Panel
@@ -28,51 +28,63 @@ from nasty_analysis.serve.widgets.word_freqs_widget import WordFreqsWidget
 
 
 class WordFreqsPanel:
+    TITLE = "Word Frequencies"
+
     def __init__(
         self,
         *,
         context: Context,
         add_next_tick_callback: Callable[[Callable[[], None]], None],
     ):
-        date_range_widget = DateRangeWidget(context.min_date, context.max_date)
-        date_range_widget.on_change(self._on_change)
+        self._context = context
+
+        self._date_range_widget = DateRangeWidget(context.min_date, context.max_date)
+        self._date_range_widget.on_change(self._on_change_date_range)
 
-        dataset_widget = DatasetWidget(
+        self._dataset_widget = DatasetWidget(
             context.settings.analysis.datasets,
+            context.num_docs_by_dataset,
             context.lang_freqs_by_dataset,
             context.query_freqs_by_dataset,
             context.url_netloc_freqs_by_dataset,
         )
-        dataset_widget.on_change(self._on_change)
+        self._dataset_widget.on_change(self._on_change)
 
         word_freqs_widget = WordFreqsWidget()
         word_freqs_widget.on_change(self._on_change)
 
-        num_docs_figure = NumDocsFigure(
+        self._num_docs_figure = NumDocsFigure(
             context.min_date,
             context.max_date,
-            date_range_widget,
+            self._date_range_widget,
         )
 
+        word_freqs_settings = context.settings.analysis.serve.word_freqs
         self._word_freqs_figure = WordFreqsFigure(
-            context.settings.analysis.serve.word_freqs.top_n_words,
+            word_freqs_settings.top_n_words,
+            word_freqs_settings.num_client_side_candidate_words
+            if word_freqs_settings.client_side_date_range
+            else None,
+            word_freqs_settings.preview_sample_size,
             context.min_date,
             context.max_date,
-            date_range_widget,
-            dataset_widget,
+            self._date_range_widget,
+            self._dataset_widget,
             word_freqs_widget,
-            num_docs_figure,
+            self._num_docs_figure,
+            context.aggregate_store,
+            context.local_indices,
             add_next_tick_callback,
         )
 
         self.panel = Panel(
-            title="Word Frequencies",
+            title=self.TITLE,
             child=row(
                 column(
-                    num_docs_figure.figure,
-                    row(date_range_widget.widget, margin=(0, 0, 0, 35)),
+                    self._num_docs_figure.figure,
+                    row(self._date_range_widget.widget, margin=(0, 0, 0, 35)),
                     Div(text="<hr/>", style={"width": "100%"}),
-                    dataset_widget.widget,
+                    self._dataset_widget.widget,
                     Div(text="<hr/>", style={"width": "100%"}),
                     word_freqs_widget.widget,
                     sizing_mode="stretch_height",
@@ -83,10 +95,32 @@ class WordFreqsPanel:
             ),
         )
 
-        self.update()
-
     def update(self) -> None:
+        self._context.record_activity()
         self._word_freqs_figure.update()
 
+    def on_change_context(self, changed_datasets: AbstractSet[str]) -> None:
+        self._date_range_widget.set_min_and_max_date(
+            self._context.min_date, self._context.max_date
+        )
+        self._dataset_widget.set_stats(
+            self._context.num_docs_by_dataset,
+            self._context.lang_freqs_by_dataset,
+            self._context.query_freqs_by_dataset,
+            self._context.url_netloc_freqs_by_dataset,
+        )
+        self._num_docs_figure.set_min_and_max_date(
+            self._context.min_date, self._context.max_date
+        )
+        self._word_freqs_figure.set_min_and_max_date(
+            self._context.min_date, self._context.max_date, changed_datasets
+        )
+        self.update()
+
     def _on_change(self, _attr: str, _old: object, _new: object) -> None:
         self.update()
+
+    def _on_change_date_range(self, attr: str, old: object, new: object) -> None:
+        # With client-side date ranges, the browser recomputes the word frequencies.
+        if not self._word_freqs_figure.client_side_date_range:
+            self._on_change(attr, old, new)
@@ -14,7 +14,7 @@
 # limitations under the License.
 #
 
-from typing import Callable
+from typing import AbstractSet, Callable
 
 from bokeh.layouts import column, row
 from bokeh.models import Div, Panel
@@ -27,27 +27,32 @@ from nasty_analysis.serve.widgets.word_trends_widget import WordTrendsWidget
 
 
 class WordTrendsPanel:
+    TITLE = "Word Trends"
+
     def __init__(
         self,
         *,
         context: Context,
         add_next_tick_callback: Callable[[Callable[[], None]], None],
     ):
-        date_range_widget = DateRangeWidget(context.min_date, context.max_date)
-        date_range_widget.on_change(self._on_change)
+        self._context = context
+
+        self._date_range_widget = DateRangeWidget(context.min_date, context.max_date)
+        self._date_range_widget.on_change(self._on_change)
 
-        dataset_word_widgets = []
+        self._dataset_word_widgets = []
         for _ in range(
             context.settings.analysis.serve.word_trends.num_dataset_word_widgets
         ):
             dataset_word_widget = DatasetWordsWidget(
                 context.settings.analysis.datasets,
+                context.num_docs_by_dataset,
                 context.lang_freqs_by_dataset,
                 context.query_freqs_by_dataset,
                 context.url_netloc_freqs_by_dataset,
             )
             dataset_word_widget.on_change(self._on_change)
-            dataset_word_widgets.append(dataset_word_widget)
+            self._dataset_word_widgets.append(dataset_word_widget)
 
         word_trends_widget = WordTrendsWidget()
         word_trends_widget.on_change(self._on_change)
@@ -55,21 +60,23 @@ class WordTrendsPanel:
         self._word_trends_figure = WordTrendsFigure(
             context.min_date,
             context.max_date,
-            date_range_widget,
-            dataset_word_widgets,
+            self._date_range_widget,
+            self._dataset_word_widgets,
             word_trends_widget,
+            context.aggregate_store,
+            context.local_indices,
             add_next_tick_callback,
         )
 
-        column_children = [date_range_widget.widget]
-        for dataset_word_widget in dataset_word_widgets:
+        column_children = [self._date_range_widget.widget]
+        for dataset_word_widget in self._dataset_word_widgets:
             column_children.append((Div(text="<hr/>", style={"width": "100%"})))
             column_children.append(dataset_word_widget.widget)
         column_children.append((Div(text="<hr/>", style={"width": "100%"})))
         column_children.append(word_trends_widget.widget)
 
         self.panel = Panel(
-            title="Word Trends",
+            title=self.TITLE,
             child=row(
                 column(*column_children, sizing_mode="stretch_height", width=350),
                 self._word_trends_figure.figure,
@@ -77,10 +84,25 @@ class WordTrendsPanel:
             ),
         )
 
-        self.update()
-
     def update(self) -> None:
+        self._context.record_activity()
         self._word_trends_figure.update()
 
+    def on_change_context(self, changed_datasets: AbstractSet[str]) -> None:
+        self._date_range_widget.set_min_and_max_date(
+            self._context.min_date, self._context.max_date
+        )
+        for dataset_word_widget in self._dataset_word_widgets:
+            dataset_word_widget.set_stats(
+                self._context.num_docs_by_dataset,
+                self._context.lang_freqs_by_dataset,
+                self._context.query_freqs_by_dataset,
+                self._context.url_netloc_freqs_by_dataset,
+            )
+        self._word_trends_figure.set_min_and_max_date(
+            self._context.min_date, self._context.max_date, changed_datasets
+        )
+        self.update()
+
     def _on_change(self, _attr: str, _old: object, _new: object) -> None:
         self.update()
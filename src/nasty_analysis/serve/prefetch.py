@@ -0,0 +1,181 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import fcntl
+from itertools import chain, zip_longest
+from logging import getLogger
+from threading import Event, Thread
+from time import time
+from typing import IO, AbstractSet, List, NamedTuple, Optional, Sequence, Tuple
+
+from nasty_utils import ColoredBraceStyleAdapter
+
+from nasty_analysis.serve.context import Context
+from nasty_analysis.serve.figures.num_docs_figure import NumDocsFigure
+from nasty_analysis.serve.figures.word_freqs_figure import WordFreqsFigure
+from nasty_analysis.serve.widgets.dataset_widget import DatasetWidget
+from nasty_analysis.serve.widgets.date_range_widget import DateRangeWidget
+from nasty_analysis.serve.widgets.word_freqs_widget import WordFreqsWidget
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+
+class _Selection(NamedTuple):
+    dataset_name: str
+    lang: Optional[str] = None
+    search_query: Optional[str] = None
+    url_netloc: Optional[str] = None
+
+
+class Prefetcher:
+    # Warms the aggregate store with the default selection of each dataset and then,
+    # whenever no session was active for a while, with the next most likely selections
+    # according to the frequencies by which the dataset widget's options are ordered.
+    # Selections are fetched through headless figures, so that they are stored under
+    # exactly the keys that sessions look up.
+
+    def __init__(self, context: Context):
+        self._context = context
+        self._changed = Event()
+        self._lock_file: Optional[IO[str]] = None
+
+    def start(self) -> None:
+        aggregate_store_dir = self._context.settings.analysis.serve.aggregate_store_dir
+        if self._context.aggregate_store is None or aggregate_store_dir is None:
+            _LOGGER.warning("Prefetching requires an aggregate_store_dir, disabling.")
+            return
+
+        # Each server process starts a prefetcher, but only the one holding the lock
+        # on the shared directory prefetches. The lock is held until the process
+        # exits.
+        lock_file = (aggregate_store_dir / "prefetch.lock").open("a", encoding="UTF-8")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            _LOGGER.debug("Prefetching in another process.")
+            return
+        self._lock_file = lock_file
+
+        self._context.on_change(self._on_change_context)
+        Thread(target=self._run, daemon=True).start()
+
+    def _on_change_context(self, _changed_datasets: AbstractSet[str]) -> None:
+        self._changed.set()
+
+    def _run(self) -> None:
+        while True:
+            self._prefetch_selections()
+            self._changed.wait()
+            self._changed.clear()
+
+    def _prefetch_selections(self) -> None:
+        serve_settings = self._context.settings.analysis.serve
+        num_datasets = len(self._context.settings.analysis.datasets)
+        selections = self._plan_selections()
+        for i, selection in enumerate(
+            selections[: num_datasets + serve_settings.prefetch_budget]
+        ):
+            # Start over if the context changed in the meantime, as the planned
+            # selections and stored entries might be outdated.
+            if i >= num_datasets and not self._wait_until_idle(
+                serve_settings.prefetch_idle_interval
+            ):
+                return
+
+            time_before = time()
+            try:
+                self._prefetch(selection)
+            except Exception:
+                _LOGGER.warning("Could not prefetch {}.", selection, exc_info=True)
+                continue
+            _LOGGER.debug(
+                "Prefetched {} after {:.2f}s.", selection, time() - time_before
+            )
+
+    def _wait_until_idle(self, idle_interval: int) -> bool:
+        while True:
+            remaining_secs = idle_interval - self._context.secs_since_last_activity
+            if remaining_secs <= 0:
+                return True
+            if self._changed.wait(remaining_secs):
+                return False
+
+    def _plan_selections(self) -> Sequence[_Selection]:
+        # Default selections of all datasets come first. Afterwards, each dataset's
+        # alternative options by decreasing frequency, taking turns between datasets.
+        datasets = self._context.settings.analysis.datasets
+        alternatives_per_dataset = []
+        for dataset in datasets:
+            alternatives: List[Tuple[int, _Selection]] = []
+            lang_freqs = self._context.lang_freqs_by_dataset[dataset.name]
+            for lang, freq in lang_freqs.most_common()[1:]:
+                alternatives.append((freq, _Selection(dataset.name, lang=lang)))
+            query_freqs = self._context.query_freqs_by_dataset.get(dataset.name)
+            for query, freq in (query_freqs or {}).items():
+                alternatives.append(
+                    (freq, _Selection(dataset.name, search_query=query))
+                )
+            url_netloc_freqs = self._context.url_netloc_freqs_by_dataset.get(
+                dataset.name
+            )
+            for url_netloc, freq in (url_netloc_freqs or {}).items():
+                alternatives.append(
+                    (freq, _Selection(dataset.name, url_netloc=url_netloc))
+                )
+
+            alternatives.sort(key=lambda alternative: -alternative[0])
+            alternatives_per_dataset.append(
+                [selection for _freq, selection in alternatives]
+            )
+
+        return [_Selection(dataset.name) for dataset in datasets] + [
+            selection
+            for selection in chain.from_iterable(zip_longest(*alternatives_per_dataset))
+            if selection is not None
+        ]
+
+    def _prefetch(self, selection: _Selection) -> None:
+        context = self._context
+        dataset_widget = DatasetWidget(
+            context.settings.analysis.datasets,
+            context.num_docs_by_dataset,
+            context.lang_freqs_by_dataset,
+            context.query_freqs_by_dataset,
+            context.url_netloc_freqs_by_dataset,
+        )
+        dataset_widget.select(
+            selection.dataset_name,
+            lang=selection.lang,
+            search_query=selection.search_query,
+            url_netloc=selection.url_netloc,
+        )
+        date_range_widget = DateRangeWidget(context.min_date, context.max_date)
+        word_freqs_figure = WordFreqsFigure(
+            context.settings.analysis.serve.word_freqs.top_n_words,
+            None,
+            None,
+            context.min_date,
+            context.max_date,
+            date_range_widget,
+            dataset_widget,
+            WordFreqsWidget(),
+            NumDocsFigure(context.min_date, context.max_date, date_range_widget),
+            context.aggregate_store,
+            context.local_indices,
+            lambda _callback: None,
+        )
+        word_freqs_figure.prefetch()
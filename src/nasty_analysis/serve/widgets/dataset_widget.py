@@ -18,6 +18,7 @@ from typing import (
     AbstractSet,
     Callable,
     Counter,
+    List,
     Mapping,
     MutableSequence,
     Optional,
@@ -29,6 +30,7 @@ from bokeh.models import Button, CheckboxGroup, Select, TextInput
 from elasticsearch_dsl import Search
 from nasty import SearchFilter
 
+from nasty_analysis.rollup import has_rollup, rollup_index
 from nasty_analysis.search_helper import SearchHelper
 from nasty_analysis.settings import DatasetSection, DatasetType
 
@@ -37,11 +39,13 @@ class DatasetWidget:
     def __init__(
         self,
         datasets: Sequence[DatasetSection],
+        num_docs_by_dataset: Mapping[str, int],
         lang_freqs_by_dataset: Mapping[str, Counter[str]],
         query_freqs_by_dataset: Mapping[str, Counter[str]],
         url_netloc_freqs_by_dataset: Mapping[str, Counter[str]],
     ):
         self._datasets = datasets
+        self._num_docs = num_docs_by_dataset
         self._lang_freqs = lang_freqs_by_dataset
         self._query_freqs = query_freqs_by_dataset
         self._url_netloc_freqs = url_netloc_freqs_by_dataset
@@ -135,40 +139,70 @@ class DatasetWidget:
         else:
             raise ValueError("Selected dataset does not exist.")
 
+        self._update_options(keep_values=False)
+
+        self._expanded_widget.children[2] = self._type_specific_widgets[
+            self.dataset.type
+        ]
+
+    def set_stats(
+        self,
+        num_docs_by_dataset: Mapping[str, int],
+        lang_freqs_by_dataset: Mapping[str, Counter[str]],
+        query_freqs_by_dataset: Mapping[str, Counter[str]],
+        url_netloc_freqs_by_dataset: Mapping[str, Counter[str]],
+    ) -> None:
+        self._num_docs = num_docs_by_dataset
+        self._lang_freqs = lang_freqs_by_dataset
+        self._query_freqs = query_freqs_by_dataset
+        self._url_netloc_freqs = url_netloc_freqs_by_dataset
+        self._update_options(keep_values=True)
+
+    def _update_options(self, *, keep_values: bool) -> None:
+        def set_options(select: Select, options: List[str]) -> None:
+            value = select.value
+            select.options = options
+            if not keep_values or value not in options:
+                select.value = options[0]
+
         if self._callbacks:
             self._lang.remove_on_change("value", *self._callbacks)
             self._search_query.remove_on_change("value", *self._callbacks)
             self._url_netloc.remove_on_change("value", *self._callbacks)
             self._code_identifier.remove_on_change("value", *self._callbacks)
 
-        self._lang.options = [
-            lang for lang, _freq in self._lang_freqs[self.dataset.name].most_common()
-        ]
-        self._lang.value = self._lang.options[0]
+        set_options(
+            self._lang,
+            [lang for lang, _freq in self._lang_freqs[self.dataset.name].most_common()],
+        )
 
         if self.dataset.type == DatasetType.NASTY:
-            self._search_query.options = ["*"] + [
-                q for q, _f in self._query_freqs[self.dataset.name].most_common()
-            ]
-            self._search_query.value = self._search_query.options[0]
+            set_options(
+                self._search_query,
+                ["*"]
+                + [q for q, _f in self._query_freqs[self.dataset.name].most_common()],
+            )
 
         elif (
             self.dataset.type == DatasetType.NEWS_CSV
             or self.dataset.type == DatasetType.MAXQDA_CODED_NEWS_CSV
         ):
-            self._url_netloc.options = ["*"] + [
-                u for u, _f in self._url_netloc_freqs[self.dataset.name].most_common()
-            ]
-            self._url_netloc.value = self._url_netloc.options[0]
+            set_options(
+                self._url_netloc,
+                ["*"]
+                + [
+                    u
+                    for u, _f in self._url_netloc_freqs[self.dataset.name].most_common()
+                ],
+            )
 
         if (
             self.dataset.type == DatasetType.MAXQDA_CODED_NASTY
             or self.dataset.type == DatasetType.MAXQDA_CODED_NEWS_CSV
         ):
-            self._code_identifier.options = [
-                "*"
-            ] + self._build_code_identifier_options()
-            self._code_identifier.value = self._code_identifier.options[0]
+            set_options(
+                self._code_identifier, ["*"] + self._build_code_identifier_options()
+            )
 
         if self._callbacks:
             self._lang.on_change("value", *self._callbacks)
@@ -176,10 +210,6 @@ class DatasetWidget:
             self._url_netloc.on_change("value", *self._callbacks)
             self._code_identifier.on_change("value", *self._callbacks)
 
-        self._expanded_widget.children[2] = self._type_specific_widgets[
-            self.dataset.type
-        ]
-
     def _build_code_identifier_options(self) -> Sequence[str]:
         if self.dataset.type == DatasetType.MAXQDA_CODED_NASTY:
             source = self.dataset.source_maxqda_coded_nasty
@@ -205,6 +235,24 @@ class DatasetWidget:
 
         return code_identifier_options
 
+    def select(
+        self,
+        dataset_name: str,
+        *,
+        lang: Optional[str] = None,
+        search_query: Optional[str] = None,
+        url_netloc: Optional[str] = None,
+    ) -> None:
+        # Programmatically select values, e.g., for prefetching. Values that are not
+        # given keep their defaults.
+        self._dataset_name.value = dataset_name
+        if lang is not None:
+            self._lang.value = lang
+        if search_query is not None:
+            self._search_query.value = search_query
+        if url_netloc is not None:
+            self._url_netloc.value = url_netloc
+
     def _on_click_hide_button(self) -> None:
         if self._hide_button.label == "+":
             self._hide_button.label = "−"
@@ -250,6 +298,10 @@ class DatasetWidget:
         self._code_identifier.disabled = not enabled
         self._cumulate_subcodes.disabled = not enabled
 
+    @property
+    def num_docs(self) -> int:
+        return self._num_docs[self.dataset.name]
+
     @property
     def lang(self) -> str:
         return self._lang.value
@@ -325,12 +377,24 @@ class DatasetWidget:
 
         return {code.code_identifier for code in codes_stack}
 
-    def set_search(self, search: Search) -> Search:
-        search_helper = SearchHelper(self.dataset.type)
+    @property
+    def can_use_rollup(self) -> bool:
+        # The rollup has no co-occurrences of words within documents.
+        return not self.cooccur_words and has_rollup(self.dataset.index)
+
+    def make_search_helper(self, *, rollup: bool = False) -> SearchHelper:
+        if rollup:
+            return SearchHelper(
+                self.dataset.type, rollup_index(self.dataset.index), rollup=True
+            )
+        return SearchHelper(self.dataset.type, self.dataset.index)
 
-        search = search.index(self.dataset.index).filter(
-            search_helper.query_lang_term(self._lang.value)
-        )
+    def set_search(self, search: Search, *, rollup: bool = False) -> Search:
+        search_helper = self.make_search_helper(rollup=rollup)
+
+        search = search.index(
+            rollup_index(self.dataset.index) if rollup else self.dataset.index
+        ).filter(search_helper.query_lang_term(self._lang.value))
         for cooccur_word in self.cooccur_words:
             search = search.filter(search_helper.query_text_tokens_term(cooccur_word))
 
@@ -28,12 +28,14 @@ class DatasetWordsWidget:
     def __init__(
         self,
         datasets: Sequence[DatasetSection],
+        num_docs_by_dataset: Mapping[str, int],
         lang_freqs_by_dataset: Mapping[str, Counter[str]],
         query_freqs_by_dataset: Mapping[str, Counter[str]],
         url_netloc_freqs_by_dataset: Mapping[str, Counter[str]],
     ):
         self.dataset_widget = DatasetWidget(
             datasets,
+            num_docs_by_dataset,
             lang_freqs_by_dataset,
             query_freqs_by_dataset,
             url_netloc_freqs_by_dataset,
@@ -57,6 +59,20 @@ class DatasetWordsWidget:
         self._should_num_docs.on_change("active", *callbacks)
         self._words.on_change("value", *callbacks)
 
+    def set_stats(
+        self,
+        num_docs_by_dataset: Mapping[str, int],
+        lang_freqs_by_dataset: Mapping[str, Counter[str]],
+        query_freqs_by_dataset: Mapping[str, Counter[str]],
+        url_netloc_freqs_by_dataset: Mapping[str, Counter[str]],
+    ) -> None:
+        self.dataset_widget.set_stats(
+            num_docs_by_dataset,
+            lang_freqs_by_dataset,
+            query_freqs_by_dataset,
+            url_netloc_freqs_by_dataset,
+        )
+
     def set_enabled(self, enabled: bool) -> None:
         self.dataset_widget.set_enabled(enabled)
         self._should_num_docs.disabled = not enabled
@@ -39,6 +39,25 @@ class DateRangeWidget:
     def on_change(self, *callbacks: Callable[[str, object, object], None]) -> None:
         self.slider.on_change("value_throttled", *callbacks)
 
+    def set_min_and_max_date(self, min_date: date, max_date: date) -> None:
+        old_min_date, old_max_date = self._min_date, self._max_date
+        selected_min_date, selected_max_date = self.min_and_max_date
+
+        # Keep the selection, except where it was at the bounds: then it follows the
+        # new bounds.
+        if selected_min_date <= old_min_date:
+            selected_min_date = min_date
+        if selected_max_date >= old_max_date:
+            selected_max_date = max_date
+        selected_min_date = min(max(selected_min_date, min_date), max_date)
+        selected_max_date = min(max(selected_max_date, min_date), max_date)
+
+        self._min_date = min_date
+        self._max_date = max_date
+        self.slider.start = min_date
+        self.slider.end = max_date
+        self.slider.value = (selected_min_date, selected_max_date)
+
     def set_enabled(self, enabled: bool) -> None:
         self.slider.disabled = not enabled
 
@@ -16,15 +16,30 @@
 
 from typing import Callable
 
-from bokeh.models import Div
+from bokeh.models import Select
+
+from nasty_analysis._utils.time_series import Granularity
 
 
 class WordTrendsWidget:
     def __init__(self):
-        self.widget = Div(text=type(self).__name__)
+        self._granularity = Select(
+            title="Granularity:",
+            options=[granularity.label for granularity in Granularity],
+            value=Granularity.AUTO.label,
+        )
+
+        self.widget = self._granularity
 
     def on_change(self, *callbacks: Callable[[str, object, object], None]) -> None:
-        pass
+        self._granularity.on_change("value", *callbacks)
 
     def set_enabled(self, enabled: bool) -> None:
-        pass
+        self._granularity.disabled = not enabled
+
+    @property
+    def granularity(self) -> Granularity:
+        for granularity in Granularity:
+            if granularity.label == self._granularity.value:
+                return granularity
+        raise ValueError()
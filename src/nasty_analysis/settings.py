@@ -17,7 +17,7 @@
 from datetime import date
 from enum import Enum
 from pathlib import Path
-from typing import Optional, Sequence
+from typing import Mapping, Optional, Sequence
 
 from nasty import DEFAULT_BATCH_SIZE, DEFAULT_MAX_TWEETS, SearchFilter
 from nasty_data import ElasticsearchSettings
@@ -32,6 +32,23 @@ class DatasetType(Enum):
     MAXQDA_CODED_NEWS_CSV = "MAXQDA_CODED_NEWS_CSV"
 
 
+class IndexProfile(Enum):
+    DEFAULT = "DEFAULT"
+    AGGREGATION = "AGGREGATION"
+
+
+class IndexOptions(Enum):
+    DOCS = "DOCS"
+    FREQS = "FREQS"
+    POSITIONS = "POSITIONS"
+    OFFSETS = "OFFSETS"
+
+
+class IndexPartition(Enum):
+    MONTH = "MONTH"
+    WEEK = "WEEK"
+
+
 class DatasetSourceNastySection(Settings):
     batch_file: Path
     batch_results_dir: Path
@@ -98,15 +115,49 @@ class DatasetSection(Settings):
     name: str
     index: str
     type: DatasetType
+    index_profile: IndexProfile = IndexProfile.DEFAULT
+    index_num_shards: Optional[int] = None
+    index_term_vectors: bool = True
+    index_options: IndexOptions = IndexOptions.OFFSETS
+    index_phrases: bool = False
+    index_store_orig: bool = True
+    index_partition: Optional[IndexPartition] = None
+    rollup: bool = False
     source_nasty: Optional[DatasetSourceNastySection]
     source_news_csv: Optional[DatasetSourceNewsCsvSection]
     source_maxqda_coded_nasty: Optional[DatasetSourceMaxqdaCodedNastySection]
     source_maxqda_coded_news_csv: Optional[DatasetSourceMaxqdaCodedNewsCsvSection]
 
+    @validator("index_phrases")
+    def _index_phrases_validator(
+        cls,  # noqa: N805
+        value: bool,
+        values: Mapping[str, object],
+    ) -> bool:
+        if value and values.get("index_options") not in (
+            IndexOptions.POSITIONS,
+            IndexOptions.OFFSETS,
+        ):
+            raise ValueError("Indexing phrases requires indexing positions.")
+        return value
+
+    @validator("index_partition")
+    def _index_partition_validator(
+        cls,  # noqa: N805
+        value: Optional[IndexPartition],
+        values: Mapping[str, object],
+    ) -> Optional[IndexPartition]:
+        if value is not None and values.get("type") != DatasetType.NASTY:
+            raise ValueError("Index partitions are only supported for NASTY datasets.")
+        return value
+
 
 class WordFreqsSection(Settings):
     enabled: bool = True
     top_n_words: int = 1000
+    client_side_date_range: bool = False
+    num_client_side_candidate_words: int = 10000
+    preview_sample_size: Optional[int] = 1000
 
 
 class WordTrendsSection(Settings):
@@ -114,9 +165,25 @@ class WordTrendsSection(Settings):
     num_dataset_word_widgets: int = 4
 
 
+class ServeBackend(Enum):
+    ELASTICSEARCH = "ELASTICSEARCH"
+    LOCAL = "LOCAL"
+
+
 class _ServeSection(Settings):
     address: str = "localhost"
     port: int = 5006
+    context_snapshot_file: Optional[Path] = None
+    context_refresh_interval: Optional[int] = None
+    aggregate_store_dir: Optional[Path] = None
+    aggregate_store_prune_interval: int = 60 * 60
+    aggregate_store_max_age: Optional[int] = 7 * 24 * 60 * 60
+    aggregate_store_max_size: Optional[int] = None
+    prefetch: bool = False
+    prefetch_budget: int = 20
+    prefetch_idle_interval: int = 30
+    backend: ServeBackend = ServeBackend.ELASTICSEARCH
+    local_index_dir: Optional[Path] = None
     word_freqs: WordFreqsSection
     word_trends: WordTrendsSection
 
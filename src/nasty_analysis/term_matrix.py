@@ -0,0 +1,146 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import date, timedelta
+from logging import getLogger
+from pathlib import Path
+from typing import Optional, TextIO
+
+import numpy as np
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.query import Query
+from nasty_utils import ColoredBraceStyleAdapter, date_range, format_yyyy_mm_dd
+from tqdm import tqdm
+from typing_extensions import Final
+
+from nasty_analysis.search_helper import SearchHelper
+
+_LOGGER = ColoredBraceStyleAdapter(getLogger(__name__))
+
+_COMPOSITE_PAGE_SIZE: Final[int] = 10000
+
+_TERM_MATRIX_FILE: Final[str] = "term_matrix.npz"
+_VOCABULARY_FILE: Final[str] = "vocabulary.txt"
+_DAYS_FILE: Final[str] = "days.txt"
+
+
+def dump_term_matrix(
+    output_dir: Path,
+    index: str,
+    search_helper: SearchHelper,
+    query: Optional[Query] = None,
+) -> None:
+    # Writes the number of matching documents per word and day as a sparse CSR matrix
+    # with one row per word of the vocabulary file and one column per day of the days
+    # file, in the format of scipy.sparse.save_npz(). Pages of the composite
+    # aggregation are written to disk as they arrive, so that memory stays bounded
+    # by the number of words.
+    search = Search(index=index).extra(size=0)
+    if query is not None:
+        search = search.query(query)
+
+    min_date, max_date = search_helper.read_agg_date_min_max(
+        search_helper.add_agg_date_min_max(search, gte=date(2000, 1, 1)).execute()
+    )
+    days = list(date_range(min_date, max_date))
+    search = search_helper.filter_date_range(
+        search, gte=min_date, lt=max_date + timedelta(days=1)
+    )
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / _DAYS_FILE).write_text(
+        "".join(format_yyyy_mm_dd(day) + "\n" for day in days), encoding="UTF-8"
+    )
+
+    indices_file = output_dir / (_TERM_MATRIX_FILE + ".indices.tmp")
+    data_file = output_dir / (_TERM_MATRIX_FILE + ".data.tmp")
+    with (output_dir / _VOCABULARY_FILE).open("w", encoding="UTF-8") as fvocabulary:
+        indptr = _dump_composite_pages(
+            search, search_helper, min_date, fvocabulary, indices_file, data_file
+        )
+
+    nnz = int(indptr[-1])
+    _LOGGER.debug(
+        "Writing {}x{} matrix with {} non-zero entries.",
+        len(indptr) - 1,
+        len(days),
+        nnz,
+    )
+    np.savez(
+        output_dir / _TERM_MATRIX_FILE,
+        format=np.array(b"csr"),
+        shape=np.array([len(indptr) - 1, len(days)]),
+        data=_load_tmp_array(data_file, nnz),
+        indices=_load_tmp_array(indices_file, nnz),
+        indptr=indptr,
+    )
+    indices_file.unlink()
+    data_file.unlink()
+
+
+def _dump_composite_pages(
+    search: Search,
+    search_helper: SearchHelper,
+    min_date: date,
+    fvocabulary: TextIO,
+    indices_file: Path,
+    data_file: Path,
+) -> np.ndarray:
+    # Buckets are ordered by word, so each word's row is complete once the next word
+    # starts.
+    indptr = [0]
+    nnz = 0
+    last_token = None
+    after = None
+    with indices_file.open("wb") as findices, data_file.open("wb") as fdata, tqdm(
+        desc="Dumping", unit=" buckets", dynamic_ncols=True
+    ) as progress:
+        while True:
+            response = search_helper.add_agg_text_tokens_date_composite(
+                search, _COMPOSITE_PAGE_SIZE, after
+            ).execute()
+            after, buckets = search_helper.read_agg_text_tokens_date_composite(response)
+            if not buckets:
+                break
+
+            columns = []
+            counts = []
+            for token, day, count in buckets:
+                if token != last_token:
+                    if last_token is not None:
+                        indptr.append(nnz)
+                    fvocabulary.write(token + "\n")
+                    last_token = token
+                columns.append((day - min_date).days)
+                counts.append(count)
+                nnz += 1
+            np.array(columns, dtype=np.int32).tofile(findices)
+            np.array(counts, dtype=np.int32).tofile(fdata)
+            progress.update(len(buckets))
+
+            if after is None:
+                break
+
+    if last_token is not None:
+        indptr.append(nnz)
+    return np.array(indptr, dtype=np.int64)
+
+
+def _load_tmp_array(file: Path, size: int) -> np.ndarray:
+    # Memory-mapped, so that writing the matrix file does not load it into memory.
+    if not size:
+        return np.zeros(0, dtype=np.int32)
+    return np.memmap(file, dtype=np.int32, mode="r", shape=(size,))
@@ -0,0 +1,54 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import date
+
+import numpy as np
+import pytest
+from nasty_utils import date_range
+
+from nasty_analysis._utils.time_series import Granularity, resample_per_day
+
+
+@pytest.mark.parametrize("granularity", [Granularity.WEEK, Granularity.MONTH])
+def test_resample_per_day_empty(granularity: Granularity) -> None:
+    dates = list(date_range(date(2020, 1, 1), date(2020, 1, 31)))
+    for values in (np.array([], dtype=np.int64), np.zeros((3, 0), dtype=np.int64)):
+        buckets, resampled = resample_per_day(dates, values, granularity)
+        assert buckets == []
+        assert resampled.shape == values.shape
+
+    buckets, resampled = resample_per_day([], np.array([]), granularity)
+    assert buckets == []
+    assert resampled.shape == (0,)
+
+
+def test_resample_per_day_week() -> None:
+    # 2020-01-01 is a Wednesday, weeks start on Mondays.
+    dates = list(date_range(date(2020, 1, 1), date(2020, 1, 14)))
+    values = np.arange(len(dates))
+    buckets, resampled = resample_per_day(dates, values, Granularity.WEEK)
+    assert buckets == [date(2019, 12, 30), date(2020, 1, 6), date(2020, 1, 13)]
+    assert resampled.tolist() == [sum(range(5)), sum(range(5, 12)), 12 + 13]
+
+
+def test_resample_per_day_month() -> None:
+    dates = list(date_range(date(2020, 1, 30), date(2020, 3, 1)))
+    values = np.ones((2, len(dates)), dtype=np.int64)
+    values[1] *= 2
+    buckets, resampled = resample_per_day(dates, values, Granularity.MONTH)
+    assert buckets == [date(2020, 1, 1), date(2020, 2, 1), date(2020, 3, 1)]
+    assert resampled.tolist() == [[2, 29, 1], [4, 58, 2]]
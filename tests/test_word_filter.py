@@ -0,0 +1,69 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import re
+from typing import Iterator, List, Mapping
+
+import pytest
+from elasticsearch_dsl import Search
+
+from nasty_analysis.local_index import LocalIndex
+from nasty_analysis.search_helper import SearchHelper
+from nasty_analysis.serve.figures.word_freqs_figure import (
+    _get_word_filter_include_exclude,
+)
+from nasty_analysis.serve.widgets.word_freqs_widget import WordFilter
+from nasty_analysis.settings import DatasetType
+
+_WORDS = ["#corona", "@who", "corona", "a#b", "a@b", "#", "@", ""]
+
+
+def _find_terms_includes(o: object) -> Iterator[object]:
+    if isinstance(o, Mapping):
+        if "terms" in o:
+            yield o["terms"].get("include")
+        for value in o.values():
+            yield from _find_terms_includes(value)
+
+
+@pytest.mark.parametrize(
+    "word_filter,expected",
+    [
+        (WordFilter.ONLY_HASHTAGS, ["#corona", "#"]),
+        (WordFilter.ONLY_MENTIONS, ["@who", "@"]),
+    ],
+)
+def test_word_filter_include_local_index(
+    word_filter: WordFilter, expected: List[str]
+) -> None:
+    include, _exclude = _get_word_filter_include_exclude(word_filter, "en")
+    matches = LocalIndex._matches_terms(include, default=True)
+    assert [word for word in _WORDS if matches(word)] == expected
+
+
+@pytest.mark.parametrize(
+    "word_filter", [WordFilter.ONLY_HASHTAGS, WordFilter.ONLY_MENTIONS]
+)
+def test_word_filter_include_elasticsearch(word_filter: WordFilter) -> None:
+    include, _exclude = _get_word_filter_include_exclude(word_filter, "en")
+    search = SearchHelper(DatasetType.NASTY).add_agg_text_tokens_terms(
+        Search(), size=10, include=include
+    )
+    assert list(_find_terms_includes(search.to_dict())) == [include]
+
+    # In Lucene's regular expressions # and @ are operators unless they are part of a
+    # character class.
+    assert not re.search("[#@]", re.sub(r"\[[^\]]*\]", "", include))